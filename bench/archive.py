@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# Times MultiFile archive builds over a synthetic directory tree.
+#
+#   python bench/archive.py [--files N] [--size KiB] [--workers 1,4]
+#                           [--archive-memory MiB] [--json]
+#
+# Half of the files are compressible text and half random data, spread over
+# nested directories. Archives up to --archive-memory MiB are built in memory,
+# pass 0 to time building them on disk.
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from platter.server import Catalog
+
+WORDS = b"lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor ".split()
+
+def make_tree(root, files, size, fanout=8):
+    for i in range(files):
+        directory = os.path.join(root, *("d%d" % (i//fanout**depth % fanout) for depth in (2, 1)))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "f%d" % i), "wb") as f:
+            if i % 2:
+                f.write(os.urandom(size))
+            else:
+                line = b" ".join(WORDS[(i + j) % len(WORDS)] for j in range(12)) + b"\n"
+                f.write((line*(size//len(line) + 1))[:size])
+
+def build(catalog, root):
+    cpu = time.process_time()
+    start = time.monotonic()
+    f = catalog.serve([root])
+    f.wait()
+    elapsed = time.monotonic() - start
+    cpu = time.process_time() - cpu
+    size = f.size
+    f.stop()
+    return elapsed, cpu, size
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--size", type=int, default=256, metavar="KiB", help="size of each file")
+    parser.add_argument("--workers", default="1,%d" % (os.cpu_count() or 1),
+                        help="comma separated worker counts to try")
+    parser.add_argument("--archive-memory", type=int, default=32, metavar="MiB")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        make_tree(root, args.files, args.size << 10)
+        input_bytes = args.files*(args.size << 10)
+        for workers in sorted({int(w) for w in args.workers.split(",")}):
+            catalog = Catalog(archive_workers=workers, archive_memory=args.archive_memory << 20,
+                              memory_budget=max(args.archive_memory, 256) << 20)
+            runs = [build(catalog, root) for _ in range(args.runs)]
+            seconds = statistics.median(r[0] for r in runs)
+            results["workers_%d" % workers] = {
+                "seconds": seconds,
+                "throughput_mib_s": input_bytes/seconds/(1 << 20),
+                "cpu_ns_per_byte": statistics.median(r[1] for r in runs)/input_bytes*1e9,
+                "archive_bytes": runs[0][2],
+            }
+
+    report = {
+        "files": args.files,
+        "input_bytes": input_bytes,
+        "archive_memory_mib": args.archive_memory,
+        "python": sys.version.split()[0],
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        for name, result in results.items():
+            print("%-10s %7.2f s  %8.1f MiB/s  %6.2f ns/B  %d bytes" % (
+                name, result["seconds"], result["throughput_mib_s"],
+                result["cpu_ns_per_byte"], result["archive_bytes"],
+            ))
+
+if __name__ == "__main__":
+    main()
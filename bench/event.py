@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# Measures the per-call cost of Observable.trigger.
+#
+#   python bench/event.py [--json]
+
+import os
+import sys
+import json
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from platter.event import Observable
+
+class Source(Observable):
+    pass
+
+def bench(subscribers, all_subscribers=0, number=200000, repeat=5):
+    obs = Source()
+    for _ in range(subscribers):
+        obs.on("progress", lambda *a: None)
+    for _ in range(all_subscribers):
+        obs.on("all", lambda *a: None)
+    timer = timeit.Timer(lambda: obs.trigger("progress", 1))
+    return min(timer.repeat(repeat, number))/number
+
+def main():
+    results = {}
+    for subscribers, all_subscribers in ((0, 0), (1, 0), (3, 0), (1, 1)):
+        name = "trigger_%d_%d" % (subscribers, all_subscribers)
+        results[name] = bench(subscribers, all_subscribers)*1e9
+    if "--json" in sys.argv:
+        json.dump({"unit": "ns/trigger", "results": results}, sys.stdout, indent=2)
+        print()
+    else:
+        for name, ns in results.items():
+            print("%-16s %8.1f ns" % (name, ns))
+
+if __name__ == "__main__":
+    main()
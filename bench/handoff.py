@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# Measures how long `platter FILE` takes to hand FILE to a running instance
+# (over the control socket) and exit.
+#
+#   python bench/handoff.py [--json] [--runs N]
+
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def wait_for(path, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.socket(socket.AF_UNIX) as sock:
+                sock.connect(path)
+            return True
+        except OSError:
+            time.sleep(0.005)
+    return False
+
+def main():
+    runs = int(sys.argv[sys.argv.index("--runs") + 1]) if "--runs" in sys.argv else 10
+    with tempfile.TemporaryDirectory() as runtime:
+        env = dict(os.environ, XDG_RUNTIME_DIR=runtime)
+        server = subprocess.Popen(
+            [sys.executable, "-m", "platter", "--no-dbus", "--bind", "127.0.0.1", "--port", "0"],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            if not wait_for(os.path.join(runtime, "platter.sock")):
+                raise RuntimeError("server didn't start")
+            times = []
+            for _ in range(runs):
+                start = time.monotonic()
+                subprocess.check_call([sys.executable, "-m", "platter.qt", __file__], cwd=ROOT, env=env)
+                times.append((time.monotonic() - start)*1e3)
+        finally:
+            server.terminate()
+            server.wait()
+
+    results = {"median_ms": statistics.median(times), "min_ms": min(times)}
+    if "--json" in sys.argv:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print("handoff  median %.1f ms  min %.1f ms" % (results["median_ms"], results["min_ms"]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# Drives an in-process server (no Qt) with concurrent clients and reports
+# throughput, latency percentiles and CPU time per byte.
+#
+#   python bench/load.py [--engine asyncio] [--workers N] [--scenario small,large,...]
+#                        [--clients N] [--large-size MiB] [--json] [--compare OLD.json]
+#
+# Scenarios:
+#   small     many clients fetching a 64 KiB file
+#   large     a few clients fetching a large (sparse) file
+#   multiget  clients fetching bundled multiget URLs (/1-3)
+#   cancel    clients that hang up part way through the large file
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from platter.options import ENGINES
+from platter.server import make_server
+
+SCENARIOS = ("small", "large", "multiget", "cancel")
+SMALL_SIZE = 64 << 10
+RECV_SIZE = 1 << 20
+
+def fetch(port, path, limit=None):
+    # Returns (time to first byte, total time, body bytes read).
+    buf = bytearray(RECV_SIZE)
+    start = time.monotonic()
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        sock.sendall(("GET %s HTTP/1.0\r\nHost: localhost\r\n\r\n" % path).encode("ascii"))
+        first = None
+        received = 0
+        while limit is None or received < limit:
+            n = sock.recv_into(buf)
+            if not n:
+                break
+            if first is None:
+                first = time.monotonic()
+            received += n
+    end = time.monotonic()
+    return (first or end) - start, end - start, received
+
+def run(port, paths, clients, requests, limit=None):
+    results = []
+    lock = threading.Lock()
+    def client(i):
+        for j in range(requests):
+            result = fetch(port, paths[(i + j) % len(paths)], limit)
+            with lock:
+                results.append(result)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    cpu = time.process_time()
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+    cpu = time.process_time() - cpu
+
+    total = sum(r[2] for r in results)
+    latencies = sorted(r[1] for r in results)
+    ttfb = sorted(r[0] for r in results)
+    return {
+        "requests": len(results),
+        "bytes": total,
+        "seconds": elapsed,
+        "throughput_mib_s": total/elapsed/(1 << 20),
+        "requests_s": len(results)/elapsed,
+        "latency_p50_ms": percentile(latencies, 50)*1e3,
+        "latency_p99_ms": percentile(latencies, 99)*1e3,
+        "ttfb_p50_ms": percentile(ttfb, 50)*1e3,
+        "ttfb_p99_ms": percentile(ttfb, 99)*1e3,
+        # Client and server share the process, so this covers both (but not
+        # --workers processes).
+        "cpu_ns_per_byte": cpu/total*1e9 if total else None,
+    }
+
+def percentile(values, p):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values)*p/100))]
+
+def make_files(directory, large_size):
+    small = os.path.join(directory, "small")
+    with open(small, "wb") as f:
+        f.write(os.urandom(SMALL_SIZE))
+    large = os.path.join(directory, "large")
+    with open(large, "wb") as f:
+        f.truncate(large_size)
+    return small, large
+
+def bench(args):
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        small, large = make_files(directory, args.large_size << 20)
+        server = make_server(args.engine, ("127.0.0.1", 0), bundle_multiget=True,
+                             workers=args.workers)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            fsmall = server.serve([small])
+            flarge = server.serve([large])
+            members = [server.serve([small]) for _ in range(3)]
+            for f in (fsmall, flarge, *members):
+                f.wait()
+            multiget = "/%d-%d" % (members[0].fid, members[-1].fid)
+
+            for scenario in args.scenarios:
+                if scenario == "small":
+                    result = run(server.server_port, ["/%d" % fsmall.fid], args.clients, args.requests)
+                elif scenario == "large":
+                    result = run(server.server_port, ["/%d" % flarge.fid], args.large_clients, 1)
+                elif scenario == "multiget":
+                    result = run(server.server_port, [multiget], args.clients, args.requests)
+                elif scenario == "cancel":
+                    result = run(server.server_port, ["/%d" % flarge.fid], args.clients, 1,
+                                 limit=min(flarge.size//2, 4 << 20))
+                results[scenario] = result
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+    return results
+
+def compare(old, new):
+    for scenario, result in new.items():
+        if scenario not in old:
+            continue
+        for key in ("throughput_mib_s", "latency_p50_ms", "latency_p99_ms", "cpu_ns_per_byte"):
+            before, after = old[scenario].get(key), result.get(key)
+            if before and after:
+                print("%-10s %-18s %10.2f -> %10.2f  (%+.1f%%)" % (
+                    scenario, key, before, after, (after - before)/before*100
+                ))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engine", choices=ENGINES, default="threads")
+    parser.add_argument("--scenario", default=",".join(SCENARIOS),
+                        help="comma separated subset of: %s" % ", ".join(SCENARIOS))
+    parser.add_argument("--workers", type=int, default=1, help="server processes")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=10, help="requests per client")
+    parser.add_argument("--large-clients", type=int, default=4)
+    parser.add_argument("--large-size", type=int, default=1024, metavar="MiB")
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--compare", metavar="FILE", help="results of an earlier --json run")
+    args = parser.parse_args()
+    args.scenarios = [s for s in args.scenario.split(",") if s]
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            parser.error("unknown scenario: %s" % scenario)
+
+    results = bench(args)
+    report = {
+        "engine": args.engine,
+        "workers": args.workers,
+        "python": sys.version.split()[0],
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        for scenario, result in results.items():
+            print("%-10s %8.1f MiB/s %8.1f req/s  p50 %7.1f ms  p99 %7.1f ms  %s ns/B" % (
+                scenario, result["throughput_mib_s"], result["requests_s"],
+                result["latency_p50_ms"], result["latency_p99_ms"],
+                "%.2f" % result["cpu_ns_per_byte"] if result["cpu_ns_per_byte"] else "-",
+            ))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f)["results"], results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# Measures how long the headless server takes from exec to accepting
+# connections, and checks that it doesn't drag in the GUI stack.
+#
+#   python bench/startup.py [--json] [--runs N]
+
+import os
+import sys
+import json
+import time
+import socket
+import statistics
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+GUI_MODULES = ("PyQt5", "PIL", "qrcode")
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_for(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.001)
+    return False
+
+def start_once():
+    port = free_port()
+    start = time.monotonic()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "platter", "--no-dbus", "--bind", "127.0.0.1", "--port", str(port)],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        if not wait_for(port):
+            raise RuntimeError("server didn't start")
+        return time.monotonic() - start
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def gui_imports():
+    code = "import sys, platter.cli, platter.server; print(' '.join(sorted(sys.modules)))"
+    out = subprocess.check_output([sys.executable, "-c", code], cwd=ROOT).decode()
+    loaded = set(out.split())
+    return [name for name in GUI_MODULES if name in loaded]
+
+def main():
+    runs = int(sys.argv[sys.argv.index("--runs") + 1]) if "--runs" in sys.argv else 10
+    times = [start_once()*1e3 for _ in range(runs)]
+    results = {
+        "median_ms": statistics.median(times),
+        "min_ms": min(times),
+        "gui_imports": gui_imports(),
+    }
+    if "--json" in sys.argv:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print("startup  median %.1f ms  min %.1f ms" % (results["median_ms"], results["min_ms"]))
+        print("gui modules loaded: %s" % (", ".join(results["gui_imports"]) or "none"))
+
+if __name__ == "__main__":
+    main()
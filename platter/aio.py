@@ -0,0 +1,517 @@
+import asyncio
+import socket
+import threading
+from email.parser import Parser
+from email.utils import formatdate
+from http import HTTPStatus
+from http.client import HTTPMessage
+
+from .progress import Transfer
+from .metrics import METRICS_PATH, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from .digest import render_checksum, SUFFIX as CHECKSUM_SUFFIX, CONTENT_TYPE as CHECKSUM_CONTENT_TYPE
+from .upload import (UPLOAD_PATH, UPLOAD_CHUNK, upload_name, body_length, parse_chunk_size,
+                     render_upload_page, Incoming, BadRequest)
+from .options import MAX_TRANSFERS
+from .remote import Tail, POLL_INTERVAL
+from .server import Catalog, plan_response, render_multiget, render_unavailable, SENDFILE_SIZE, STREAM
+
+__all__ = ("AsyncServer", "AsyncRequest")
+
+MAX_HEADER_SIZE = 64 << 10
+# How much a connection's reader buffers before it stops reading the socket,
+# large enough that an upload isn't read in dribs.
+READ_AHEAD = UPLOAD_CHUNK
+
+class AsyncRequest(Transfer):
+    # The asyncio equivalent of server.Request. It triggers the same events
+    # so the rest of platter can't tell the two apart.
+    file = None
+    received = None
+
+    def __init__(self, server, reader, writer):
+        super().__init__()
+        self.server = server
+        self.progress_rate = server.progress_rate
+        self.bandwidth = server.bandwidth
+        self.metrics = server.metrics
+        self.reader = reader
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+        self.client_address = writer.get_extra_info("peername")[:2]
+
+    async def handle(self):
+        try:
+            try:
+                head = await asyncio.wait_for(self.reader.readuntil(b"\r\n\r\n"), self.server.timeout)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                return
+            if len(head) > MAX_HEADER_SIZE:
+                return
+            try:
+                request_line, _, header_text = head.decode("iso-8859-1").partition("\r\n")
+                method, path, version = request_line.split(" ", 2)
+            except ValueError:
+                await self.send_error(400)
+                return
+            self.headers = Parser(_class=HTTPMessage).parsestr(header_text)
+
+            if method == "GET":
+                await self.do_GET(path)
+            elif method == "HEAD":
+                await self.do_GET(path, head=True)
+            elif method in ("PUT", "POST"):
+                await self.do_PUT(path, version)
+            else:
+                await self.send_error(501)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.writer.close()
+
+    async def _send_content(self, content_type, content, head):
+        self.send_head(200, [("Content-Type", content_type), ("Content-Length", len(content))])
+        if not head:
+            self.writer.write(content)
+        await self._drain()
+
+    async def do_GET(self, path, head=False):
+        if path == METRICS_PATH and self.server.metrics is not None:
+            await self._send_content(METRICS_CONTENT_TYPE, self.server.metrics.render(), head)
+            return
+
+        if path.endswith(CHECKSUM_SUFFIX):
+            await self.send_checksum(path, head)
+            return
+
+        if path == UPLOAD_PATH and self.server.upload_dir is not None:
+            await self._send_content("text/html; charset=utf-8", render_upload_page(), head)
+            return
+
+        self.file, multiget = self.server.lookup(path)
+
+        if multiget:
+            await self._send_content("text/html", render_multiget(multiget).encode('utf-8'), head)
+            return
+
+        if self.file is None:
+            await self.send_error(404, head)
+            return
+
+        # Probes and revalidations of loaded files don't show up as transfers.
+        response = None
+        if head or self.file.loaded:
+            if not await self.wait_loaded():
+                await self._send_unavailable()
+                return
+            if self.file.failed:
+                await self.send_error(404, head)
+                return
+            response = await self._plan_response(head)
+            if response is None:
+                return
+            if head or response.status == 304:
+                self.send_head(response.status, response.headers)
+                await self._drain()
+                return
+
+        try:
+            self.file._register_request(self)
+
+            # Waiting clients hold one of max_transfers slots.
+            if not await self.wait_loaded():
+                self.trigger("failure")
+                await self._send_unavailable()
+                return
+            if self.file.failed:
+                raise IOError("%s failed to load" % self.file.name)
+
+            self.trigger("start")
+
+            if response is None:
+                response = await self._plan_response(head)
+                if response is None:
+                    return
+            self.send_head(response.status, response.headers)
+
+            if response.status == 416:
+                await self._drain()
+                self.trigger("failure")
+                return
+
+            self._begin(response.length)
+            with response.open() as fobj:
+                for part in response.body:
+                    if isinstance(part, bytes):
+                        self.writer.write(part)
+                        await self._drain()
+                        self._sent(len(part))
+                    elif part is STREAM:
+                        if not await self._copy_stream(fobj):
+                            return
+                    elif not await self._copy(fobj, *part):
+                        return
+        except:
+            self.trigger("failure")
+        else:
+            self._done()
+            self.trigger("success")
+        finally:
+            self._end()
+
+    # Disk writes go through an executor in blocks of UPLOAD_CHUNK bytes.
+    async def do_PUT(self, path, version):
+        name = upload_name(path) if self.server.upload_dir is not None else None
+        if name is None:
+            await self.send_error(404)
+            return
+        try:
+            length = body_length(self.headers)
+        except BadRequest as e:
+            await self.send_error(e.status)
+            return
+        if self.headers.get("Expect", "").lower() == "100-continue" and version != "HTTP/1.0":
+            self.writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+        self.bandwidth = None
+        self.metrics = None
+        try:
+            upload = Incoming(self.server.upload_dir, name)
+        except OSError:
+            await self.send_error(500)
+            return
+        self.server.trigger("upload", self)
+        self.trigger("start")
+        # Keep reading while the previous block is written out.
+        writing = None
+        try:
+            self._begin(length or 0)
+            # The pieces are handed over as they are rather than copied into one block.
+            pending = []
+            pending_size = 0
+            async for piece in self._body(length):
+                if self.canceled:
+                    raise ConnectionError("Canceled")
+                pending.append(piece)
+                pending_size += len(piece)
+                self._sent(len(piece))
+                if pending_size >= UPLOAD_CHUNK:
+                    if writing is not None:
+                        await writing
+                    writing = self.loop.run_in_executor(None, upload.writelines, pending)
+                    pending = []
+                    pending_size = 0
+            if writing is not None:
+                await writing
+                writing = None
+            await self.loop.run_in_executor(None, upload.writelines, pending)
+            path = await self.loop.run_in_executor(None, upload.finish)
+        except (BadRequest, OSError, asyncio.TimeoutError) as e:
+            await self._settle(writing)
+            upload.discard()
+            self.trigger("failure")
+            if not isinstance(e, (ConnectionError, asyncio.TimeoutError)):
+                await self.send_error(e.status if isinstance(e, BadRequest) else 500)
+            return
+        except BaseException:
+            await self._settle(writing)
+            upload.discard()
+            self.trigger("failure")
+            raise
+        finally:
+            self._end()
+        self._done()
+
+        self.received = await self.loop.run_in_executor(None, self.server.receive, self, path)
+        content = (self.received.url + "\n").encode("utf-8")
+        self.send_head(201, [
+            ("Location", "/%d" % self.received.fid),
+            ("Content-Type", "text/plain; charset=utf-8"),
+            ("Content-Length", len(content)),
+        ])
+        self.writer.write(content)
+        await self._drain()
+        self.trigger("success")
+
+    async def _settle(self, future):
+        if future is not None:
+            try:
+                await asyncio.shield(future)
+            except BaseException:
+                pass
+
+    async def _body(self, length):
+        if length is not None:
+            async for piece in self._read_body(length):
+                yield piece
+            return
+        while True:
+            size = parse_chunk_size(await self._readline())
+            if not size:
+                break
+            async for piece in self._read_body(size):
+                yield piece
+            if (await self._readline()).strip():
+                raise BadRequest(400, "Bad chunk")
+        # Trailers
+        while (await self._readline()).strip():
+            pass
+
+    async def _readline(self):
+        try:
+            return await asyncio.wait_for(self.reader.readuntil(b"\n"), self.server.timeout)
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("Upload cut short")
+        except asyncio.LimitOverrunError:
+            raise BadRequest(400, "Bad chunk")
+
+    async def _read_body(self, count):
+        while count:
+            data = await asyncio.wait_for(self.reader.read(min(count, UPLOAD_CHUNK)), self.server.timeout)
+            if not data:
+                raise ConnectionError("Upload cut short")
+            count -= len(data)
+            yield data
+
+    async def send_checksum(self, path, head):
+        self.file, _ = self.server.lookup(path[:-len(CHECKSUM_SUFFIX)])
+        future = None
+        if self.file is not None:
+            if not await self.wait_loaded():
+                await self._send_unavailable()
+                return
+            try:
+                future = self.file.checksum()
+            except OSError:
+                pass
+        if future is None:
+            await self.send_error(404, head)
+            return
+        try:
+            # Shielded, the future is shared with other clients.
+            digest = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.server.timeout)
+        except asyncio.TimeoutError:
+            await self._send_unavailable()
+            return
+        if digest is None:
+            await self.send_error(503, head)
+            return
+        await self._send_content(CHECKSUM_CONTENT_TYPE, render_checksum(digest, self.file.name), head)
+
+    # Returns False if the file still isn't loaded after the server's timeout.
+    async def wait_loaded(self):
+        # Don't tie up an executor thread per client while an archive builds.
+        if self.file.loaded:
+            return True
+        loaded = self.loop.create_future()
+        def on_load():
+            self.loop.call_soon_threadsafe(lambda: loaded.done() or loaded.set_result(None))
+        self.file.on("load", on_load)
+        try:
+            if not self.file.loaded:
+                await asyncio.wait_for(loaded, self.server.timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.file.off("load", on_load)
+        return True
+
+    # Sends a 404 instead (and returns None) if the file has been deleted or
+    # can't be read since it was served.
+    async def _plan_response(self, head):
+        try:
+            return plan_response(self.file, self.headers)
+        except OSError:
+            self.trigger("failure")
+            await self.send_error(404, head)
+            return None
+
+    async def _send_unavailable(self):
+        self.writer.write(render_unavailable(self.server.retry_after))
+        await self._drain()
+
+    # Returns False if the request was canceled part way through.
+    async def _copy(self, fobj, offset, count):
+        try:
+            fobj.fileno()
+        except (AttributeError, OSError):
+            return await self._copy_buffered(fobj, offset, count)
+        return await self._copy_sendfile(fobj, offset, count)
+
+    async def _copy_sendfile(self, fobj, offset, count):
+        # loop.sendfile falls back on reading the file if os.sendfile fails.
+        end = offset + count
+        while offset < end:
+            if self.canceled:
+                return False
+            chunk = min(self._chunk_size(SENDFILE_SIZE), end - offset)
+            await self._throttle(chunk)
+            sent = await asyncio.wait_for(
+                self.loop.sendfile(self.writer.transport, fobj, offset, chunk), self.server.timeout
+            )
+            if not sent:
+                raise IOError("Unexpected end of file")
+            offset += sent
+            self._sent(sent)
+        return True
+
+    async def _copy_buffered(self, fobj, offset, count):
+        # Streams may block on the disk, read them from an executor.
+        if offset:
+            fobj.seek(offset)
+        while count > 0:
+            size = min(self._chunk_size(SENDFILE_SIZE), count)
+            if isinstance(fobj, Tail):
+                buf = await self._read_tail(fobj, size)
+            else:
+                buf = await self.loop.run_in_executor(None, fobj.read, size)
+            if not buf:
+                raise IOError("Unexpected end of file")
+            if self.canceled:
+                return False
+            await self._throttle(len(buf))
+            self.writer.write(buf)
+            await self._drain()
+            count -= len(buf)
+            self._sent(len(buf))
+        return True
+
+    # Waits for a download on the loop, rather than holding an executor
+    # thread for as long as the download takes.
+    async def _read_tail(self, fobj, size):
+        buf = fobj.read_nowait(size)
+        if buf is not None:
+            return buf
+        # Another process's download can only be polled.
+        listen = getattr(fobj.source, "listen", None)
+        grown = asyncio.Event()
+        def on_grow():
+            self.loop.call_soon_threadsafe(grown.set)
+        if listen is not None:
+            listen(on_grow)
+        try:
+            while True:
+                grown.clear()
+                buf = fobj.read_nowait(size)
+                if buf is not None:
+                    return buf
+                if listen is not None:
+                    await grown.wait()
+                else:
+                    await asyncio.sleep(POLL_INTERVAL)
+        finally:
+            if listen is not None:
+                fobj.source.unlisten(on_grow)
+
+    # Progress is measured in bytes consumed from the underlying file.
+    async def _copy_stream(self, fobj):
+        consumed = 0
+        while True:
+            buf = await self.loop.run_in_executor(None, fobj.read, SENDFILE_SIZE)
+            if not buf:
+                return True
+            if self.canceled:
+                return False
+            await self._throttle(len(buf))
+            self.writer.write(buf)
+            await self._drain()
+            self._sent(fobj.consumed - consumed)
+            consumed = fobj.consumed
+
+    # A client that stops reading for the server's timeout fails the transfer.
+    async def _drain(self):
+        await asyncio.wait_for(self.writer.drain(), self.server.timeout)
+
+    async def _throttle(self, nbytes):
+        delay = self._delay(nbytes)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def send_head(self, status, headers):
+        status = HTTPStatus(status)
+        lines = ["HTTP/1.0 %d %s" % (status, status.phrase)]
+        lines.append("Server: Platter")
+        lines.append("Date: %s" % formatdate(usegmt=True))
+        lines.extend("%s: %s" % header for header in headers)
+        lines.append("Connection: close")
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1", "strict"))
+
+    async def send_error(self, status, head=False):
+        status = HTTPStatus(status)
+        content = ("<p>Error %d: %s</p>" % (status, status.phrase)).encode("utf-8")
+        self.send_head(status, [("Content-Type", "text/html"), ("Content-Length", len(content))])
+        if not head:
+            self.writer.write(content)
+        await self._drain()
+
+    def cancel(self):
+        # May be called from any thread.
+        self.canceled = True
+        self.loop.call_soon_threadsafe(self.writer.transport.abort)
+        if self.file is not None:
+            self.file._unregister_request(self)
+
+class AsyncServer(Catalog):
+    # Serves every connection from a single asyncio event loop instead of a
+    # thread per connection. It has the same interface as server.Server.
+
+    request_class = AsyncRequest
+
+    def __init__(self, address=("", 10700), backlog=1024, reuse_port=False,
+                 max_transfers=MAX_TRANSFERS["asyncio"], **options):
+        Catalog.__init__(self, max_transfers=max_transfers, **options)
+        # Bind right away so that file URLs are valid before serve_forever.
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.socket.bind(address)
+        self.socket.listen(backlog)
+        self.server_address = self.socket.getsockname()
+        self.server_port = self.server_address[1]
+        self._loop = None
+        self._stop = None
+        self._stopped = threading.Event()
+        self._slots = None
+        self._queued = 0
+
+    def serve_forever(self):
+        self._stopped.clear()
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._stopped.set()
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_transfers)
+        server = await asyncio.start_server(self._handle, sock=self.socket, limit=READ_AHEAD)
+        async with server:
+            await self._stop.wait()
+
+    # At most max_transfers connections are handled at once and max_queued
+    # wait their turn, the rest get a 503.
+    async def _handle(self, reader, writer):
+        if self._slots.locked() and self._queued >= self.max_queued:
+            if self.metrics is not None:
+                self.metrics.reject()
+            writer.write(render_unavailable(self.retry_after))
+            writer.close()
+            return
+        self._queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._queued -= 1
+        try:
+            await self.request_class(self, reader, writer).handle()
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+            self._stopped.wait()
+
+    def server_close(self):
+        self.socket.close()
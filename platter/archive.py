@@ -0,0 +1,390 @@
+import io
+import os
+import hashlib
+import itertools
+import time
+import struct
+import zlib
+from collections import namedtuple, deque
+from functools import partial
+from io import DEFAULT_BUFFER_SIZE as BUF_SIZE
+from tempfile import SpooledTemporaryFile
+
+__all__ = ("Entry", "ZipStream", "ArchiveBuilder", "arcname", "compressible")
+
+# Record layouts (see PKWARE's APPNOTE.TXT).
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+DATA_DESCRIPTOR = struct.Struct("<IIII")
+DATA_DESCRIPTOR64 = struct.Struct("<IIQQ")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+END_RECORD = struct.Struct("<IHHHHIIH")
+END_RECORD64 = struct.Struct("<IQHHIIQQQQ")
+END_LOCATOR64 = struct.Struct("<IIQI")
+EXTRA_HEADER = struct.Struct("<HH")
+
+LOCAL_HEADER_SIG = 0x04034b50
+DATA_DESCRIPTOR_SIG = 0x08074b50
+CENTRAL_HEADER_SIG = 0x02014b50
+END_RECORD_SIG = 0x06054b50
+END_RECORD64_SIG = 0x06064b50
+END_LOCATOR64_SIG = 0x07064b50
+ZIP64_EXTRA = 0x0001
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+STORED = 0
+DEFLATED = 8
+
+VERSION = 20
+VERSION64 = 45
+MADE_BY_UNIX = 3 << 8
+
+ZIP32_MAX = 0xFFFFFFFF
+ZIP32_MAX_ENTRIES = 0xFFFF
+
+CHUNK_SIZE = 1 << 20
+SPOOL_SIZE = 4 << 20
+SAMPLE_SIZE = 64 << 10
+# Don't bother deflating samples that don't shrink below this ratio.
+MIN_RATIO = 0.9
+
+# Formats that are already compressed (or encrypted) and won't shrink.
+STORE_EXTENSIONS = frozenset((
+    # Images
+    "jpg", "jpeg", "png", "gif", "webp", "heic", "heif", "avif", "jxl",
+    # Audio/Video
+    "mp3", "m4a", "aac", "ogg", "oga", "opus", "flac", "mp4", "m4v", "mkv",
+    "webm", "mov", "avi", "wmv",
+    # Archives
+    "zip", "gz", "tgz", "bz2", "tbz2", "xz", "txz", "lz", "lzma", "lz4",
+    "zst", "7z", "rar", "cab", "jar", "apk", "deb", "rpm", "whl", "squashfs",
+    # Documents (zipped containers)
+    "docx", "xlsx", "pptx", "odt", "ods", "odp", "epub", "pdf",
+    # Other
+    "gpg", "pgp", "iso",
+))
+
+class Entry(namedtuple("Entry", ("name", "size", "mtime", "open"))):
+    __slots__ = ()
+
+    @classmethod
+    def from_path(cls, path, st=None):
+        if st is None:
+            st = os.stat(path)
+        return cls(arcname(path), st.st_size, st.st_mtime, partial(open, path, "rb"))
+
+def arcname(path):
+    # Same naming scheme as ZipFile.write()
+    name = os.path.normpath(os.path.splitdrive(path)[1])
+    while name[0] in (os.sep, os.altsep):
+        name = name[1:]
+    return name
+
+def compressible(name, fobj=None):
+    ext = name.rpartition(".")[2].lower()
+    if ext in STORE_EXTENSIONS:
+        return False
+    if fobj is None:
+        return True
+    # Try a quick deflate of the beginning of the file to catch high-entropy
+    # data with an unknown extension.
+    sample = fobj.read(SAMPLE_SIZE)
+    if len(sample) < 1024:
+        return True
+    return len(zlib.compress(sample, 1)) < len(sample) * MIN_RATIO
+
+def dos_time(mtime):
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return (
+        (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+        ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    )
+
+def encode_name(name):
+    return name.encode("utf-8", "surrogateescape")
+
+def local_header(name, mtime, method, crc, csize, usize, flags=0):
+    zip64 = csize >= ZIP32_MAX or usize >= ZIP32_MAX
+    extra = b""
+    if zip64:
+        extra = EXTRA_HEADER.pack(ZIP64_EXTRA, 16) + struct.pack("<QQ", usize, csize)
+        csize = usize = ZIP32_MAX
+    dtime, ddate = dos_time(mtime)
+    return LOCAL_HEADER.pack(
+        LOCAL_HEADER_SIG, VERSION64 if zip64 else VERSION, flags | FLAG_UTF8, method,
+        dtime, ddate, crc, csize, usize, len(name), len(extra)
+    ) + name + extra
+
+def data_descriptor(crc, csize, usize):
+    if csize >= ZIP32_MAX or usize >= ZIP32_MAX:
+        return DATA_DESCRIPTOR64.pack(DATA_DESCRIPTOR_SIG, crc, csize, usize)
+    return DATA_DESCRIPTOR.pack(DATA_DESCRIPTOR_SIG, crc, csize, usize)
+
+def central_header(name, mtime, method, crc, csize, usize, offset, flags=0):
+    fields = []
+    if usize >= ZIP32_MAX:
+        fields.append(usize)
+        usize = ZIP32_MAX
+    if csize >= ZIP32_MAX:
+        fields.append(csize)
+        csize = ZIP32_MAX
+    if offset >= ZIP32_MAX:
+        fields.append(offset)
+        offset = ZIP32_MAX
+    extra = b""
+    if fields:
+        extra = EXTRA_HEADER.pack(ZIP64_EXTRA, 8*len(fields)) + struct.pack("<%dQ" % len(fields), *fields)
+    version = VERSION64 if fields else VERSION
+    dtime, ddate = dos_time(mtime)
+    return CENTRAL_HEADER.pack(
+        CENTRAL_HEADER_SIG, MADE_BY_UNIX | version, version, flags | FLAG_UTF8, method,
+        dtime, ddate, crc, csize, usize, len(name), len(extra), 0, 0, 0,
+        0o100644 << 16, offset
+    ) + name + extra
+
+def end_records(count, cd_offset, cd_size):
+    records = b""
+    if count >= ZIP32_MAX_ENTRIES or cd_offset >= ZIP32_MAX or cd_size >= ZIP32_MAX:
+        end64_offset = cd_offset + cd_size
+        records = END_RECORD64.pack(
+            END_RECORD64_SIG, END_RECORD64.size - 12, MADE_BY_UNIX | VERSION64, VERSION64,
+            0, 0, count, count, cd_size, cd_offset
+        ) + END_LOCATOR64.pack(END_LOCATOR64_SIG, 0, end64_offset, 1)
+        count = min(count, ZIP32_MAX_ENTRIES)
+        cd_offset = min(cd_offset, ZIP32_MAX)
+        cd_size = min(cd_size, ZIP32_MAX)
+    return records + END_RECORD.pack(END_RECORD_SIG, 0, 0, count, count, cd_size, cd_offset, 0)
+
+class ZipStream(io.RawIOBase):
+    # Generates a zip archive of stored (uncompressed) entries on the fly.
+    # The size of the archive only depends on the names and sizes of the
+    # entries so it's known before a single byte has been read.
+
+    def __init__(self, entries):
+        self._entries = entries
+        self._chunks = self._generate()
+        self._pending = memoryview(b"")
+
+    @staticmethod
+    def length(entries):
+        offset = 0
+        cd_size = 0
+        for entry in entries:
+            name = encode_name(entry.name)
+            cd_size += len(central_header(name, 0, STORED, 0, entry.size, entry.size, offset))
+            offset += len(local_header(name, 0, STORED, 0, entry.size, entry.size))
+            offset += entry.size
+            offset += len(data_descriptor(0, entry.size, entry.size))
+        return offset + cd_size + len(end_records(len(entries), offset, cd_size))
+
+    def _generate(self):
+        offset = 0
+        central = []
+        for entry in self._entries:
+            name = encode_name(entry.name)
+            header = local_header(name, entry.mtime, STORED, 0, entry.size, entry.size, FLAG_DATA_DESCRIPTOR)
+            yield header
+
+            # The size has been promised so pad or truncate files that
+            # changed since they were listed.
+            crc = 0
+            remaining = entry.size
+            with entry.open() as fobj:
+                while remaining:
+                    buf = fobj.read(min(BUF_SIZE, remaining)) or bytes(min(BUF_SIZE, remaining))
+                    crc = zlib.crc32(buf, crc)
+                    remaining -= len(buf)
+                    yield buf
+            yield data_descriptor(crc, entry.size, entry.size)
+
+            central.append(central_header(
+                name, entry.mtime, STORED, crc, entry.size, entry.size, offset, FLAG_DATA_DESCRIPTOR
+            ))
+            offset += len(header) + entry.size + len(data_descriptor(0, entry.size, entry.size))
+
+        cd = b"".join(central)
+        yield cd
+        yield end_records(len(central), offset, len(cd))
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._pending:
+            try:
+                self._pending = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._pending))
+        b[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._chunks.close()
+        super().close()
+
+
+Compressed = namedtuple("Compressed", ("entry", "method", "crc", "csize", "usize", "data"))
+
+def compress_entry(entry):
+    with entry.open() as fobj:
+        method = DEFLATED if compressible(entry.name, fobj) else STORED
+        fobj.seek(0)
+
+        if method == STORED:
+            # Stored entries are copied straight from the source when the
+            # archive is assembled, and their CRC computed on the way.
+            return Compressed(entry, method, None, entry.size, entry.size, None)
+
+        crc = 0
+        usize = 0
+
+        data = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        while True:
+            buf = fobj.read(CHUNK_SIZE)
+            if not buf:
+                break
+            crc = zlib.crc32(buf, crc)
+            usize += len(buf)
+            data.write(compressor.compress(buf))
+        data.write(compressor.flush())
+        csize = data.tell()
+        data.seek(0)
+        return Compressed(entry, method, crc, csize, usize, data)
+
+class _Region:
+    # Reads part of an open file without moving its position.
+    def __init__(self, fd, offset, size):
+        self._fd = fd
+        self._offset = offset
+        self._remaining = size
+
+    def read(self, size):
+        if not self._remaining:
+            return b""
+        buf = os.pread(self._fd, min(size, self._remaining), self._offset)
+        if not buf:
+            raise IOError("Archive truncated")
+        self._offset += len(buf)
+        self._remaining -= len(buf)
+        return buf
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+def _entry_key(entry):
+    return (entry.name, entry.size, entry.mtime)
+
+class _Digesting:
+    # Hashes everything written through it.
+    def __init__(self, out):
+        self.out = out
+        self.sha256 = hashlib.sha256()
+
+    def write(self, buf):
+        self.sha256.update(buf)
+        return self.out.write(buf)
+
+    def flush(self):
+        self.out.flush()
+
+class ArchiveBuilder:
+    # Builds a zip archive, compressing entries in a thread pool (zlib
+    # releases the GIL) and writing them out in order. The SHA-256 of the
+    # archive is left in sha256 once it's written.
+    #
+    # previous may be (file, index) of an archive built earlier, where index
+    # is the builder's index attribute after writing it. Entries that haven't
+    # changed since are copied from it instead of being compressed again.
+
+    def __init__(self, entries, workers=None, previous=None):
+        self.entries = entries
+        self.workers = workers or os.cpu_count() or 1
+        self.previous = previous
+        self.index = {}
+        self.sha256 = None
+
+    def _compress(self, entry):
+        if self.previous is not None:
+            fobj, index = self.previous
+            record = index.get(_entry_key(entry))
+            if record is not None:
+                method, crc, csize, usize, offset = record
+                return Compressed(entry, method, crc, csize, usize, _Region(fobj.fileno(), offset, csize))
+        return compress_entry(entry)
+
+    def write(self, out, progress=None):
+        from concurrent.futures import ThreadPoolExecutor
+        out = _Digesting(out)
+        offset = 0
+        central = []
+        done = 0
+        with ThreadPoolExecutor(self.workers) as pool:
+            # Bound the number of compressed entries waiting to be written.
+            entries = iter(self.entries)
+            pending = deque(
+                pool.submit(self._compress, entry)
+                for entry in itertools.islice(entries, self.workers * 2)
+            )
+
+            while pending:
+                result = pending.popleft().result()
+                entry = next(entries, None)
+                if entry is not None:
+                    pending.append(pool.submit(self._compress, entry))
+
+                offset += self._write_entry(out, result, offset, central)
+                done += result.usize
+                if progress is not None:
+                    progress(done)
+
+        cd = b"".join(central)
+        out.write(cd)
+        out.write(end_records(len(central), offset, len(cd)))
+        out.flush()
+        self.sha256 = out.sha256.digest()
+
+    def _write_entry(self, out, result, offset, central):
+        entry = result.entry
+        name = encode_name(entry.name)
+        # The CRC of an entry copied from its source follows it in a data
+        # descriptor, like in ZipStream.
+        crc = result.crc
+        flags = FLAG_DATA_DESCRIPTOR if crc is None else 0
+        header = local_header(name, entry.mtime, result.method, crc or 0, result.csize, result.usize, flags)
+        out.write(header)
+        descriptor = b""
+        if result.data is None:
+            crc = 0
+            with entry.open() as fobj:
+                remaining = result.usize
+                while remaining:
+                    buf = fobj.read(min(CHUNK_SIZE, remaining)) or bytes(min(CHUNK_SIZE, remaining))
+                    crc = zlib.crc32(buf, crc)
+                    out.write(buf)
+                    remaining -= len(buf)
+            descriptor = data_descriptor(crc, result.csize, result.usize)
+            out.write(descriptor)
+        else:
+            with result.data:
+                while True:
+                    buf = result.data.read(CHUNK_SIZE)
+                    if not buf:
+                        break
+                    out.write(buf)
+        central.append(central_header(
+            name, entry.mtime, result.method, crc, result.csize, result.usize, offset, flags
+        ))
+        self.index[_entry_key(entry)] = (
+            result.method, crc, result.csize, result.usize, offset + len(header)
+        )
+        return len(header) + result.csize + len(descriptor)
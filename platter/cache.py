@@ -0,0 +1,107 @@
+import os
+import hashlib
+from tempfile import NamedTemporaryFile
+from threading import Lock
+
+__all__ = ("DiskCache", "ArchiveCache", "VariantCache", "archive_key", "variant_key", "cache_dir")
+
+# Bump these whenever the archive format (or compressor) changes.
+ARCHIVE_VERSION = 2
+VARIANT_VERSION = 1
+
+def cache_dir(*parts):
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "platter", *parts)
+
+def _stat_key(h, stats):
+    for path, st in stats:
+        h.update(os.fsencode(path))
+        h.update(b"\0%d\0%d\0%d\0%d\0" % (st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev))
+    return h.hexdigest()
+
+def archive_key(stats):
+    return _stat_key(hashlib.sha256(b"platter-archive-%d\0" % ARCHIVE_VERSION), stats)
+
+def variant_key(path, st, encoding):
+    h = hashlib.sha256(b"platter-variant-%d\0%s\0" % (VARIANT_VERSION, encoding.encode("ascii")))
+    return _stat_key(h, ((path, st),))
+
+class DiskCache:
+    # A directory of files named by the hash of their inputs. Least recently
+    # used files are evicted once the directory grows past max_size bytes.
+    # Files are handed out open so that evicting one that's still being
+    # served is harmless.
+
+    name = None
+    suffix = ""
+
+    def __init__(self, max_size, directory=None):
+        self.max_size = max_size
+        self.directory = directory or cache_dir(self.name)
+        self._lock = Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def lookup(self, key):
+        path = self._path(key)
+        with self._lock:
+            try:
+                fobj = open(path, "rb")
+            except FileNotFoundError:
+                return None
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return fobj
+
+    def create(self):
+        return NamedTemporaryFile(dir=self.directory, prefix=".tmp-", delete=False)
+
+    def commit(self, fobj, key):
+        fobj.flush()
+        with self._lock:
+            os.replace(fobj.name, self._path(key))
+        self.evict()
+
+    def discard(self, fobj):
+        fobj.close()
+        try:
+            os.unlink(fobj.name)
+        except OSError:
+            pass
+
+    def evict(self):
+        with self._lock:
+            cached = []
+            for entry in os.scandir(self.directory):
+                if entry.name.startswith(".tmp-") or not entry.name.endswith(self.suffix):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                cached.append((st.st_mtime, st.st_size, entry.path))
+
+            total = sum(size for _, size, _ in cached)
+            cached.sort()
+            for _, size, path in cached:
+                if total <= self.max_size:
+                    break
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+                total -= size
+
+class ArchiveCache(DiskCache):
+    # Finished MultiFile archives.
+    name = "archives"
+    suffix = ".zip"
+
+class VariantCache(DiskCache):
+    # Content-Encoding variants (e.g. gzip) of served files.
+    name = "variants"
+    suffix = ".variant"
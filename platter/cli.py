@@ -0,0 +1,82 @@
+import sys
+import signal
+import threading
+
+from .options import make_parser, file_groups, should_forward, server_options
+from .control import forward, ControlServer
+
+__all__ = ("main",)
+
+# A headless server. Only the modules needed to parse the arguments are
+# loaded before the socket is bound; Qt (and friends) are never loaded.
+
+def parse_args(argv):
+    parser = make_parser(prog="platter-server", description="Serve files without a GUI.")
+    parser.add_argument(
+        "--no-dbus",
+        action="store_false",
+        dest="dbus",
+        help="don't register on the session bus"
+    )
+    args = parser.parse_args(argv)
+    args.groups = file_groups(args)
+    args.forward = should_forward(parser, args)
+    return args
+
+def _print_url(f):
+    print(f.url, f.name, sep="\t", flush=True)
+
+def _start_dbus(server):
+    try:
+        from dbus.mainloop.glib import DBusGMainLoop
+        from gi.repository import GLib
+        DBusGMainLoop(set_as_default=True)
+        from .dbus import PlatterServerDBus
+        return PlatterServerDBus(server), GLib
+    except Exception:
+        return None, None
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.forward and forward(args.groups):
+        return 0
+
+    from .server import make_server
+    server = make_server(args.engine, (args.bind, args.port), **server_options(args))
+    server.on("add", _print_url)
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    print("Listening on http://%s:%d/" % (server.my_ip, server.server_port), file=sys.stderr, flush=True)
+
+    for group in args.groups:
+        server.serve(group)
+
+    try:
+        control = ControlServer(server)
+        control.start()
+    except OSError:
+        control = None
+
+    bus, GLib = _start_dbus(server) if args.dbus else (None, None)
+    if bus is not None:
+        loop = GLib.MainLoop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signum, loop.quit)
+        loop.run()
+    else:
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        try:
+            while not stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+
+    if control is not None:
+        control.close()
+    server.shutdown()
+    thread.join()
+    server.server_close()
+    return 0
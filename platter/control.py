@@ -0,0 +1,154 @@
+import os
+import stat
+import json
+import errno
+import socket
+import threading
+
+from .util import is_url
+
+__all__ = ("socket_path", "forward", "ControlServer")
+
+# Hands files to an already running instance. This module is imported before
+# anything heavy (Qt in particular) so that forwarding stays cheap.
+
+TIMEOUT = 2
+
+def socket_path():
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return os.path.join(runtime, "platter.sock")
+    # /tmp is shared, so use a directory nobody else can put a socket in.
+    return os.path.join("/tmp", "platter-%d" % os.getuid(), "platter.sock")
+
+def _owned(path, kind):
+    # Whether path is a `kind` (stat.S_ISSOCK, ...) of ours that only we can write to.
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return kind(st.st_mode) and st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+def _absolute(groups):
+    # The running instance doesn't share our working directory.
+    return [[fpath if is_url(fpath) else os.path.abspath(fpath) for fpath in group] for group in groups]
+
+def forward(groups):
+    # Returns True if a running instance took the files.
+    groups = _absolute(groups)
+    return _forward_dbus(groups) or _forward_socket(groups)
+
+def _forward_dbus(groups):
+    try:
+        import dbus
+    except ImportError:
+        return False
+    from .dbus import BUS_NAME, SERVER_OBJECT, SERVER_INTERFACE
+    try:
+        bus = dbus.SessionBus()
+        if not bus.name_has_owner(BUS_NAME):
+            return False
+        inst = dbus.Interface(
+            bus.get_object(BUS_NAME, SERVER_OBJECT, introspect=False),
+            dbus_interface=SERVER_INTERFACE
+        )
+        inst.AddFileGroups(groups, signature='aas', timeout=TIMEOUT)
+    except dbus.DBusException:
+        return False
+    return True
+
+def _forward_socket(groups):
+    path = socket_path()
+    if not (_owned(os.path.dirname(path), stat.S_ISDIR) and _owned(path, stat.S_ISSOCK)):
+        return False
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(TIMEOUT)
+    try:
+        sock.connect(path)
+        sock.sendall(json.dumps({"groups": groups}).encode("utf-8") + b"\n")
+        reply = json.loads(sock.makefile("rb").readline().decode("utf-8"))
+    except (OSError, ValueError):
+        return False
+    finally:
+        sock.close()
+    return reply.get("ok", False)
+
+class ControlServer(threading.Thread):
+    # Accepts newline terminated JSON requests ({"groups": [[path, ...], ...]})
+    # on a Unix socket and serves the listed files.
+    daemon = True
+
+    def __init__(self, server, path=None):
+        super().__init__(name="platter-control")
+        self.server = server
+        self.path = path or socket_path()
+        self.socket = self._bind()
+
+    def _bind(self):
+        directory = os.path.dirname(self.path)
+        try:
+            os.mkdir(directory, 0o700)
+        except FileExistsError:
+            pass
+        if not _owned(directory, stat.S_ISDIR):
+            raise OSError(errno.EPERM, "Not ours", directory)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            try:
+                sock.bind(self.path)
+            except OSError:
+                # Take over the socket of an instance that's no longer there,
+                # but never someone else's.
+                if not _owned(self.path, stat.S_ISSOCK) or self._alive():
+                    sock.close()
+                    raise
+                os.unlink(self.path)
+                sock.bind(self.path)
+        finally:
+            os.umask(old_umask)
+        sock.listen(16)
+        return sock
+
+    def _alive(self):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+            return True
+        except OSError:
+            return False
+        finally:
+            probe.close()
+
+    def run(self):
+        while True:
+            try:
+                conn, _ = self.socket.accept()
+            except OSError:
+                return
+            with conn:
+                conn.settimeout(TIMEOUT)
+                try:
+                    self._handle(conn)
+                except (OSError, ValueError):
+                    pass
+
+    def _handle(self, conn):
+        request = json.loads(conn.makefile("rb").readline().decode("utf-8"))
+        fids = []
+        for group in request.get("groups", ()):
+            if group and all(os.path.exists(fpath) or is_url(fpath) for fpath in group):
+                fids.append(self.server.serve(group).fid)
+        conn.sendall(json.dumps({"ok": True, "fids": fids}).encode("utf-8") + b"\n")
+
+    def close(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        try:
+            # Wakes up the accept in run().
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
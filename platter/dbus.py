@@ -17,6 +17,34 @@ class PlatterServerDBus(dbus.service.Object):
     def AddFiles(self, files):
         self.server.serve(files)
 
+    @dbus.service.method(dbus_interface=SERVER_INTERFACE, in_signature='aas')
+    def AddFileGroups(self, groups):
+        for files in groups:
+            self.server.serve([str(f) for f in files])
+
+    # Rates are in bytes per second, 0 means unlimited.
+    @dbus.service.method(dbus_interface=SERVER_INTERFACE, in_signature='t')
+    def SetRateLimit(self, rate):
+        self.server.set_rate_limit(int(rate))
+
+    @dbus.service.method(dbus_interface=SERVER_INTERFACE, in_signature='t')
+    def SetClientRateLimit(self, rate):
+        self.server.set_client_rate_limit(int(rate))
+
+    @dbus.service.method(dbus_interface=SERVER_INTERFACE, in_signature='ut')
+    def SetFileRateLimit(self, fid, rate):
+        self.server.set_file_rate_limit(self._file(fid), int(rate))
+
+    @dbus.service.method(dbus_interface=SERVER_INTERFACE, in_signature='ud')
+    def SetFileWeight(self, fid, weight):
+        self.server.set_file_weight(self._file(fid), float(weight))
+
+    def _file(self, fid):
+        try:
+            return self.server.files[int(fid)]
+        except KeyError:
+            raise dbus.exceptions.DBusException("No such file: %d" % fid)
+
 def get_instance(bus=None):
     if not bus:
         bus = dbus.SessionBus()
@@ -0,0 +1,105 @@
+import os
+import queue
+import base64
+import hashlib
+from concurrent.futures import Future
+from threading import Thread, Lock
+
+from .event import Observable
+
+__all__ = ("Digests", "stat_key", "digest_headers", "render_checksum", "SUFFIX")
+
+# Checksum URLs are a file's URL with this appended.
+SUFFIX = ".sha256"
+CONTENT_TYPE = "text/plain; charset=utf-8"
+
+MAX_ENTRIES = 4096
+BUF_SIZE = 1 << 20
+
+def stat_key(st):
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+def digest_headers(digest):
+    value = base64.b64encode(digest).decode("ascii")
+    return [("Repr-Digest", "sha-256=:%s:" % value), ("Digest", "SHA-256=%s" % value)]
+
+# Same format as sha256sum.
+def render_checksum(digest, name):
+    return ("%s  %s\n" % (digest.hex(), name)).encode("utf-8", "surrogateescape")
+
+def _sha256(fobj):
+    h = hashlib.sha256()
+    buf = bytearray(BUF_SIZE)
+    view = memoryview(buf)
+    while True:
+        n = fobj.readinto(buf)
+        if not n:
+            return h.digest()
+        h.update(view[:n])
+
+class Digests(Observable):
+    # SHA-256 digests of served files, remembered by stat identity (device,
+    # inode, size and mtime) so each version of a file is read at most once.
+    # They're computed on up to `workers` daemon threads; with none, digests
+    # only come in through add(). Triggers "digest" (key, digest) whenever a
+    # computation finishes, with digest None if the file changed meanwhile.
+
+    def __init__(self, workers=2):
+        super().__init__()
+        self.workers = workers
+        self._lock = Lock()
+        self._digests = {}
+        self._pending = {}
+        self._queue = queue.Queue()
+        self._threads = 0
+
+    def get(self, st):
+        return self._digests.get(stat_key(st))
+
+    def items(self):
+        with self._lock:
+            return list(self._digests.items())
+
+    def compute(self, path):
+        # Returns a Future for the digest of path as it is now.
+        key = stat_key(os.stat(path))
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            future = Future()
+            digest = self._digests.get(key)
+            if digest is not None:
+                future.set_result(digest)
+                return future
+            self._pending[key] = future
+            if self.workers:
+                self._queue.put((path, key))
+                if self._threads < self.workers:
+                    self._threads += 1
+                    Thread(target=self._work, name="platter-digest", daemon=True).start()
+        return future
+
+    def add(self, key, digest):
+        with self._lock:
+            if digest is not None:
+                self._digests.pop(key, None)
+                self._digests[key] = digest
+                while len(self._digests) > MAX_ENTRIES:
+                    del self._digests[next(iter(self._digests))]
+            future = self._pending.pop(key, None)
+        if future is not None:
+            future.set_result(digest)
+        self.trigger("digest", key, digest)
+
+    def _work(self):
+        while True:
+            path, key = self._queue.get()
+            try:
+                with open(path, "rb", buffering=0) as fobj:
+                    digest = _sha256(fobj)
+                    if stat_key(os.fstat(fobj.fileno())) != key:
+                        digest = None
+            except OSError:
+                digest = None
+            self.add(key, digest)
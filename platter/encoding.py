@@ -0,0 +1,98 @@
+import io
+import zlib
+from importlib.util import find_spec
+
+__all__ = ("ENCODINGS", "negotiate", "EncodedReader")
+
+CHUNK_SIZE = 256 << 10
+# Not worth compressing, the headers are bigger than the savings.
+MIN_SIZE = 1024
+
+def _gzip():
+    return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+def _zstd():
+    # Imported on first use to keep startup fast.
+    import zstandard
+    return zstandard.ZstdCompressor(level=3).compressobj()
+
+# Content codings we can produce, in order of preference.
+ENCODINGS = {}
+if find_spec("zstandard") is not None:
+    ENCODINGS["zstd"] = _zstd
+ENCODINGS["gzip"] = _gzip
+
+def negotiate(accept_encoding):
+    # Picks the content coding to use for an Accept-Encoding header, or None
+    # to send the file as is.
+    if not accept_encoding:
+        return None
+    qvalues = {}
+    for item in accept_encoding.split(","):
+        coding, *params = item.strip().split(";")
+        q = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[coding.strip().lower()] = q
+
+    best, best_q = None, 0.0
+    for coding in ENCODINGS:
+        q = qvalues.get(coding, qvalues.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+class EncodedReader(io.RawIOBase):
+    # Compresses a file as it's read. If a cache (and key) is given the
+    # compressed bytes are also written to it and committed once the whole
+    # file has been read.
+
+    def __init__(self, fobj, encoding, cache=None, key=None):
+        self._fobj = fobj
+        self._compressor = ENCODINGS[encoding]()
+        self._pending = memoryview(b"")
+        self._eof = False
+        self.consumed = 0
+        self._cache = cache
+        self._key = key
+        self._tee = cache.create() if cache is not None else None
+
+    def readable(self):
+        return True
+
+    def _fill(self):
+        while not self._pending and not self._eof:
+            buf = self._fobj.read(CHUNK_SIZE)
+            if buf:
+                self.consumed += len(buf)
+                out = self._compressor.compress(buf)
+            else:
+                self._eof = True
+                out = self._compressor.flush()
+            if self._tee is not None and out:
+                self._tee.write(out)
+            self._pending = memoryview(out)
+        if self._eof and not self._pending and self._tee is not None:
+            self._cache.commit(self._tee, self._key)
+            self._tee.close()
+            self._tee = None
+
+    def readinto(self, b):
+        self._fill()
+        n = min(len(b), len(self._pending))
+        b[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            if self._tee is not None:
+                self._cache.discard(self._tee)
+                self._tee = None
+            self._fobj.close()
+        super().close()
@@ -1,36 +1,133 @@
 from threading import Lock
+from collections import deque
+import weakref
+from types import MethodType
 
-__all__ = ("Observable",)
+__all__ = ("Observable", "EventQueue")
+
+_EMPTY = ({}, ())
+
+class _WeakCallback:
+    __slots__ = ("ref",)
+
+    def __init__(self, ref):
+        self.ref = ref
+
+    def __call__(self, *args, **kwargs):
+        cb = self.ref()
+        if cb is not None:
+            cb(*args, **kwargs)
 
 class Observable:
     __slots__ = ()
 
+    # Subscriptions are kept in a plain dict guarded by a lock. Every change
+    # rebuilds an immutable dispatch table (signal -> tuple of callbacks,
+    # "all" callbacks included) that trigger reads without locking.
+
     def __init__(self):
         self.__callbacks = {}
+        self.__table = _EMPTY
         self.__lock = Lock()
 
     def trigger(self, signal, *args, **kwargs):
-        with self.__lock:
-            callbacks = self.__callbacks.get(
-                signal, frozenset()
-            ).union(self.__callbacks.get(
-                "all", frozenset()
-            ))
-
-        for cb in callbacks:
+        table, default = self.__table
+        for cb in table.get(signal, default):
             cb(*args, **kwargs)
 
-    def on(self, signal, cb):
+    def on(self, signal, cb, weak=False, queue=None):
+        # weak: don't keep cb (or the object it's bound to) alive.
+        # queue: deliver through an EventQueue instead of calling cb directly.
+        if weak:
+            key = (weakref.WeakMethod if isinstance(cb, MethodType) else weakref.ref)(
+                cb, self.__reaper(signal)
+            )
+            target = _WeakCallback(key)
+        else:
+            key = target = cb
+        if queue is not None:
+            target = queue.wrap(target)
+
         with self.__lock:
-            self.__callbacks.setdefault(signal, set()).add(cb)
+            self.__callbacks.setdefault(signal, {})[key] = target
+            self.__rebuild()
 
     def off(self, signal, cb):
         with self.__lock:
-            if signal in self.__callbacks:
-                self.__callbacks[signal].remove(cb)
+            callbacks = self.__callbacks.get(signal)
+            if not callbacks:
+                return
+            if cb in callbacks:
+                del callbacks[cb]
+            else:
+                # Weak subscriptions compare equal to a new weakref to cb.
+                try:
+                    key = (weakref.WeakMethod if isinstance(cb, MethodType) else weakref.ref)(cb)
+                except TypeError:
+                    return
+                callbacks.pop(key, None)
+            self.__rebuild()
 
     def once(self, signal, cb):
         def fn(*args, **kwargs):
-            self.off(signal, cb)
+            self.off(signal, fn)
             cb(*args, **kwargs)
         return self.on(signal, fn)
+
+    def __reaper(self, signal):
+        try:
+            selfref = weakref.ref(self)
+        except TypeError:
+            return None
+        def reap(ref):
+            obj = selfref()
+            if obj is not None:
+                obj.__remove(signal, ref)
+        return reap
+
+    def __remove(self, signal, key):
+        with self.__lock:
+            callbacks = self.__callbacks.get(signal)
+            if callbacks and callbacks.pop(key, None) is not None:
+                self.__rebuild()
+
+    def __rebuild(self):
+        # Must be called with the lock held.
+        default = tuple(self.__callbacks.get("all", {}).values())
+        table = {
+            signal: tuple(callbacks.values()) + (default if signal != "all" else ())
+            for signal, callbacks in self.__callbacks.items()
+        }
+        self.__table = (table, default)
+
+class EventQueue:
+    # Collects events from any thread and delivers them in batches whenever
+    # drain() is called (e.g. from a GUI timer). With coalesce=True only the
+    # latest pending call of each callback is kept.
+
+    def __init__(self, coalesce=False):
+        self.coalesce = coalesce
+        self._events = deque()
+        self._latest = {}
+        self._lock = Lock()
+
+    def wrap(self, cb):
+        if self.coalesce:
+            def enqueue(*args, **kwargs):
+                with self._lock:
+                    self._latest[cb] = (args, kwargs)
+        else:
+            def enqueue(*args, **kwargs):
+                self._events.append((cb, args, kwargs))
+        return enqueue
+
+    def drain(self):
+        if self.coalesce:
+            with self._lock:
+                latest, self._latest = self._latest, {}
+            for cb, (args, kwargs) in latest.items():
+                cb(*args, **kwargs)
+        else:
+            for _ in range(len(self._events)):
+                cb, args, kwargs = self._events.popleft()
+                cb(*args, **kwargs)
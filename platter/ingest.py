@@ -0,0 +1,52 @@
+import os
+import stat
+
+__all__ = ("scan",)
+
+# Walks the served paths with os.scandir, one directory level at a time in
+# parallel, and keeps the stat results for the archive builder so that no
+# file is stat'ed twice.
+
+def _scan_dir(path):
+    files, dirs = [], []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    # Like os.walk, don't follow symlinks to directories.
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    continue
+                if stat.S_ISREG(st.st_mode):
+                    files.append((entry.path, st))
+    except OSError:
+        pass
+    return files, dirs
+
+def scan(paths, workers=None):
+    # Returns (path, stat_result) for every regular file under paths,
+    # sorted by path so that archives (and their cache keys) are stable.
+    found = []
+    level = []
+    for path in paths:
+        st = os.stat(path)
+        if stat.S_ISDIR(st.st_mode):
+            level.append(path)
+        else:
+            found.append((path, st))
+
+    if level:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(workers) as executor:
+            while level:
+                next_level = []
+                for files, dirs in executor.map(_scan_dir, level):
+                    found.extend(files)
+                    next_level.extend(dirs)
+                level = next_level
+
+    found.sort(key=lambda item: item[0])
+    return found
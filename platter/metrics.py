@@ -0,0 +1,160 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+from threading import Lock
+
+__all__ = ("Metrics", "Histogram", "METRICS_PATH", "CONTENT_TYPE")
+
+METRICS_PATH = "/metrics"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+TTFB_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+DURATION_BUCKETS = (0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 1800)
+BUILD_BUCKETS = (0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0]*(len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+
+    def render(self, name):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += count
+            lines.append('%s_bucket{le="%s"} %d' % (name, bound, cumulative))
+        lines.append("%s_sum %r" % (name, total))
+        lines.append("%s_count %d" % (name, cumulative))
+        return lines
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class Metrics:
+    # Collects server statistics for the /metrics endpoint (Prometheus text
+    # format). Transfers are only touched when they begin and end; bytes sent
+    # by running transfers are read from Transfer.sent when scraped.
+
+    def __init__(self):
+        self._lock = Lock()
+        self._active = {}
+        self._files = {}
+        self.bytes_sent = 0
+        self.requests = 0
+        self.rejected = 0
+        self.ttfb = Histogram(TTFB_BUCKETS)
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.archive_build = Histogram(BUILD_BUCKETS)
+
+    def begin(self, transfer):
+        now = time.monotonic()
+        self.ttfb.observe(now - transfer.started)
+        with self._lock:
+            self._active[transfer] = now
+            self.requests += 1
+            if transfer.file in self._files:
+                self._files[transfer.file][1] += 1
+
+    def end(self, transfer):
+        now = time.monotonic()
+        with self._lock:
+            try:
+                began = self._active.pop(transfer)
+            except KeyError:
+                return
+            self.bytes_sent += transfer.sent
+            if transfer.file in self._files:
+                self._files[transfer.file][0] += transfer.sent
+        self.duration.observe(now - began)
+
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def archive_built(self, seconds):
+        self.archive_build.observe(seconds)
+
+    # Only files added here are reported individually.
+    def add_file(self, file):
+        with self._lock:
+            self._files.setdefault(file, [0, 0])
+
+    def forget_file(self, file):
+        with self._lock:
+            self._files.pop(file, None)
+
+    def render(self):
+        with self._lock:
+            active = list(self._active)
+            files = {f: list(stats) for f, stats in self._files.items()}
+            bytes_sent = self.bytes_sent
+            requests = self.requests
+            rejected = self.rejected
+
+        file_active = {}
+        for transfer in active:
+            bytes_sent += transfer.sent
+            if transfer.file in files:
+                files[transfer.file][0] += transfer.sent
+            file_active[transfer.file] = file_active.get(transfer.file, 0) + 1
+
+        lines = []
+        def metric(name, kind, help, samples):
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, kind))
+            lines.extend(samples)
+
+        def per_file(name, values):
+            return [
+                '%s{fid="%d",name="%s"} %d' % (name, f.fid, _label(f.name), value)
+                for f, value in values
+            ]
+
+        metric("platter_bytes_sent_total", "counter", "Response body bytes sent.",
+               ["platter_bytes_sent_total %d" % bytes_sent])
+        metric("platter_requests_total", "counter", "Transfers started.",
+               ["platter_requests_total %d" % requests])
+        metric("platter_requests_rejected_total", "counter", "Connections turned away with a 503.",
+               ["platter_requests_rejected_total %d" % rejected])
+        metric("platter_requests_active", "gauge", "Transfers in progress.",
+               ["platter_requests_active %d" % len(active)])
+        metric("platter_file_bytes_sent_total", "counter", "Response body bytes sent per file.",
+               per_file("platter_file_bytes_sent_total", ((f, s[0]) for f, s in files.items())))
+        metric("platter_file_requests_total", "counter", "Transfers started per file.",
+               per_file("platter_file_requests_total", ((f, s[1]) for f, s in files.items())))
+        metric("platter_file_requests_active", "gauge", "Transfers in progress per file.",
+               per_file("platter_file_requests_active", ((f, file_active.get(f, 0)) for f in files)))
+        metric("platter_time_to_first_byte_seconds", "histogram",
+               "Time from accepting a request to sending its body.",
+               self.ttfb.render("platter_time_to_first_byte_seconds"))
+        metric("platter_transfer_duration_seconds", "histogram", "Time spent sending response bodies.",
+               self.duration.render("platter_transfer_duration_seconds"))
+        metric("platter_archive_build_seconds", "histogram", "Time spent building archives.",
+               self.archive_build.render("platter_archive_build_seconds"))
+        metric("platter_threads", "gauge", "Live threads.",
+               ["platter_threads %d" % threading.active_count()])
+        metric("process_cpu_seconds_total", "counter", "CPU time used by the process.",
+               ["process_cpu_seconds_total %r" % time.process_time()])
+        rss = _resident_memory()
+        if rss is not None:
+            metric("process_resident_memory_bytes", "gauge", "Resident memory size.",
+                   ["process_resident_memory_bytes %d" % rss])
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+def _resident_memory():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1])*os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
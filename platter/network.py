@@ -1,5 +1,3 @@
-import netifaces
-
 __all__ = ('find_ip', 'get_default_iface')
 
 def __parse_table(iterable):
@@ -14,6 +12,7 @@ def get_default_iface():
     return None
 
 def find_ip():
+    import netifaces
     iface = get_default_iface()
     if iface is None:
         return '127.0.0.1'
@@ -0,0 +1,215 @@
+import os
+import argparse
+
+from .util import is_url
+
+__all__ = ("ENGINES", "MAX_TRANSFERS", "make_parser", "file_groups", "should_forward", "server_options")
+
+# Kept free of heavy imports so that argument parsing is fast.
+
+ENGINES = ("threads", "asyncio")
+# The default --max-transfers, a connection costs a thread with one engine
+# but not the other.
+MAX_TRANSFERS = {"threads": 128, "asyncio": 1024}
+DEFAULT_PORT = 10700
+
+# Options that don't configure the server, so they don't stop the files from
+# being handed to a running instance.
+CLIENT_OPTIONS = frozenset(("files", "archives", "groups", "new_instance", "dbus"))
+
+def make_parser(**kwargs):
+    parser = argparse.ArgumentParser(**kwargs)
+    def path_exists(string):
+        if os.path.exists(string) or is_url(string):
+            return string
+        else:
+            raise argparse.ArgumentTypeError("Path '%s' does not exist." % string)
+
+    parser.add_argument("files",
+                        nargs='*',
+                        type=path_exists,
+                        default = [],
+                       )
+    parser.add_argument(
+        "-a",
+        "--archive",
+        nargs='+',
+        default = [],
+        action='append',
+        type=path_exists,
+        dest="archives"
+    )
+    parser.add_argument(
+        "-p",
+        "--port",
+        type=int,
+        default=DEFAULT_PORT,
+        help="port to listen on (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--bind",
+        default="",
+        metavar="ADDRESS",
+        help="address to listen on (default: all)"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="send archives as they are generated (uncompressed) instead of building them first"
+    )
+    parser.add_argument(
+        "--archive-cache",
+        type=int,
+        metavar="MiB",
+        default=0,
+        help="keep up to this many MiB of built archives around for reuse"
+    )
+    parser.add_argument(
+        "--archive-memory",
+        type=int,
+        metavar="MiB",
+        default=32,
+        help="build archives of up to this many MiB in memory instead of on disk (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        metavar="MiB",
+        default=256,
+        help="keep at most this many MiB of archives in memory in total (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="threads",
+        help="serve connections from a thread each or from a single asyncio event loop"
+    )
+    parser.add_argument(
+        "--bundle-multiget",
+        action="store_true",
+        help="send multiget URLs (e.g. /1-3+5) as a single zip archive"
+    )
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="compress compressible files for clients that accept gzip (or zstd)"
+    )
+    parser.add_argument(
+        "--variant-cache",
+        type=int,
+        metavar="MiB",
+        default=0,
+        help="keep up to this many MiB of compressed files around for reuse"
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=int,
+        metavar="KiB/s",
+        default=0,
+        help="limit the total upload rate"
+    )
+    parser.add_argument(
+        "--client-rate-limit",
+        type=int,
+        metavar="KiB/s",
+        default=0,
+        help="limit the upload rate to each client"
+    )
+    parser.add_argument(
+        "--max-transfers",
+        type=int,
+        metavar="N",
+        help="serve at most this many clients at once (default: %s)" % ", ".join(
+            "%d with %s" % (MAX_TRANSFERS[engine], engine) for engine in ENGINES
+        )
+    )
+    parser.add_argument(
+        "--max-queued",
+        type=int,
+        default=1024,
+        metavar="N",
+        help="clients allowed to wait for a slot before getting a 503 (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=60,
+        metavar="SECONDS",
+        help="drop clients that stall for this long (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        metavar="N",
+        help="accept connections in this many processes (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="rebuild archives when the files in them change"
+    )
+    def directory(string):
+        if os.path.isdir(string):
+            return os.path.abspath(string)
+        raise argparse.ArgumentTypeError("'%s' is not a directory." % string)
+
+    parser.add_argument(
+        "--receive",
+        type=directory,
+        metavar="DIRECTORY",
+        dest="upload_dir",
+        help="accept uploads (see /upload) into this directory and serve them"
+    )
+    parser.add_argument(
+        "--no-checksums",
+        action="store_false",
+        dest="checksums",
+        help="don't compute SHA-256 checksums of served files"
+    )
+    parser.add_argument(
+        "--no-metrics",
+        action="store_false",
+        dest="metrics",
+        help="don't serve statistics at /metrics"
+    )
+    parser.add_argument(
+        "--new-instance",
+        action="store_true",
+        help="start a new server even if one is running (implied by any server option)"
+    )
+    return parser
+
+def file_groups(args):
+    return [[fpath] for fpath in args.files] + args.archives
+
+def should_forward(parser, args):
+    # Files only go to a running instance if nothing was asked of the server.
+    if not args.groups or args.new_instance:
+        return False
+    return all(
+        value == parser.get_default(name)
+        for name, value in vars(args).items() if name not in CLIENT_OPTIONS
+    )
+
+def server_options(args):
+    from .cache import ArchiveCache, VariantCache
+    return dict(
+        stream_archives=args.stream,
+        archive_cache=ArchiveCache(args.archive_cache << 20) if args.archive_cache else None,
+        bundle_multiget=args.bundle_multiget,
+        compress_transfers=args.compress,
+        variant_cache=VariantCache(args.variant_cache << 20) if args.variant_cache else None,
+        rate_limit=args.rate_limit << 10,
+        client_rate_limit=args.client_rate_limit << 10,
+        metrics=args.metrics,
+        watch=args.watch,
+        max_transfers=args.max_transfers or MAX_TRANSFERS[args.engine],
+        max_queued=args.max_queued,
+        timeout=args.timeout,
+        workers=args.workers,
+        checksums=args.checksums,
+        upload_dir=args.upload_dir,
+        archive_memory=args.archive_memory << 20,
+        memory_budget=args.memory_budget << 20,
+    )
@@ -0,0 +1,753 @@
+import os
+import sys
+import time
+import pickle
+import signal
+import socket
+import struct
+import itertools
+import traceback
+import subprocess
+from functools import partial
+from threading import Thread, Event, Lock
+
+from .event import Observable
+from .progress import Progress
+from .options import ENGINES, MAX_TRANSFERS
+from .archive import Entry, ZipStream
+from .cache import VariantCache
+from .digest import Digests
+from .remote import Tail, PolledGrowth
+from .server import (Catalog, File, RealFile, LocalFile, StreamingMultiFile, RemoteFile, Snapshot,
+                     make_server)
+
+__all__ = ("PreforkServer", "RemoteRequest", "run_worker")
+
+# Several processes accepting on the same port (SO_REUSEPORT) so transfers
+# aren't bound to a single interpreter. The main process keeps the catalog:
+# it builds archives and hands every loaded file to the workers, as a path
+# or a file descriptor. Requests in the workers are mirrored back as
+# RemoteRequests on the main process's files, so the UI, D-Bus and /metrics
+# still see a single server.
+
+# Seconds between checks for workers that have died.
+SUPERVISE_INTERVAL = 1
+START_TIMEOUT = 10
+STOP_TIMEOUT = 5
+CALL_TIMEOUT = 5
+MAX_FDS = 4
+
+class Channel:
+    # Length prefixed pickles over a Unix stream socket. File descriptors
+    # travel with the first bytes of their message.
+    HEADER = struct.Struct("!I")
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._lock = Lock()
+
+    def send(self, message, fds=()):
+        data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+        data = self.HEADER.pack(len(data)) + data
+        with self._lock:
+            if fds:
+                sent = socket.send_fds(self.sock, [data], fds)
+                self.sock.sendall(data[sent:])
+            else:
+                self.sock.sendall(data)
+
+    def recv(self):
+        header, fds, _, _ = socket.recv_fds(self.sock, self.HEADER.size, MAX_FDS)
+        if not header:
+            raise EOFError
+        header += self._read(self.HEADER.size - len(header))
+        (length,) = self.HEADER.unpack(header)
+        return pickle.loads(self._read(length)), fds
+
+    def _read(self, size):
+        buf = bytearray()
+        while len(buf) < size:
+            chunk = self.sock.recv(size - len(buf))
+            if not chunk:
+                raise EOFError
+            buf += chunk
+        return bytes(buf)
+
+    def close(self):
+        self.sock.close()
+
+def _share(rate, workers):
+    # Global limits are split evenly between the workers.
+    return max(1, rate//workers) if rate else rate
+
+def _describe(f):
+    # What a worker needs to serve a loaded file: kind, data, etag and fds.
+    if isinstance(f, StreamingMultiFile):
+        return "stream", f._stats, f.etag, ()
+    if isinstance(f, LocalFile):
+        return "path", f.path, None, ()
+    # Workers tail a download until it's complete, then get it like an archive.
+    if isinstance(f, RemoteFile) and not f.complete:
+        fd = os.dup(f._download.file.fileno())
+        return "tail", (f.size, f.mtime), f.etag, (fd,)
+    snapshot = f.snapshot()
+    return "fd", None, snapshot.etag, (os.open(snapshot.path, os.O_RDONLY | os.O_CLOEXEC),)
+
+class RemoteRequest(Observable):
+    # Stands in for a request served by a worker. It triggers the same events
+    # as server.Request and can be canceled the same way.
+    canceled = False
+    finished = False
+    progress = Progress.NONE
+    sent = 0
+    file = None
+    received = None
+
+    def __init__(self, worker, rid, client_address):
+        super().__init__()
+        self.worker = worker
+        self.rid = rid
+        self.client_address = client_address
+        self.started = time.monotonic()
+        self.files = []
+
+    def cancel(self):
+        # The worker reports the removal once it's done.
+        self.canceled = True
+        try:
+            self.worker.channel.send(("cancel", self.rid))
+        except OSError:
+            self._drop()
+
+    def _drop(self):
+        for f in self.files:
+            if self in f.requests:
+                f._unregister_request(self)
+
+class _Worker(Thread):
+    # A worker process and the thread relaying its events.
+    daemon = True
+
+    def __init__(self, server, index):
+        super().__init__(name="platter-worker-%d" % index)
+        self.server = server
+        self.requests = {}
+        self.ready = Event()
+        parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        with child:
+            self.process = subprocess.Popen(
+                [sys.executable, "-c", "from platter.prefork import run_worker; run_worker(%d)" % child.fileno()],
+                pass_fds=(child.fileno(),),
+                env=_worker_env(),
+            )
+        self.channel = Channel(parent)
+
+    def send(self, message, fds=()):
+        try:
+            self.channel.send(message, fds)
+        except OSError:
+            # Dead, the supervisor will replace it.
+            pass
+
+    def run(self):
+        while True:
+            try:
+                message, fds = self.channel.recv()
+            except (OSError, EOFError):
+                break
+            try:
+                getattr(self, "_on_" + message[0])(*message[1:])
+            except Exception:
+                traceback.print_exc()
+        self.channel.close()
+        for request in self.requests.values():
+            if self.server.metrics is not None:
+                self.server.metrics.end(request)
+            if not request.finished:
+                request.finished = True
+                request.trigger("failure")
+        self.requests.clear()
+        self.ready.set()
+
+    def _on_ready(self):
+        self.ready.set()
+
+    def _on_add(self, fid, rid, client_address):
+        request = self.requests.get(rid)
+        if request is None:
+            request = self.requests[rid] = RemoteRequest(self, rid, client_address)
+        f = self.server.files.get(fid)
+        if f is not None:
+            request.files.append(f)
+            f._register_request(request)
+
+    def _on_remove(self, fid, rid):
+        request = self.requests.get(rid)
+        if request is None:
+            return
+        for f in request.files:
+            if f.fid == fid and request in f.requests:
+                f._unregister_request(request)
+
+    # Requests canceled part way through are forgotten before they've
+    # finished; whatever the worker reports about them after that is dropped.
+    def _on_forget(self, rid):
+        request = self.requests.pop(rid, None)
+        if request is not None and self.server.metrics is not None:
+            self.server.metrics.end(request)
+
+    def _on_start(self, rid):
+        self._trigger(rid, "start")
+
+    def _on_success(self, rid):
+        self._trigger(rid, "success")
+
+    def _on_failure(self, rid):
+        self._trigger(rid, "failure")
+
+    def _trigger(self, rid, state):
+        request = self.requests.get(rid)
+        if request is not None:
+            request.finished = state != "start"
+            request.trigger(state)
+
+    def _on_progress(self, rid, sent, total, rate, eta):
+        request = self.requests.get(rid)
+        if request is not None:
+            request.sent = sent
+            request.progress = Progress(sent, total, rate, eta)
+            request.trigger("progress", request.progress)
+
+    def _on_begin(self, rid, fid, started):
+        request = self.requests.get(rid)
+        if request is not None and self.server.metrics is not None:
+            request.started = started
+            request.file = self.server.files.get(fid)
+            self.server.metrics.begin(request)
+
+    def _on_end(self, rid, sent):
+        request = self.requests.get(rid)
+        if request is not None and self.server.metrics is not None:
+            request.sent = sent
+            self.server.metrics.end(request)
+
+    def _on_reject(self):
+        if self.server.metrics is not None:
+            self.server.metrics.reject()
+
+    def _on_render(self, token):
+        self.send(("reply", token, self.server.metrics.render()))
+
+    def _on_upload(self, rid, client_address):
+        request = self.requests[rid] = RemoteRequest(self, rid, client_address)
+        self.server.trigger("upload", request)
+
+    def _on_receive(self, token, rid, path):
+        f = self.server.serve([path])
+        request = self.requests.get(rid)
+        if request is not None:
+            request.received = f
+        self.send(("reply", token, f.fid))
+
+    def _on_checksum(self, fid):
+        f = self.server.files.get(fid)
+        if f is not None:
+            f._start_checksum()
+
+    def stop(self):
+        self.send(("stop",))
+        try:
+            self.process.wait(STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+def _worker_env():
+    # The workers import platter from wherever we did.
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, (root, env.get("PYTHONPATH"))))
+    return env
+
+class PreforkServer(Catalog):
+    # Has the same interface as server.Server. Connections are handled by
+    # workers processes running the given engine; rate limits and
+    # max_transfers/max_queued are split between them.
+
+    def __init__(self, engine="threads", address=("", 10700), workers=2, **options):
+        if engine not in ENGINES:
+            raise ValueError("Unknown server engine: %s" % engine)
+        options.setdefault("max_transfers", MAX_TRANSFERS[engine])
+        Catalog.__init__(self, **options)
+        # Holds the port (and picks one if asked for port 0) without
+        # accepting anything itself.
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.socket.bind(address)
+        self.server_address = self.socket.getsockname()
+        self.server_port = self.server_address[1]
+
+        variant_cache = self.variant_cache
+        self._config = dict(
+            engine=engine,
+            address=(address[0], self.server_port),
+            options=dict(
+                progress_rate=self.progress_rate,
+                rate_limit=_share(options.get("rate_limit"), workers),
+                client_rate_limit=options.get("client_rate_limit"),
+                bundle_multiget=self.bundle_multiget,
+                compress_transfers=self.compress_transfers,
+                variant_cache=(variant_cache.max_size, variant_cache.directory) if variant_cache else None,
+                metrics=self.metrics is not None,
+                checksums=self.digests is not None,
+                upload_dir=self.upload_dir,
+                max_transfers=-(-self.max_transfers//workers),
+                max_queued=-(-self.max_queued//workers),
+                timeout=self.timeout,
+                retry_after=self.retry_after,
+            ),
+        )
+        self._lock = Lock()
+        self._loaded = set()
+        self._limits = {}
+        self._stop = Event()
+        self._stopped = Event()
+        self._stopped.set()
+        self._workers = [None]*workers
+        if self.digests is not None:
+            self.digests.on("digest", self._send_digest)
+        for index in range(workers):
+            self._spawn(index)
+        for worker in self._workers:
+            worker.ready.wait(START_TIMEOUT)
+
+    def _spawn(self, index):
+        worker = _Worker(self, index)
+        with self._lock:
+            worker.send(("config", self._config))
+            if self.digests is not None:
+                worker.send(("digests", self.digests.items()))
+            for f in self.files.values():
+                self._send_file(worker, f)
+            for (method, fid), rate in self._limits.items():
+                worker.send(("limit", method, fid, rate))
+            self._workers[index] = worker
+        worker.start()
+        return worker
+
+    def _broadcast(self, message, fds=()):
+        # Must be called with the lock held.
+        for worker in self._workers:
+            if worker is not None:
+                worker.send(message, fds)
+
+    # Workers don't hash anything themselves.
+    def _send_digest(self, key, digest):
+        with self._lock:
+            self._broadcast(("digest", key, digest))
+
+    def _send_file(self, worker, f):
+        worker.send(("add", f.fid, f.name, not f.seekable))
+        if f.fid in self._loaded:
+            self._send_state(worker.send, f)
+
+    def _send_state(self, send, f):
+        kind, data, etag, fds = _describe(f)
+        try:
+            send(("load", f.fid, kind, data, etag), fds)
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def _announce(self, f, update=False):
+        with self._lock:
+            if f.fid not in self.files or f.failed or (f.fid in self._loaded and not update):
+                return
+            self._loaded.add(f.fid)
+            self._send_state(self._broadcast, f)
+
+    def serve(self, fpaths):
+        f = Catalog.serve(self, fpaths)
+        with self._lock:
+            self._broadcast(("add", f.fid, f.name, not f.seekable))
+        f.on("load", partial(self._announce, f))
+        f.on("update", partial(self._announce, f, True))
+        if f.loaded:
+            self._announce(f)
+        return f
+
+    def unserve(self, file):
+        if not Catalog.unserve(self, file):
+            return False
+        with self._lock:
+            self._loaded.discard(file.fid)
+            for key in [key for key in self._limits if key[1] == file.fid]:
+                del self._limits[key]
+            self._broadcast(("remove", file.fid))
+        return True
+
+    def _set_limit(self, method, fid, rate):
+        with self._lock:
+            self._limits[(method, fid)] = rate
+            self._broadcast(("limit", method, fid, rate))
+
+    def set_rate_limit(self, rate):
+        Catalog.set_rate_limit(self, rate)
+        self._set_limit("set_rate_limit", None, _share(rate, len(self._workers)))
+
+    def set_client_rate_limit(self, rate):
+        # A client whose connections land on several workers gets this
+        # much from each of them.
+        Catalog.set_client_rate_limit(self, rate)
+        self._set_limit("set_client_rate_limit", None, rate)
+
+    def set_file_rate_limit(self, file, rate):
+        Catalog.set_file_rate_limit(self, file, rate)
+        self._set_limit("set_file_rate_limit", file.fid, _share(rate, len(self._workers)))
+
+    def set_file_weight(self, file, weight):
+        Catalog.set_file_weight(self, file, weight)
+        self._set_limit("set_file_weight", file.fid, weight)
+
+    def serve_forever(self):
+        self._stop.clear()
+        self._stopped.clear()
+        try:
+            while not self._stop.wait(SUPERVISE_INTERVAL):
+                for index, worker in enumerate(self._workers):
+                    if worker.process.poll() is not None:
+                        self._spawn(index)
+        finally:
+            self._stopped.set()
+
+    def shutdown(self):
+        self._stop.set()
+        self._stopped.wait()
+
+    def server_close(self):
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.stop()
+        self.socket.close()
+
+# Worker side.
+
+class MirrorFile(RealFile):
+    # A file loaded by the main process. Archives arrive as a descriptor,
+    # plain files as a path so they're reopened for every request as usual.
+
+    def __init__(self, server, fid, name, link):
+        RealFile.__init__(self, server, fid, name)
+        self.link = link
+        self._etag = None
+        self._fds = []
+        self._tail = None
+        self._current = None
+        self.once("unload", self._close)
+
+    def snapshot(self):
+        return self._current or self
+
+    @property
+    def size(self):
+        if self._current is not None:
+            return self._current.size
+        return RealFile.size.fget(self)
+
+    @property
+    def etag(self):
+        if self._current is not None:
+            return self._current.etag
+        if self._etag is None and self._filepath is not None:
+            return RealFile.etag.fget(self)
+        return self._etag
+
+    # Checksums are computed by the main process and sent to every worker.
+    def checksum(self):
+        future = RealFile.checksum(self)
+        if future is not None and not future.done():
+            self.link.send(("checksum", self.fid))
+        return future
+
+    @property
+    def mtime(self):
+        if self._current is not None:
+            return self._current.mtime
+        if self._filepath is None and self._tail is not None:
+            return self._tail[2]
+        return RealFile.mtime.fget(self)
+
+    def open(self):
+        if self._current is not None:
+            return self._current.open()
+        if self._filepath is None and self._tail is not None:
+            fd, length, _ = self._tail
+            return Tail(fd, length, PolledGrowth(fd, length, lambda: self._tail is None))
+        return RealFile.open(self)
+
+    # A download the main process is still fetching.
+    def tail(self, info, etag, fds):
+        length, mtime = info
+        self._fds.append(fds[0])
+        self._tail = (fds[0], length, mtime)
+        self._etag = etag
+        self._size = length
+        self._compressible = False
+        self._loaded.set()
+        self.trigger("load")
+
+    def load(self, path, etag, fds):
+        if fds:
+            path = "/proc/self/fd/%d" % fds[0]
+            # Like MultiFile, keep the previous archive open for the
+            # requests still reading it.
+            self._fds.append(fds[0])
+            while len(self._fds) > 2:
+                os.close(self._fds.pop(0))
+            self._current = Snapshot(self, path, etag)
+        if not self.loaded:
+            self._etag = etag
+            self._finish(path)
+            return
+        self._filepath = path
+        self._compressible = None
+        self.trigger("update")
+
+    def _close(self):
+        self._tail = None
+        for fd in self._fds:
+            os.close(fd)
+        self._fds = []
+
+class MirrorStream(File):
+    # The worker side of a StreamingMultiFile.
+    seekable = False
+
+    def __init__(self, server, fid, name, link):
+        File.__init__(self, server, fid, name)
+
+    def load(self, stats, etag, fds):
+        self._entries = [Entry.from_path(path, st) for path, st in stats]
+        self._etag = etag
+        self._size = ZipStream.length(self._entries)
+        self._mtime = max((e.mtime for e in self._entries), default=0)
+        self._loaded.set()
+        self.trigger("load")
+
+    @property
+    def etag(self):
+        if self.loaded:
+            return self._etag
+
+    @property
+    def size(self):
+        if self.loaded:
+            return self._size
+
+    @property
+    def mtime(self):
+        if self.loaded:
+            return self._mtime
+
+    def open(self):
+        return ZipStream(self._entries)
+
+class _MetricsRelay:
+    # Takes the place of metrics.Metrics in a worker; the main process does
+    # the counting.
+
+    def __init__(self, link):
+        self.link = link
+
+    def begin(self, transfer):
+        rid = self.link.rid(transfer)
+        if rid is not None:
+            fid = transfer.file.fid if transfer.file is not None else None
+            self.link.send(("begin", rid, fid, transfer.started))
+
+    def end(self, transfer):
+        rid = self.link.rid(transfer)
+        if rid is not None:
+            self.link.send(("end", rid, transfer.sent))
+
+    def reject(self):
+        self.link.send(("reject",))
+
+    def add_file(self, file):
+        pass
+
+    def forget_file(self, file):
+        pass
+
+    def render(self):
+        return self.link.call("render") or b""
+
+class _Link:
+    # A worker's end of the channel: numbers requests and forwards their
+    # events, and applies the main process's changes to the catalog.
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.server = None
+        self._lock = Lock()
+        self._rids = {}
+        self._requests = {}
+        self._next = itertools.count()
+        self._tokens = itertools.count()
+        self._calls = {}
+
+    def send(self, message):
+        try:
+            self.channel.send(message)
+        except OSError:
+            pass
+
+    # Sends (kind, token, *args) and waits for the main process to reply,
+    # returns None if it doesn't.
+    def call(self, kind, *args):
+        token = next(self._tokens)
+        done = self._calls[token] = [Event(), None]
+        self.send((kind, token) + args)
+        done[0].wait(CALL_TIMEOUT)
+        return self._calls.pop(token)[1]
+
+    def rid(self, request):
+        return self._rids.get(request)
+
+    def _number(self, request):
+        # Must be called with the lock held.
+        rid = self._rids[request] = next(self._next)
+        self._requests[rid] = [request, 0]
+        for state in ("start", "success", "failure"):
+            request.on(state, partial(self.send, (state, rid)))
+        request.on("progress", partial(self._progress, rid))
+        return rid
+
+    def track(self, fid, request):
+        with self._lock:
+            rid = self._rids.get(request)
+            if rid is None:
+                rid = self._number(request)
+            self._requests[rid][1] += 1
+            self.send(("add", fid, rid, request.client_address))
+
+    # Uploads aren't registered with any file, they're forgotten once done.
+    def track_upload(self, request):
+        with self._lock:
+            rid = self._number(request)
+            self.send(("upload", rid, request.client_address))
+        for state in ("success", "failure"):
+            request.on(state, partial(self._forget, request))
+
+    def _forget(self, request):
+        with self._lock:
+            rid = self._rids.pop(request, None)
+            if rid is not None:
+                del self._requests[rid]
+                self.send(("forget", rid))
+
+    def receive(self, request, path):
+        fid = self.call("receive", self.rid(request), path)
+        return self.server.files.get(fid)
+
+    def untrack(self, fid, request):
+        with self._lock:
+            rid = self._rids.get(request)
+            if rid is None:
+                return
+            self.send(("remove", fid, rid))
+            entry = self._requests[rid]
+            entry[1] -= 1
+            if not entry[1]:
+                del self._requests[rid]
+                del self._rids[request]
+                self.send(("forget", rid))
+
+    def _progress(self, rid, progress):
+        self.send(("progress", rid) + tuple(progress))
+
+    def run(self):
+        while True:
+            try:
+                message, fds = self.channel.recv()
+            except (OSError, EOFError):
+                break
+            if message[0] == "stop":
+                break
+            try:
+                getattr(self, "_on_" + message[0])(*message[1:], fds=fds)
+            except Exception:
+                traceback.print_exc()
+        self.server.shutdown()
+
+    def _on_add(self, fid, name, streaming, fds):
+        f = (MirrorStream if streaming else MirrorFile)(self.server, fid, name, self)
+        f.on("add", partial(self.track, fid))
+        f.on("remove", partial(self.untrack, fid))
+        self.server.files[fid] = f
+
+    def _on_load(self, fid, kind, data, etag, fds):
+        f = self.server.files.get(fid)
+        if f is None:
+            for fd in fds:
+                os.close(fd)
+            return
+        if kind == "tail":
+            f.tail(data, etag, fds)
+        else:
+            f.load(data, etag, fds)
+
+    def _on_remove(self, fid, fds):
+        f = self.server.files.get(fid)
+        if f is not None:
+            f.stop()
+
+    def _on_cancel(self, rid, fds):
+        entry = self._requests.get(rid)
+        if entry is not None:
+            entry[0].cancel()
+
+    def _on_limit(self, method, fid, rate, fds):
+        if fid is None:
+            getattr(self.server, method)(rate)
+        elif fid in self.server.files:
+            getattr(self.server, method)(self.server.files[fid], rate)
+
+    def _on_reply(self, token, value, fds):
+        done = self._calls.get(token)
+        if done is not None:
+            done[1] = value
+            done[0].set()
+
+    def _on_digest(self, key, digest, fds):
+        if self.server.digests is not None:
+            self.server.digests.add(key, digest)
+
+    def _on_digests(self, items, fds):
+        for key, digest in items:
+            self._on_digest(key, digest, fds)
+
+def run_worker(fd):
+    # The main process decides when we stop.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    channel = Channel(socket.socket(fileno=fd))
+    (_, config), _ = channel.recv()
+    options = config["options"]
+    metrics = options.pop("metrics")
+    if options["variant_cache"] is not None:
+        options["variant_cache"] = VariantCache(*options["variant_cache"])
+
+    link = _Link(channel)
+    link.server = make_server(config["engine"], config["address"], reuse_port=True, metrics=False, **options)
+    if metrics:
+        link.server.metrics = _MetricsRelay(link)
+    link.server.on("upload", link.track_upload)
+    link.server.receive = link.receive
+    if link.server.digests is not None:
+        link.server.digests = Digests(workers=0)
+    link.send(("ready",))
+    Thread(target=link.run, daemon=True).start()
+    link.server.serve_forever()
+    link.server.server_close()
@@ -0,0 +1,90 @@
+import time
+from collections import namedtuple
+
+from .event import Observable
+
+__all__ = ("Progress", "Transfer")
+
+# Weight of the latest sample in the smoothed transfer rate.
+RATE_SMOOTHING = 0.3
+
+class Progress(namedtuple("Progress", ("sent", "total", "rate", "eta"))):
+    # sent and total are in bytes, rate in bytes per second and eta in
+    # seconds (None while unknown).
+    __slots__ = ()
+
+    @property
+    def percent(self):
+        if not self.total:
+            return 100.0
+        return self.sent/self.total*100
+
+Progress.NONE = Progress(0, 0, 0.0, None)
+
+class Transfer(Observable):
+    # Tracks the bytes sent by a request and triggers coalesced "progress"
+    # events at most progress_rate times per second. If bandwidth is set to a
+    # throttle.Scheduler the transfer is registered with it while it runs,
+    # and likewise with metrics.Metrics.
+    canceled = False
+    progress = Progress.NONE
+    progress_rate = 10
+    bandwidth = None
+    metrics = None
+
+    def __init__(self):
+        super().__init__()
+        self.started = time.monotonic()
+
+    def _begin(self, total):
+        now = time.monotonic()
+        self.sent = 0
+        self.total = total
+        self._interval = 1/self.progress_rate if self.progress_rate else 0
+        self._last_time = now
+        self._last_sent = 0
+        self._rate = 0.0
+        self.progress = Progress(0, total, 0.0, None)
+        if self.bandwidth is not None:
+            self.bandwidth.register(self, self.client_address[0], self.file)
+        if self.metrics is not None:
+            self.metrics.begin(self)
+
+    def _end(self):
+        if self.bandwidth is not None:
+            self.bandwidth.unregister(self)
+        if self.metrics is not None:
+            self.metrics.end(self)
+
+    def _chunk_size(self, size):
+        if self.bandwidth is None or not self.bandwidth.limited:
+            return size
+        return min(size, self.bandwidth.chunk_size(self))
+
+    # How long to wait before sending nbytes.
+    def _delay(self, nbytes):
+        if self.bandwidth is None or not self.bandwidth.limited:
+            return 0
+        return self.bandwidth.delay(self, nbytes)
+
+    def _sent(self, nbytes):
+        self.sent += nbytes
+        now = time.monotonic()
+        if now - self._last_time >= self._interval:
+            self._report(now)
+
+    def _report(self, now):
+        elapsed = now - self._last_time
+        if elapsed > 0:
+            rate = (self.sent - self._last_sent)/elapsed
+            self._rate = rate if not self._rate else (
+                RATE_SMOOTHING*rate + (1 - RATE_SMOOTHING)*self._rate
+            )
+        self._last_time = now
+        self._last_sent = self.sent
+        eta = (self.total - self.sent)/self._rate if self._rate else None
+        self.progress = Progress(self.sent, self.total, self._rate, eta)
+        self.trigger("progress", self.progress)
+
+    def _done(self):
+        self._report(time.monotonic())
@@ -1,10 +1,14 @@
-from .app import PlatterQt, AlreadyRunning
-
 def main():
     import sys
-    try:
-        app = PlatterQt(sys.argv)
-    except AlreadyRunning:
+    from ..options import make_parser, file_groups, should_forward
+    from ..control import forward
+
+    # Hand the files to a running instance before paying for Qt.
+    parser = make_parser()
+    args = parser.parse_args(sys.argv[1:])
+    args.groups = file_groups(args)
+    if should_forward(parser, args) and forward(args.groups):
         return 0
-    else:
-        return app.exec_()
+
+    from .app import PlatterQt
+    return PlatterQt(sys.argv).exec_()
@@ -1,66 +1,45 @@
 from PyQt5 import QtWidgets
-from ..util import async
-from ..dbus import get_instance, PlatterServerDBus
+from ..util import run_async, is_url
 import os, threading
-import argparse
 
 from .ui import PlatterQtUI
-from ..server import Server
-
-class AlreadyRunning(Exception):
-    pass
+from ..server import make_server
+from ..options import make_parser, file_groups, server_options
+from ..control import ControlServer
 
 def parse_args(args):
-    parser = argparse.ArgumentParser()
-    def path_exists(string):
-        if os.path.exists(string):
-            return string
-        else:
-            raise argparse.ArgumentTypeError("Path '%s' does not exist." % string)
-
-    parser.add_argument("files",
-                        nargs='*',
-                        type=path_exists,
-                        default = [],
-                       )
-    parser.add_argument(
-        "-a",
-        "--archive",
-        nargs='+',
-        default = [],
-        action='append',
-        type=path_exists,
-        dest="archives"
-    )
-    args = parser.parse_args()
-    return [[fpath] for fpath in args.files] + args.archives
+    args = make_parser().parse_args(args)
+    args.groups = file_groups(args)
+    return args
 
 
 class PlatterQt(QtWidgets.QApplication):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # Without D-Bus, running instances are still found through the
+        # control socket.
         dbus_enabled = True
         try:
             from dbus.mainloop.pyqt5 import DBusQtMainLoop
             DBusQtMainLoop(set_as_default=True)
         except ImportError:
             dbus_enabled = False
-            pass
 
-        fpaths = parse_args(self.arguments()[1:])
+        args = parse_args(self.arguments()[1:])
+        fpaths = args.groups
 
+        self.server = make_server(args.engine, (args.bind, args.port), **server_options(args))
         if dbus_enabled:
-            inst = get_instance()
-            if inst:
-                if fpaths:
-                    for fpath in fpaths:
-                        inst.AddFiles(fpath)
-                    raise AlreadyRunning()
-
-
-        self.server = Server()
-        if dbus_enabled:
-            PlatterServerDBus(self.server)
+            try:
+                from ..dbus import PlatterServerDBus
+                PlatterServerDBus(self.server)
+            except Exception:
+                pass
+        try:
+            self.control = ControlServer(self.server)
+            self.control.start()
+        except OSError:
+            self.control = None
         self.main = PlatterQtUI()
         self.connectSignals()
 
@@ -81,17 +60,19 @@ class PlatterQt(QtWidgets.QApplication):
         self._shutdown()
 
     def addFiles(self, fpaths):
-        if all(os.path.exists(fpath) for fpath in fpaths):
+        if all(os.path.exists(fpath) or is_url(fpath) for fpath in fpaths):
             self.server.serve(fpaths)
             return True
         else:
             return False
 
     def _shutdown(self):
+        if self.control is not None:
+            self.control.close()
         self.server.shutdown()
         self.server_thread.join()
 
-    @async
+    @run_async
     def shutdown(self):
         self._shutdown()
         self.quit()
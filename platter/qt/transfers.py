@@ -0,0 +1,144 @@
+import functools
+from PyQt5 import QtGui, QtCore, QtWidgets
+
+from ..event import EventQueue
+
+__all__ = ("TransferModel", "TransferDelegate", "format_size", "format_progress")
+
+# How often (in ms) queued events are applied and progress is repainted.
+UPDATE_INTERVAL = 100
+
+PercentRole = QtCore.Qt.UserRole
+
+def format_size(size):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = "TiB"
+    return "%.1f %s" % (size, unit) if unit != "B" else "%d B" % size
+
+def format_progress(progress):
+    text = "{} of {}".format(format_size(progress.sent), format_size(progress.total))
+    if progress.rate:
+        text += " at {}/s".format(format_size(progress.rate))
+    if progress.eta is not None:
+        minutes, seconds = divmod(int(progress.eta), 60)
+        text += ", {}:{:02d} left".format(minutes, seconds)
+    return text
+
+class TransferModel(QtCore.QAbstractListModel):
+    # One row per request for a file. Request threads never wait on the GUI:
+    # they only queue events, which are applied from a timer along with a
+    # single repaint of every row whose progress changed.
+
+    def __init__(self, file, parent=None):
+        super().__init__(parent)
+        self.file = file
+        self.rows = []
+        self.events = EventQueue()
+
+        file.on("add", self.onAdd, weak=True)
+        file.on("remove", self.onRemove, weak=True, queue=self.events)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.update)
+        self.timer.start(UPDATE_INTERVAL)
+
+    # Called from the request's thread, before it sends anything.
+    def onAdd(self, request):
+        for state in ("success", "failure"):
+            request.on(state, self.events.wrap(functools.partial(self.onState, request, state)))
+        self.events.wrap(self.onInsert)(request)
+
+    def onInsert(self, request):
+        row = len(self.rows)
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        self.rows.append([request, request.progress, None])
+        self.endInsertRows()
+
+    def onRemove(self, request):
+        for row, (r, _, _) in enumerate(self.rows):
+            if r is request:
+                self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+                del self.rows[row]
+                self.endRemoveRows()
+                return
+
+    def onState(self, request, state):
+        for row, entry in enumerate(self.rows):
+            if entry[0] is request:
+                entry[2] = state
+                self.dataChanged.emit(self.index(row), self.index(row))
+                return
+
+    def update(self):
+        self.events.drain()
+        first = last = None
+        for row, entry in enumerate(self.rows):
+            progress = entry[0].progress
+            if progress is not entry[1]:
+                entry[1] = progress
+                if first is None:
+                    first = row
+                last = row
+        if first is not None:
+            self.dataChanged.emit(self.index(first), self.index(last))
+
+    def cancel(self, row):
+        self.rows[row][0].cancel()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        request, progress, state = self.rows[index.row()]
+        if role == PercentRole:
+            return 100 if state == "success" else int(progress.percent)
+        if role == QtCore.Qt.DisplayRole:
+            client = "{}:{}".format(*request.client_address)
+            if state == "success":
+                return "{} - Completed".format(client)
+            if state == "failure":
+                return "{} - Failed".format(client)
+            return "{} - {}% - {}".format(client, int(progress.percent), format_progress(progress))
+        return None
+
+class TransferDelegate(QtWidgets.QStyledItemDelegate):
+    # Paints a row as a progress bar with a cancel button on its right.
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.close_icon = QtGui.QIcon.fromTheme("window-close")
+
+    def _closeRect(self, rect):
+        size = rect.height() - 8
+        return QtCore.QRect(rect.right() - size - 4, rect.top() + 4, size, size)
+
+    def paint(self, painter, option, index):
+        bar = QtWidgets.QStyleOptionProgressBar()
+        bar.rect = option.rect.adjusted(4, 4, -option.rect.height() - 4, -4)
+        bar.state = option.state | QtWidgets.QStyle.State_Horizontal
+        bar.minimum = 0
+        bar.maximum = 100
+        bar.progress = index.data(PercentRole)
+        bar.text = index.data(QtCore.Qt.DisplayRole)
+        bar.textVisible = True
+        bar.textAlignment = QtCore.Qt.AlignCenter
+
+        style = option.widget.style() if option.widget else QtWidgets.QApplication.style()
+        style.drawControl(QtWidgets.QStyle.CE_ProgressBar, bar, painter, option.widget)
+        self.close_icon.paint(painter, self._closeRect(option.rect))
+
+    def sizeHint(self, option, index):
+        return QtCore.QSize(300, option.fontMetrics.height() + 16)
+
+    def editorEvent(self, event, model, option, index):
+        if (event.type() == QtCore.QEvent.MouseButtonRelease
+                and self._closeRect(option.rect).contains(event.pos())):
+            model.cancel(index.row())
+            return True
+        return False
@@ -3,6 +3,7 @@ import qrcode.image.svg
 from PyQt5 import QtGui, QtCore, QtWidgets, QtSvg
 from io import BytesIO
 from .common import sync
+from .transfers import TransferModel, TransferDelegate
 
 try:
     # Attempt to use gtk icon theme.
@@ -101,15 +102,9 @@ class FilePane(QtWidgets.QWidget):
     def __init__(self, f):
         super().__init__()
         self.app = QtWidgets.QApplication.instance()
-        self.transfer_panes = {}
         self.file = f
 
         self.initUI()
-        self.connectSignals()
-
-    def connectSignals(self):
-        self.file.on("add", sync(self.onAddTransfer, True))
-        self.file.on("remove", sync(self.onRemoveTransfer))
 
     def initUI(self):
         container = QtWidgets.QHBoxLayout()
@@ -161,81 +156,13 @@ class FilePane(QtWidgets.QWidget):
         return url_pane
 
     def makeTransfersPane(self):
-        transfers_container = QtWidgets.QWidget()
-        self.transfers_pane = QtWidgets.QVBoxLayout()
-        self.transfers_pane.setSpacing(0)
-        self.transfers_pane.setContentsMargins(0,0,0,0)
-        self.transfers_pane.addStretch(1)
-
-        outer_layout = QtWidgets.QVBoxLayout()
-        outer_layout.addLayout(self.transfers_pane)
-        outer_layout.addStretch(1)
-        transfers_container.setLayout(outer_layout)
-
-        scroll_container = QtWidgets.QScrollArea()
-        scroll_container.setWidget(transfers_container)
-        scroll_container.setWidgetResizable(True)
-        return scroll_container
+        self.transfers = TransferModel(self.file, self)
+        view = QtWidgets.QListView()
+        view.setModel(self.transfers)
+        view.setItemDelegate(TransferDelegate(view))
+        view.setUniformItemSizes(True)
+        view.setSelectionMode(QtWidgets.QAbstractItemView.NoSelection)
+        return view
 
     def copyToClipboard(self):
         self.app.clipboard().setText(self.file.url)
-
-    def onAddTransfer(self, request):
-        transfer = TransferPane(request)
-        self.transfer_panes[request] = transfer
-        self.transfers_pane.addWidget(transfer)
-
-    def onRemoveTransfer(self, request):
-        transfer = self.transfer_panes.pop(request)
-        self.transfers_pane.removeWidget(transfer)
-        v = transfer.layout().takeAt(0)
-        while v:
-            v.widget().hide()
-            v = transfer.layout().takeAt(0)
-
-class TransferPane(QtWidgets.QWidget):
-    def __init__(self, request):
-        super().__init__()
-        self.app = QtWidgets.QApplication.instance()
-        self.request = request
-
-        self.initUI()
-        self.connectSignals()
-
-    def initUI(self):
-        self.progress_bar = QtWidgets.QProgressBar()
-
-        self.progress_bar.setFormat("{}:{} - %p%".format(*self.request.client_address))
-        self.progress_bar.setValue(self.request.progress)
-        self.progress_bar.setSizePolicy(QtWidgets.QSizePolicy.Preferred, QtWidgets.QSizePolicy.Preferred)
-
-        self.close_button = QtWidgets.QToolButton()
-        self.close_button.setIcon(QtGui.QIcon.fromTheme("window-close"))
-
-
-        layout = QtWidgets.QHBoxLayout()
-        layout.addWidget(self.progress_bar)
-        layout.addWidget(self.close_button)
-        self.setLayout(layout)
-
-
-    def connectSignals(self):
-        self.request.on("progress", sync(self.onProgress))
-        self.request.on("success", sync(self.onSucceed))
-        self.request.on("failure", sync(self.onFailure))
-
-        self.close_button.clicked.connect(self.onCancel)
-
-    def onProgress(self, progress):
-        self.progress_bar.setValue(progress)
-
-    def onSucceed(self):
-        self.progress_bar.setValue(100)
-        self.progress_bar.setFormat("{}:{} - Completed".format(*self.request.client_address))
-
-    def onFailure(self):
-        self.progress_bar.setFormat("{}:{} - Failed".format(*self.request.client_address))
-    
-    def onCancel(self):
-        self.request.cancel()
-
@@ -0,0 +1,75 @@
+import re
+
+__all__ = ("parse_range", "RangeNotSatisfiable", "Multipart")
+
+_RANGE_SPEC = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+def parse_range(header, size):
+    # Returns a list of (start, stop) pairs (stop exclusive), or None if the
+    # header should be ignored and the whole file sent.
+    if header is None:
+        return None
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes" or not specs:
+        return None
+
+    ranges = []
+    for spec in specs.split(","):
+        if not spec.strip():
+            continue
+        match = _RANGE_SPEC.match(spec)
+        if not match:
+            return None
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            stop = int(last) + 1 if last else size
+            if stop <= start:
+                if last:
+                    return None
+                continue
+        elif last:
+            start = max(size - int(last), 0)
+            stop = size
+        else:
+            return None
+        if start >= size or stop == start:
+            continue
+        ranges.append((start, min(stop, size)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    # Coalesce overlapping ranges so that a client can't ask for the same
+    # bytes over and over again.
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, stop in ranges[1:]:
+        if start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(stop, merged[-1][1]))
+        else:
+            merged.append((start, stop))
+    return merged
+
+class Multipart:
+    def __init__(self, ranges, size, boundary, content_type="application/octet-stream"):
+        self.boundary = boundary
+        self.parts = [(
+            ("\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n" % (
+                boundary, content_type, start, stop-1, size
+            )).encode("ascii"),
+            start,
+            stop
+        ) for start, stop in ranges]
+        self.trailer = ("\r\n--%s--\r\n" % boundary).encode("ascii")
+
+    @property
+    def content_type(self):
+        return "multipart/byteranges; boundary=%s" % self.boundary
+
+    @property
+    def length(self):
+        return sum(len(head) + stop - start for head, start, stop in self.parts) + len(self.trailer)
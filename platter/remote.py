@@ -0,0 +1,236 @@
+import os
+import time
+import socket
+import hashlib
+from tempfile import TemporaryFile
+from threading import Condition
+from http.client import HTTPException
+from urllib.parse import urlsplit, unquote
+from urllib.request import Request, urlopen
+from email.utils import parsedate_to_datetime
+
+__all__ = ("remote_name", "Download", "PolledGrowth", "Tail")
+
+FETCH_CHUNK = 256 << 10
+POLL_INTERVAL = 0.05
+USER_AGENT = "platter"
+
+# Named after the URL as given, not wherever it redirects to.
+def remote_name(url):
+    parts = urlsplit(url)
+    name = unquote(parts.path, errors="surrogateescape").replace("\\", "/").rpartition("/")[2]
+    return name.lstrip(".") or parts.hostname or "download"
+
+def _remote_mtime(headers):
+    try:
+        return parsedate_to_datetime(headers["Last-Modified"]).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+class Download:
+    # Fetches a URL into an anonymous temporary file. Readers can tail the
+    # file (see Tail) while it's still coming in, so however many clients
+    # there are, the URL is only fetched once.
+
+    def __init__(self, url, timeout=60):
+        self.url = url
+        self._response = urlopen(Request(url, headers={"User-Agent": USER_AGENT}), timeout=timeout)
+        headers = self._response.headers
+        self.mtime = _remote_mtime(headers)
+        # Only a strong validator can be passed on as is.
+        etag = headers.get("ETag")
+        self.etag = etag if etag and etag.startswith('"') else None
+        try:
+            self.length = int(headers["Content-Length"])
+        except (TypeError, ValueError):
+            self.length = None
+        self.file = TemporaryFile(buffering=0)
+        self.received = 0
+        self.sha256 = None
+        self.complete = False
+        self.error = None
+        self._cond = Condition()
+        self._listeners = set()
+        self._running = False
+        self._closed = False
+
+    # The file is only written (and, once closed, only closed) by the thread
+    # running this, so close() can't pull it out from under a write.
+    def run(self, progress=None):
+        h = hashlib.sha256()
+        buf = bytearray(FETCH_CHUNK)
+        view = memoryview(buf)
+        with self._cond:
+            self._running = self.error is None
+        try:
+            while self._running:
+                n = self._response.readinto(buf)
+                if not n:
+                    break
+                with self._cond:
+                    if self.error is not None:
+                        break
+                    written = 0
+                    while written < n:
+                        written += os.write(self.file.fileno(), view[written:n])
+                    self.received += n
+                    self._notify()
+                h.update(view[:n])
+                if progress is not None:
+                    progress(self.received)
+            if self.error is None and self.length is not None and self.received != self.length:
+                raise IOError("Download cut short")
+            if self.error is None:
+                # So that the copy stats like the original.
+                os.utime(self.file.fileno(), (self.mtime, self.mtime))
+        except (OSError, HTTPException) as e:
+            self._fail(e)
+        finally:
+            self._response.close()
+        with self._cond:
+            self._running = False
+            if self.error is None:
+                self.length = self.received
+                self.sha256 = h.digest()
+                self.complete = True
+                self._notify()
+            error = self.error
+            closed = self._closed
+        if closed:
+            self.file.close()
+        if error is not None:
+            raise IOError("Download of %s failed: %s" % (self.url, error))
+
+    def _fail(self, error):
+        with self._cond:
+            if self.error is None:
+                self.error = error
+            self._notify()
+
+    # Called with the lock held.
+    def _notify(self):
+        self._cond.notify_all()
+        for callback in self._listeners:
+            callback()
+
+    # callback is called (from the downloading thread) whenever the download
+    # gets further, completes or fails. It mustn't block.
+    def listen(self, callback):
+        with self._cond:
+            self._listeners.add(callback)
+
+    def unlisten(self, callback):
+        with self._cond:
+            self._listeners.discard(callback)
+
+    def stop(self):
+        self._fail("stopped")
+        # Wake run() up if it's waiting on the server.
+        sock = getattr(getattr(self._response.fp, "raw", None), "_sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    # Blocks until there's something past offset (or nothing more is
+    # coming) and returns how much of the file is there.
+    def wait(self, offset):
+        with self._cond:
+            while self.received <= offset and not self.complete and self.error is None:
+                self._cond.wait()
+            if self.error is not None:
+                raise IOError("Download of %s failed: %s" % (self.url, self.error))
+            return self.received
+
+    # Like wait, but returns None instead of blocking.
+    def available(self, offset):
+        with self._cond:
+            if self.error is not None:
+                raise IOError("Download of %s failed: %s" % (self.url, self.error))
+            if self.received <= offset and not self.complete:
+                return None
+            return self.received
+
+    # Can be called from any thread, a running download closes the file
+    # once it has stopped.
+    def close(self):
+        self.stop()
+        with self._cond:
+            self._closed = True
+            if self._running:
+                return
+        self.file.close()
+
+class PolledGrowth:
+    # Stands in for the Download of a file being downloaded by another
+    # process, watching the file grow.
+
+    def __init__(self, fd, length, stopped):
+        self._fd = fd
+        self._length = length
+        self._stopped = stopped
+
+    def available(self, offset):
+        if self._stopped():
+            raise IOError("Download stopped")
+        size = os.fstat(self._fd).st_size
+        return size if size > offset or size >= self._length else None
+
+    def wait(self, offset):
+        while True:
+            size = self.available(offset)
+            if size is not None:
+                return size
+            time.sleep(POLL_INTERVAL)
+
+class Tail:
+    # Reads a file that's still being written, waiting for the bytes that
+    # haven't arrived yet. The source (a Download or PolledGrowth) says how
+    # much of the file is there: source.wait(offset) once there's more than
+    # offset, or all of it, and source.available(offset) right away (None if
+    # that's not yet the case).
+
+    def __init__(self, fd, length, source):
+        self._fd = os.dup(fd)
+        self._length = length
+        self.source = source
+        self._offset = 0
+
+    def seek(self, offset):
+        self._offset = offset
+        return offset
+
+    def tell(self):
+        return self._offset
+
+    def read(self, size=-1):
+        return self._read(size, self.source.wait)
+
+    # Returns None instead of blocking.
+    def read_nowait(self, size=-1):
+        return self._read(size, self.source.available)
+
+    def _read(self, size, available):
+        end = self._length if size < 0 else min(self._length, self._offset + size)
+        if self._offset >= end:
+            return b""
+        available = available(self._offset)
+        if available is None:
+            return None
+        buf = os.pread(self._fd, min(end, available) - self._offset, self._offset)
+        if not buf:
+            raise IOError("Download truncated")
+        self._offset += len(buf)
+        return buf
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,91 +1,541 @@
 from http.server import HTTPServer, BaseHTTPRequestHandler
-from socketserver import ThreadingMixIn
-from threading import Thread, Event
+from threading import Thread, Event, Lock
 from .event import Observable
-from tempfile import TemporaryFile
+from .progress import Transfer
 from .network import find_ip
 import os
+import time
+import queue
+import socket
+import hashlib
 from urllib.parse import quote
 from io import DEFAULT_BUFFER_SIZE as BUF_SIZE
-import itertools
-from zipfile import ZipFile
+from bisect import bisect_right
+from collections import namedtuple
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from email.utils import parsedate_to_datetime, formatdate
 
-from .util import list_files
+from .util import make_code, is_url
+from .options import MAX_TRANSFERS
+from .ranges import parse_range, RangeNotSatisfiable, Multipart
+from .archive import Entry, ZipStream, ArchiveBuilder, compressible
+from .ingest import scan
+from .watch import Watcher
+from .cache import archive_key, variant_key
+from .encoding import negotiate, EncodedReader, MIN_SIZE as MIN_ENCODED_SIZE
+from .throttle import Scheduler
+from .metrics import Metrics, METRICS_PATH, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from .digest import (Digests, stat_key, digest_headers, render_checksum,
+                     SUFFIX as CHECKSUM_SUFFIX, CONTENT_TYPE as CHECKSUM_CONTENT_TYPE)
+from .remote import remote_name, Download, Tail
+from .spool import MemoryBudget, SpoolFile
+from .upload import (UPLOAD_PATH, UPLOAD_CHUNK, MAX_LINE, upload_name, body_length, parse_chunk_size,
+                     render_upload_page, Incoming, BadRequest)
 
 __all__ = ("Observable",)
 
+SENDFILE_SIZE = 1 << 20
+
 def render_multiget(fids):
     return "<p>Downlaoding Files...</p>" + "<br>".join(
         '<iframe style="border: none;" height="0" src="/{url}"><a href="/{url}">url</a></iframe>'.format(url=fid) for fid in fids
     )+"<script>window.open('', '_parent', ''); window.close();</script>"
 
-class Request(BaseHTTPRequestHandler, Observable):
-    canceled = False
-    progress = 0
-    def __init__(self, *args, **kwargs):
-        Observable.__init__(self)
-        BaseHTTPRequestHandler.__init__(self, *args, **kwargs)
+def parse_fids(path):
+    # Parses "/1-5+9" into sorted, merged, inclusive (first, last) intervals
+    # without expanding them.
+    intervals = []
+    try:
+        for piece in path[1:].split('+'):
+            first, sep, last = piece.partition('-')
+            first = int(first)
+            last = int(last) if sep else first
+            if first <= 0 or last < first:
+                return None
+            intervals.append((first, last))
+    except ValueError:
+        return None
 
-    def do_GET(self):
+    intervals.sort()
+    merged = [intervals[0]]
+    for first, last in intervals[1:]:
+        if first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(last, merged[-1][1]))
+        else:
+            merged.append((first, last))
+    return merged
+
+def select_files(files, intervals):
+    starts = [first for first, _ in intervals]
+    selected = []
+    for fid, f in files.items():
+        i = bisect_right(starts, fid) - 1
+        if i >= 0 and fid <= intervals[i][1]:
+            selected.append(f)
+    selected.sort(key=lambda f: f.fid)
+    return selected
+
+# The body is a list of byte strings, (offset, count) slices of the source
+# (opened with open()) and STREAM, which copies the rest of the source. length
+# is what progress is measured against.
+Response = namedtuple("Response", ("status", "headers", "body", "length", "open"))
+STREAM = None
+
+def plan_response(file, request_headers):
+    file = file.snapshot()
+    size = file.size
+    etag = file.etag
+    encodable = _encodable(file)
+    encoding = negotiate(request_headers.get("Accept-Encoding")) if encodable else None
+    validators = [("Last-Modified", formatdate(file.mtime, usegmt=True))]
+    if encodable:
+        validators.append(("Vary", "Accept-Encoding"))
+
+    if _not_modified(file, request_headers, etag, encoding):
+        if etag is not None:
+            validators.append(("ETag", _encoded_etag(etag, encoding)))
+        return Response(304, validators, [], 0, file.open)
+
+    headers = [
+        ("Accept-Ranges", "bytes" if file.seekable else "none"),
+        ("Content-Disposition", "attachment;filename=%s" % quote(file.name)),
+    ] + validators
+
+    try:
+        ranges = _requested_ranges(file, request_headers) if file.seekable else None
+    except RangeNotSatisfiable:
+        return Response(416, [("Content-Range", "bytes */%d" % size), ("Content-Length", 0)], [], 0, file.open)
+
+    if ranges is None and encoding is not None:
+        if etag is not None:
+            headers.append(("ETag", _encoded_etag(etag, encoding)))
+        return _encoded_response(file, encoding, headers)
+    if etag is not None:
+        headers.append(("ETag", etag))
+    digest = file.digest
+    if digest is not None:
+        headers.extend(digest_headers(digest))
+
+    if ranges is None:
+        status = 200
+        headers.append(("Content-Type", "application/octet-stream"))
+        body = [(0, size)]
+        length = size
+    elif len(ranges) == 1:
+        status = 206
+        start, stop = ranges[0]
+        headers.append(("Content-Type", "application/octet-stream"))
+        headers.append(("Content-Range", "bytes %d-%d/%d" % (start, stop-1, size)))
+        body = [(start, stop - start)]
+        length = stop - start
+    else:
+        status = 206
+        multipart = Multipart(ranges, size, make_code(12))
+        headers.append(("Content-Type", multipart.content_type))
+        body = []
+        for head, start, stop in multipart.parts:
+            body.append(head)
+            body.append((start, stop - start))
+        body.append(multipart.trailer)
+        length = multipart.length
+
+    headers.append(("Content-Length", length))
+    return Response(status, headers, body, length, file.open)
 
-        # Multiget
+# Each Content-Encoding is a separate representation with its own tag.
+def _encoded_etag(etag, encoding):
+    if encoding is None:
+        return etag
+    return '%s-%s"' % (etag[:-1], encoding)
+
+def _etag_matches(header, tags, weak):
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            if not weak:
+                continue
+            tag = tag[2:]
+        if tag in tags:
+            return True
+    return False
+
+def _not_modified(file, request_headers, etag, encoding):
+    if_none_match = request_headers.get("If-None-Match")
+    if if_none_match is not None:
+        if etag is None:
+            return False
+        return _etag_matches(if_none_match, {etag, _encoded_etag(etag, encoding)}, weak=True)
+
+    if_modified_since = request_headers.get("If-Modified-Since")
+    if if_modified_since is not None:
         try:
-            fids = set(itertools.chain.from_iterable((range(int(pair[0]), int(pair[1])+1) if len(pair) == 2 else (int(pair[0]),) for pair in (piece.split('-', 1) for piece in self.path[1:].split('+')))))
-        except:
-            self.send_error(404)
+            date = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return int(file.mtime) <= date.timestamp()
+    return False
+
+def _encodable(file):
+    return (
+        file.server.compress_transfers
+        and file.seekable
+        and file.size >= MIN_ENCODED_SIZE
+        and file.compressible
+    )
+
+def _open_variant(cache, key):
+    variant = cache.lookup(key)
+    if variant is None:
+        raise FileNotFoundError("variant %s was evicted" % key)
+    return variant
+
+def _encoded_response(file, encoding, headers):
+    headers.append(("Content-Type", "application/octet-stream"))
+    headers.append(("Content-Encoding", encoding))
+
+    cache = file.server.variant_cache
+    key = None
+    if cache is not None:
+        key = variant_key(file.path, os.stat(file.path), encoding)
+        variant = cache.lookup(key)
+        if variant is not None:
+            # HEAD and 304 responses never open the body, so the variant is
+            # only held open once it's being sent.
+            with variant:
+                size = os.fstat(variant.fileno()).st_size
+            headers.append(("Content-Length", size))
+            return Response(200, headers, [(0, size)], size, lambda: _open_variant(cache, key))
+
+    # We don't know the compressed size up front so the connection is closed
+    # to mark the end of the body.
+    return Response(
+        200, headers, [STREAM], file.size,
+        lambda: EncodedReader(file.open(), encoding, cache, key)
+    )
+
+def _requested_ranges(file, request_headers):
+    if_range = request_headers.get("If-Range")
+    if if_range is not None and not _if_range_matches(file, if_range.strip()):
+        return None
+    return parse_range(request_headers.get("Range"), file.size)
+
+def _if_range_matches(file, validator):
+    # If-Range only accepts strong validators.
+    if validator.startswith(('"', 'W/')):
+        return file.etag is not None and _etag_matches(validator, {file.etag}, weak=False)
+    try:
+        date = parsedate_to_datetime(validator)
+    except (TypeError, ValueError):
+        return False
+    return date.timestamp() == int(file.mtime)
+
+class Request(BaseHTTPRequestHandler, Transfer):
+    # Use the kernel's sendfile when the file has a real file descriptor.
+    zero_copy = True
+    file = None
+    # The file an upload became once it's complete.
+    received = None
+
+    def __init__(self, request, client_address, server):
+        Transfer.__init__(self)
+        self.progress_rate = server.progress_rate
+        self.bandwidth = server.bandwidth
+        self.metrics = server.metrics
+        self.timeout = server.timeout
+        BaseHTTPRequestHandler.__init__(self, request, client_address, server)
+
+    def do_GET(self):
+        self._respond(head=False)
+
+    def do_HEAD(self):
+        self._respond(head=True)
+
+    def do_PUT(self):
+        self._receive()
+
+    def do_POST(self):
+        self._receive()
+
+    def _send_content(self, content_type, content, head):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", len(content))
+        self.end_headers()
+        if not head:
+            self.wfile.write(content)
+
+    def _send_head(self, response):
+        self.send_response(response.status)
+        for header, value in response.headers:
+            self.send_header(header, value)
+        self.end_headers()
+
+    def _respond(self, head):
+        if self.path == METRICS_PATH and self.server.metrics is not None:
+            self._send_content(METRICS_CONTENT_TYPE, self.server.metrics.render(), head)
             return
 
-        if not all(fid > 0 for fid in fids):
-            self.send_error(404)
+        if self.path.endswith(CHECKSUM_SUFFIX):
+            self._send_checksum(head)
             return
 
-        if len(fids) > 1:
-            content = render_multiget(fids).encode('utf-8')
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html")
-            self.send_header("Content-Length", len(content))
-            self.end_headers()
-            self.wfile.write(content)
+        if self.path == UPLOAD_PATH and self.server.upload_dir is not None:
+            self._send_content("text/html; charset=utf-8", render_upload_page(), head)
             return
 
-        try:
-            self.file = self.server.files[tuple(fids)[0]]
-        except:
+        self.file, multiget = self.server.lookup(self.path)
+
+        if multiget:
+            self._send_content("text/html", render_multiget(multiget).encode('utf-8'), head)
+            return
+
+        if self.file is None:
             self.send_error(404)
             return
-        
+
+        # Probes and revalidations of loaded files don't show up as transfers.
+        response = None
+        if head or self.file.loaded:
+            if not self.file.wait(self.server.timeout):
+                self._send_unavailable()
+                return
+            if self.file.failed:
+                self.send_error(404)
+                return
+            response = self._plan_response()
+            if response is None:
+                return
+            if head or response.status == 304:
+                self._send_head(response)
+                return
+
         try:
             self.file._register_request(self)
-            self.send_response(200)
 
-            self.file.wait()
+            # A client waiting for an archive holds on to a worker, so it's
+            # sent away to retry later if the archive takes too long.
+            if not self.file.wait(self.server.timeout):
+                self.trigger("failure")
+                self._send_unavailable()
+                return
+            if self.file.failed:
+                raise IOError("%s failed to load" % self.file.name)
 
             self.trigger("start")
 
-            self.send_header("Content-Type", "application/octet-stream")
-            self.send_header("Content-Disposition", "attachment;filename=%s" % quote(self.file.name))
-            self.send_header('Content-Length', self.file.size)
-            self.end_headers()
-
+            if response is None:
+                response = self._plan_response()
+                if response is None:
+                    return
+            self._send_head(response)
 
-            percent_increment = float(BUF_SIZE)/float(self.file.size)*100
+            if response.status == 416:
+                self.trigger("failure")
+                return
 
-            with self.file.open() as fobj:
-                while True:
-                    buf = fobj.read(BUF_SIZE)
-                    if not buf:
-                        break
-                    if self.canceled:
+            self._begin(response.length)
+            with response.open() as fobj:
+                for part in response.body:
+                    if isinstance(part, bytes):
+                        self.wfile.write(part)
+                        self._sent(len(part))
+                    elif part is STREAM:
+                        if not self._copy_stream(fobj):
+                            return
+                    elif not self._copy(fobj, *part):
                         return
-                    self.wfile.write(buf)
-                    self.progress += percent_increment
-                    self.trigger("progress", self.progress)
         except:
             self.trigger("failure")
         else:
-            self.progress = 100
+            self._done()
             self.trigger("success")
+        finally:
+            self._end()
+
+    # Sends a 404 instead (and returns None) if the file has been deleted or
+    # can't be read since it was served.
+    def _plan_response(self):
+        try:
+            return plan_response(self.file, self.headers)
+        except OSError:
+            self.trigger("failure")
+            self.send_error(404)
+            return None
+
+    def _send_unavailable(self):
+        self.close_connection = True
+        self.wfile.write(render_unavailable(self.server.retry_after))
+
+    # Waits for the checksum if it's still being computed.
+    def _send_checksum(self, head):
+        file, _ = self.server.lookup(self.path[:-len(CHECKSUM_SUFFIX)])
+        future = None
+        if file is not None:
+            if not file.wait(self.server.timeout):
+                self._send_unavailable()
+                return
+            try:
+                future = file.checksum()
+            except OSError:
+                pass
+        if future is None:
+            self.send_error(404)
+            return
+        try:
+            digest = future.result(self.server.timeout)
+        except FutureTimeout:
+            self._send_unavailable()
+            return
+        if digest is None:
+            # Changed while it was being read.
+            self.send_error(503)
+            return
+        self._send_content(CHECKSUM_CONTENT_TYPE, render_checksum(digest, file.name), head)
+
+    # Uploads are streamed to a temporary file next to where they end up,
+    # then served like any other file.
+    def _receive(self):
+        name = upload_name(self.path) if self.server.upload_dir is not None else None
+        if name is None:
+            self.send_error(404)
+            return
+        try:
+            length = body_length(self.headers)
+        except BadRequest as e:
+            self.send_error(e.status)
+            return
+        if self.headers.get("Expect", "").lower() == "100-continue" and self.request_version != "HTTP/1.0":
+            # BaseHTTPRequestHandler leaves this to HTTP/1.1 servers.
+            self.wfile.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+        # Rate limits and metrics are about what we send.
+        self.bandwidth = None
+        self.metrics = None
+        try:
+            upload = Incoming(self.server.upload_dir, name)
+        except OSError:
+            self.send_error(500)
+            return
+        self.server.trigger("upload", self)
+        self.trigger("start")
+        try:
+            self._begin(length or 0)
+            for piece in self._body(length):
+                if self.canceled:
+                    raise ConnectionError("Canceled")
+                upload.write(piece)
+                self._sent(len(piece))
+            path = upload.finish()
+        except Exception as e:
+            upload.discard()
+            self.trigger("failure")
+            if isinstance(e, BadRequest):
+                self.send_error(e.status)
+            elif isinstance(e, OSError) and not isinstance(e, (ConnectionError, TimeoutError)):
+                # Most likely out of space.
+                self.send_error(500)
+            return
+        finally:
+            self._end()
+        self._done()
+
+        self.received = self.server.receive(self, path)
+        content = (self.received.url + "\n").encode("utf-8")
+        self.send_response(201)
+        self.send_header("Location", "/%d" % self.received.fid)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", len(content))
+        self.end_headers()
+        self.wfile.write(content)
+        self.trigger("success")
+
+    # Yields the request body in pieces of up to UPLOAD_CHUNK bytes. Each
+    # piece is only valid until the next one is read.
+    def _body(self, length):
+        view = memoryview(bytearray(UPLOAD_CHUNK))
+        if length is not None:
+            yield from self._read_body(view, length)
+            return
+        while True:
+            size = parse_chunk_size(self.rfile.readline(MAX_LINE))
+            if not size:
+                break
+            yield from self._read_body(view, size)
+            if self.rfile.readline(MAX_LINE).strip():
+                raise BadRequest(400, "Bad chunk")
+        # Trailers
+        while self.rfile.readline(MAX_LINE).strip():
+            pass
+
+    def _read_body(self, view, count):
+        while count:
+            n = self.rfile.readinto(view[:min(count, len(view))])
+            if not n:
+                raise ConnectionError("Upload cut short")
+            count -= n
+            yield view[:n]
+
+    # Returns False if the request was canceled part way through.
+    def _copy(self, fobj, offset, count):
+        if self.zero_copy:
+            try:
+                fobj.fileno()
+            except (AttributeError, OSError):
+                pass
+            else:
+                return self._copy_sendfile(fobj, offset, count)
+        return self._copy_buffered(fobj, offset, count)
+
+    def _copy_sendfile(self, fobj, offset, count):
+        # socket.sendfile falls back on send() if the kernel can't do it.
+        end = offset + count
+        while offset < end:
+            if self.canceled:
+                return False
+            chunk = min(self._chunk_size(SENDFILE_SIZE), end - offset)
+            self._throttle(chunk)
+            sent = self.connection.sendfile(fobj, offset, chunk)
+            if not sent:
+                raise IOError("Unexpected end of file")
+            offset += sent
+            self._sent(sent)
+        return True
+
+    def _copy_buffered(self, fobj, offset, count):
+        if offset:
+            fobj.seek(offset)
+        while count > 0:
+            buf = fobj.read(min(BUF_SIZE, count))
+            if not buf:
+                raise IOError("Unexpected end of file")
+            if self.canceled:
+                return False
+            self._throttle(len(buf))
+            self.wfile.write(buf)
+            count -= len(buf)
+            self._sent(len(buf))
+        return True
 
+    # Progress is measured in bytes consumed from the underlying file.
+    def _copy_stream(self, fobj):
+        consumed = 0
+        while True:
+            buf = fobj.read(SENDFILE_SIZE)
+            if not buf:
+                return True
+            if self.canceled:
+                return False
+            self._throttle(len(buf))
+            self.wfile.write(buf)
+            self._sent(fobj.consumed - consumed)
+            consumed = fobj.consumed
+
+    def _throttle(self, nbytes):
+        delay = self._delay(nbytes)
+        if delay:
+            time.sleep(delay)
 
     def cancel(self):
         self.canceled = True
@@ -99,10 +549,17 @@ class Request(BaseHTTPRequestHandler, Observable):
                 self.rfile.close()
             except:
                 pass
-        self.file._unregister_request(self)
+        if self.file is not None:
+            self.file._unregister_request(self)
 
 class File(Observable):
     size = None
+    etag = None
+    digest = None
+    # Set (along with loaded) if the file couldn't be loaded.
+    failed = False
+    seekable = False
+    compressible = False
 
     def __init__(self, server, fid, name):
         super().__init__()
@@ -117,6 +574,15 @@ class File(Observable):
     def open(self):
         raise NotImplementedError()
 
+    # The version of the file to plan a response from and send.
+    def snapshot(self):
+        return self
+
+    # Returns a Future for the file's SHA-256, or None if there's no
+    # checksum to be had.
+    def checksum(self):
+        return None
+
     @property
     def url(self):
         return "http://%s:%d/%d" % (
@@ -127,11 +593,13 @@ class File(Observable):
     def loaded(self):
         return self._loaded.is_set()
 
-    def wait(self):
-        self._loaded.wait()
+    # Returns False if the file still isn't loaded after timeout seconds.
+    def wait(self, timeout=None):
+        return self._loaded.wait(timeout)
     
     def stop(self):
-        self.server.unserve(self)
+        if not self.server.unserve(self):
+            return
 
         for req in frozenset(self.requests):
             req.cancel()
@@ -146,12 +614,49 @@ class File(Observable):
         self.requests.remove(request)
         self.trigger("remove", request)
 
+class Snapshot:
+    # One version of a file that gets replaced by new ones (see MultiFile),
+    # published in a single assignment. A response planned from a snapshot
+    # also reads it, whatever the file has moved on to since.
+    def __init__(self, file, path, etag):
+        st = os.stat(path)
+        self.file = file
+        self.path = path
+        self.etag = etag
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    @property
+    def digest(self):
+        if self.file.server.digests is not None:
+            return self.file.server.digests.get(os.stat(self.path))
+
+    def open(self):
+        return open(self.path, "rb")
+
 class RealFile(File):
+    seekable = True
+
     def __init__(self, server, fid, name):
         File.__init__(self, server, fid, name)
 
         self._size = None
         self._filepath = None
+        self._compressible = None
+
+    @property
+    def path(self):
+        return self._filepath
+
+    @property
+    def compressible(self):
+        if self._compressible is None:
+            with self.open() as fobj:
+                self._compressible = compressible(self.name, fobj)
+        return self._compressible
 
     def open(self):
         try:
@@ -159,16 +664,52 @@ class RealFile(File):
         except AttributeError:
             raise IOError("File not loaded")
     
+    @property
+    def mtime(self):
+        if self.loaded:
+            return os.stat(self._filepath).st_mtime
+
     @property
     def size(self):
         if self.loaded and self._size is None:
             self._size = os.path.getsize(self._filepath)
         return self._size
 
+    @property
+    def etag(self):
+        if self.loaded:
+            st = os.stat(self._filepath)
+            return '"%x-%x-%x"' % (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    # Only known once computed, and only for the file as it is now.
+    @property
+    def digest(self):
+        if self._filepath is not None and self.server.digests is not None:
+            return self.server.digests.get(os.stat(self._filepath))
+
+    def checksum(self):
+        if self._filepath is None or self.server.digests is None:
+            return None
+        return self.server.digests.compute(self._filepath)
+
+    def _start_checksum(self):
+        try:
+            self.checksum()
+        except OSError:
+            pass
+
     def _finish(self, filepath):
         self._filepath = filepath
         self._loaded.set()
         self.trigger("load")
+        self._start_checksum()
+
+    # Wakes up anyone waiting for the file and drops it.
+    def _fail(self):
+        self.failed = True
+        self._loaded.set()
+        self.trigger("load")
+        self.stop()
 
 class LocalFile(RealFile):
     def __init__(self, server, fid, filepath):
@@ -176,67 +717,560 @@ class LocalFile(RealFile):
         self._finish(filepath)
 
 class MultiFile(Thread, RealFile):
-    def __init__(self, server, fid, name, files):
+    # Everything from walking the paths on happens in the thread so that
+    # serve() returns right away. In watch mode the archive is rebuilt when
+    # the paths change, reusing the compressed data of unchanged entries;
+    # requests already running keep reading the archive they opened.
+    def __init__(self, server, fid, name, paths):
         Thread.__init__(self)
         RealFile.__init__(self, server, fid, name)
 
-        self._files = files
+        self._paths = paths
+        self._stats = None
+        self._archive = None
+        self._retired = None
+        self._index = None
+        self._watcher = None
+        self._current = None
         self.start()
 
     def run(self):
-        files_with_size = [(path, os.path.getsize(path)) for path in self._files]
-        total_size = sum(s for f,s in files_with_size)
-        cur_size = 0
-        file = TemporaryFile(mode='wb')
-        with ZipFile(file, mode='w') as zipfile:
-            for fpath,size in files_with_size:
-                zipfile.write(fpath)
-                cur_size += size
-                self.trigger('loading', (cur_size/total_size*100))
-
-        self.once("unload", lambda: file.close())
-        self._finish("/proc/self/fd/%d" % file.fileno())
+        # Watch before walking so that no change slips through.
+        if self.server.watch:
+            try:
+                self._watcher = Watcher(self._paths, self._refresh)
+            except OSError:
+                pass
+        try:
+            self._stats = scan(self._paths)
+            key = archive_key(self._stats)
+            file = self._build(self._stats, key)
+        except Exception:
+            if self._watcher is not None:
+                self._watcher.close()
+            self._fail()
+            raise
+        self._serve_archive(file, key)
+        if self._watcher is not None:
+            self._watcher.start()
+
+    def _build(self, stats, key):
+        cache = self.server.archive_cache
+        if cache is not None:
+            file = cache.lookup(key)
+            if file is not None:
+                self.trigger('loading', 100)
+                self._index = None
+                return file
+            file = cache.create()
+        else:
+            file = SpoolFile(self.server.archive_memory, self.server.memory_budget)
+
+        entries = [Entry.from_path(path, st) for path, st in stats]
+        total_size = sum(e.size for e in entries) or 1
+        previous = (self._archive, self._index) if self._index is not None else None
+        builder = ArchiveBuilder(entries, self.server.archive_workers, previous)
+        start = time.monotonic()
+        try:
+            builder.write(file, lambda done: self.trigger('loading', done/total_size*100))
+        except:
+            if cache is not None:
+                cache.discard(file)
+            else:
+                file.close()
+            raise
+        if self.server.metrics is not None:
+            self.server.metrics.archive_built(time.monotonic() - start)
+        if self.server.digests is not None:
+            self.server.digests.add(stat_key(os.fstat(file.fileno())), builder.sha256)
+        if cache is not None:
+            cache.commit(file, key)
+        self._index = builder.index
+        return file
+
+    def _refresh(self):
+        try:
+            stats = scan(self._paths)
+            if [(p, _stat_id(st)) for p, st in stats] == [(p, _stat_id(st)) for p, st in self._stats]:
+                return
+            key = archive_key(stats)
+            file = self._build(stats, key)
+        except (OSError, ValueError):
+            # Gone, or unloaded part way through.
+            return
+        if self._watcher.stopped:
+            file.close()
+            return
+        self._stats = stats
+        self._serve_archive(file, key)
+
+    def snapshot(self):
+        return self._current
+
+    @property
+    def size(self):
+        if self._current is not None:
+            return self._current.size
+
+    @property
+    def mtime(self):
+        if self._current is not None:
+            return self._current.mtime
+
+    @property
+    def etag(self):
+        if self._current is not None:
+            return self._current.etag
+
+    def open(self):
+        return self._current.open()
+
+    def _serve_archive(self, file, key):
+        # The archive is fully determined by its inputs so their key doubles
+        # as a strong ETag that survives restarts.
+        old, self._archive = self._archive, file
+        path = "/proc/self/fd/%d" % file.fileno()
+        self._current = Snapshot(self, path, '"%s"' % key[:32])
+        if old is None:
+            self.once("unload", self._unload)
+            self._finish(path)
+            return
+
+        # The old archive stays open until the next refresh for the
+        # requests still reading it.
+        self._filepath = path
+        self._compressible = None
+        if self._retired is not None:
+            self._retired.close()
+        self._retired = old
+        self.trigger("update")
+        self._start_checksum()
+
+    def _unload(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+        for file in (self._archive, self._retired):
+            if file is not None:
+                file.close()
+
+def _stat_id(st):
+    return (st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev)
+
+class StreamingMultiFile(MultiFile):
+    # Sends the archive as it's generated instead of building it first.
+    seekable = False
+
+    def snapshot(self):
+        return self
+
+    def run(self):
+        try:
+            self._stats = scan(self._paths)
+            self._entries = [Entry.from_path(path, st) for path, st in self._stats]
+            self._etag = '"%s-stored"' % archive_key(self._stats)[:32]
+        except Exception:
+            self._fail()
+            raise
+        self._size = ZipStream.length(self._entries)
+        self._mtime = max((e.mtime for e in self._entries), default=0)
+        self._loaded.set()
+        self.trigger("load")
+
+    @property
+    def size(self):
+        if self.loaded:
+            return self._size
+
+    @property
+    def mtime(self):
+        if self.loaded:
+            return self._mtime
+
+    @property
+    def etag(self):
+        if self.loaded:
+            return self._etag
+
+    def open(self):
+        return ZipStream(self._entries)
+
+class RemoteFile(Thread, RealFile):
+    # A file served from a URL while it's being downloaded. Clients read the
+    # part that has arrived and then wait for the rest. Without a
+    # Content-Length, the file only loads once the download is complete.
+    def __init__(self, server, fid, url):
+        Thread.__init__(self, daemon=True)
+        RealFile.__init__(self, server, fid, remote_name(url))
+        self.source = url
+        self._download = None
+        self._stopped = False
+        self._checksum = Future() if server.digests is not None else None
+        self.once("unload", self._unload)
+        self.start()
+
+    def run(self):
+        try:
+            self._download = Download(self.source, self.server.timeout)
+            if self._stopped:
+                self._unload()
+                return
+            if self._download.length is not None:
+                self._loaded.set()
+                self.trigger("load")
+            self._download.run(self._progress)
+            if self._stopped:
+                return
+        except Exception:
+            if self._checksum is not None:
+                self._checksum.set_result(None)
+            self._fail()
+            if self._stopped:
+                return
+            raise
+        fd = self._download.file.fileno()
+        if self.server.digests is not None:
+            self.server.digests.add(stat_key(os.fstat(fd)), self._download.sha256)
+            self._checksum.set_result(self._download.sha256)
+        self._filepath = "/proc/self/fd/%d" % fd
+        if self.loaded:
+            self.trigger("update")
+        else:
+            self._loaded.set()
+            self.trigger("load")
+
+    def _progress(self, received):
+        self.trigger("loading", received/(self._download.length or received or 1)*100)
+
+    @property
+    def complete(self):
+        return self._filepath is not None
+
+    @property
+    def compressible(self):
+        return self.complete and RealFile.compressible.fget(self)
+
+    def open(self):
+        if self.complete:
+            return RealFile.open(self)
+        if self._download is None or self._download.error is not None:
+            raise IOError("Download failed")
+        return Tail(self._download.file.fileno(), self._download.length, self._download)
+
+    @property
+    def mtime(self):
+        if self.loaded and self._download is not None:
+            return self._download.mtime
+
+    @property
+    def size(self):
+        if not self.loaded:
+            return None
+        if self._download is None or self._download.length is None:
+            # It failed.
+            return 0
+        return self._download.length
+
+    @property
+    def etag(self):
+        if self.loaded and self._download is not None:
+            if self._download.etag is None and self.complete:
+                return RealFile.etag.fget(self)
+            return self._download.etag
+
+    def checksum(self):
+        if self.complete:
+            return RealFile.checksum(self)
+        return self._checksum
+
+    def _unload(self):
+        self._stopped = True
+        if self._download is not None:
+            self._download.close()
+
+class BundleFile(File):
+    # A one-off archive of several served files, streamed on the fly for a
+    # multiget request. Requests show up on every bundled file.
+    seekable = False
+
+    def __init__(self, server, files):
+        super().__init__(server, None, "files.zip")
+        self.files = files
+        self._lock = Lock()
+        for f in files:
+            # Weak, so members don't keep an abandoned bundle alive.
+            f.on("load", self._check_loaded, weak=True)
+        self._check_loaded()
+
+    def _check_loaded(self):
+        with self._lock:
+            if self.loaded or not all(f.loaded for f in self.files):
+                return
+            for f in self.files:
+                f.off("load", self._check_loaded)
+            if any(f.failed for f in self.files):
+                self.failed = True
+            else:
+                self._entries = self._make_entries()
+                self._etag = self._make_etag()
+                self._size = ZipStream.length(self._entries)
+                self._mtime = max(e.mtime for e in self._entries)
+            self._loaded.set()
+        self.trigger("load")
+
+    def _make_etag(self):
+        if any(f.etag is None for f in self.files):
+            return None
+        h = hashlib.sha256()
+        for entry, f in zip(self._entries, self.files):
+            h.update(("%s\0%s\0" % (entry.name, f.etag)).encode("utf-8", "surrogateescape"))
+        return '"%s-bundle"' % h.hexdigest()[:32]
+
+    @property
+    def etag(self):
+        if self.loaded:
+            return self._etag
+
+    def _make_entries(self):
+        entries = []
+        names = set()
+        for f in self.files:
+            name = f.name
+            base, ext = os.path.splitext(name)
+            n = 1
+            while name in names:
+                n += 1
+                name = "%s (%d)%s" % (base, n, ext)
+            names.add(name)
+            entries.append(Entry(name, f.size, f.mtime, f.open))
+        return entries
+
+    @property
+    def size(self):
+        if self.loaded:
+            return self._size
+
+    @property
+    def mtime(self):
+        if self.loaded:
+            return self._mtime
+
+    def open(self):
+        return ZipStream(self._entries)
+
+    def _register_request(self, request):
+        for f in self.files:
+            f._register_request(request)
+
+    def _unregister_request(self, request):
+        for f in self.files:
+            if request in f.requests:
+                f._unregister_request(request)
 
 last_file_number = 0
 def AutoFile(server, fid, fpaths):
     global last_file_number
+    Archive = StreamingMultiFile if server.stream_archives else MultiFile
     if len(fpaths) == 0:
         raise ValueError("No files specified")
+    elif any(is_url(fpath) for fpath in fpaths):
+        if len(fpaths) > 1:
+            raise ValueError("URLs can only be served on their own")
+        return RemoteFile(server, fid, fpaths[0])
     elif len(fpaths) == 1:
         if os.path.isdir(fpaths[0]):
             directory = fpaths[0]
-            return MultiFile(server, fid, os.path.basename(directory)+".zip", list(list_files(directory)))
+            return Archive(server, fid, os.path.basename(directory)+".zip", [directory])
         else:
             return LocalFile(server, fid, fpaths[0])
     else:
         last_file_number += 1
-        return MultiFile(
+        return Archive(
             server,
             fid, 
             "files-{}.zip".format(last_file_number),
-            list(itertools.chain.from_iterable((
-                list_files(path)
-            ) for path in fpaths))
+            list(fpaths)
         )
 
-class Server(ThreadingMixIn, HTTPServer, Observable):
+class Catalog(Observable):
+    # The set of files being served, independent of how they are served.
     __last_fid = 0
 
-    def __init__(self, address=("", 10700), handler=Request, **kwargs):
+    def __init__(self, stream_archives=False, archive_workers=None, archive_cache=None, progress_rate=10,
+                 rate_limit=None, client_rate_limit=None, bundle_multiget=False,
+                 compress_transfers=False, variant_cache=None, metrics=True, watch=False,
+                 max_transfers=MAX_TRANSFERS["threads"], max_queued=1024, timeout=60, retry_after=5, checksums=True,
+                 upload_dir=None, archive_memory=32 << 20, memory_budget=256 << 20):
         Observable.__init__(self)
-        HTTPServer.__init__(self, address, handler, **kwargs)
+        # Archives of up to archive_memory bytes are built in memory, as long
+        # as they all fit in memory_budget.
+        self.archive_memory = archive_memory
+        self.memory_budget = MemoryBudget(memory_budget)
+        self.upload_dir = upload_dir
+        self.digests = Digests() if checksums else None
+        self.max_transfers = max_transfers
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.watch = watch
+        self.metrics = Metrics() if metrics else None
+        self.compress_transfers = compress_transfers
+        self.variant_cache = variant_cache
+        self.bundle_multiget = bundle_multiget
+        self.progress_rate = progress_rate
+        self.bandwidth = Scheduler(rate_limit, client_rate_limit)
+        self.stream_archives = stream_archives
+        self.archive_workers = archive_workers
+        self.archive_cache = archive_cache
         self.files = {}
+        self._files_lock = Lock()
         self.my_ip = find_ip()
 
     def serve(self, fpaths):
         self.__last_fid += 1
         f = AutoFile(self, self.__last_fid, fpaths)
         self.files[f.fid] = f
+        if self.metrics is not None:
+            self.metrics.add_file(f)
         self.trigger("add", f)
+        # It may have failed before it was listed (see RealFile._fail).
+        if f.failed:
+            f.stop()
 
         return f
     
+    # Called with each completed upload (see Request._receive).
+    def receive(self, request, path):
+        return self.serve([path])
+
+    # Returns the file to send for a request path and, for multigets that
+    # aren't bundled, the fids to hand back to the client instead.
+    def lookup(self, path):
+        intervals = parse_fids(path)
+        if not intervals:
+            return None, None
+        if len(intervals) == 1 and intervals[0][0] == intervals[0][1]:
+            return self.files.get(intervals[0][0]), None
+
+        files = select_files(self.files, intervals)
+        if not files:
+            return None, None
+        if self.bundle_multiget:
+            return BundleFile(self, files), None
+        return None, [f.fid for f in files]
+
+    # Returns False if the file wasn't being served.
     def unserve(self, file):
-        f = self.files.pop(file.fid)
+        with self._files_lock:
+            if self.files.get(file.fid) is not file:
+                return False
+            f = self.files.pop(file.fid)
+        self.bandwidth.forget_file(f)
+        if self.metrics is not None:
+            self.metrics.forget_file(f)
         self.trigger("remove", f)
+        return True
+
+    # Rates are in bytes per second, None (or 0) lifts the limit.
+    def set_rate_limit(self, rate):
+        self.bandwidth.set_rate(rate)
+
+    def set_client_rate_limit(self, rate):
+        self.bandwidth.set_client_rate(rate)
+
+    def set_file_rate_limit(self, file, rate):
+        self.bandwidth.set_file_rate(file, rate)
+
+    def set_file_weight(self, file, weight):
+        self.bandwidth.set_file_weight(file, weight)
+
+def render_unavailable(retry_after):
+    return (
+        "HTTP/1.0 503 Service Unavailable\r\n"
+        "Retry-After: %d\r\n"
+        "Content-Length: 0\r\n"
+        "Connection: close\r\n\r\n" % retry_after
+    ).encode("ascii")
 
+class WorkerPoolMixIn:
+    # Handles connections on at most max_transfers threads (started as
+    # needed). Up to max_queued more connections wait for a thread, anything
+    # beyond that is turned away with a 503.
+    daemon_threads = True
+
+    def _init_pool(self):
+        self._pool_lock = Lock()
+        self._queue = queue.Queue(self.max_queued)
+        self._workers = 0
+        self._idle = 0
+
+    def process_request(self, request, client_address):
+        with self._pool_lock:
+            try:
+                self._queue.put_nowait((request, client_address))
+            except queue.Full:
+                self._reject(request)
+                return
+            if self._idle:
+                self._idle -= 1
+            elif self._workers < self.max_transfers:
+                self._workers += 1
+                Thread(target=self._work, daemon=self.daemon_threads).start()
+
+    def _reject(self, request):
+        if self.metrics is not None:
+            self.metrics.reject()
+        try:
+            request.setblocking(False)
+            request.send(render_unavailable(self.retry_after))
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+            with self._pool_lock:
+                self._idle += 1
+
+    def server_close(self):
+        super().server_close()
+        with self._pool_lock:
+            workers, self._workers = self._workers, 0
+        for _ in range(workers):
+            self._queue.put(None)
+
+class Server(WorkerPoolMixIn, HTTPServer, Catalog):
+    request_queue_size = 128
+
+    def __init__(self, address=("", 10700), handler=Request, bind_and_activate=True, reuse_port=False,
+                 **options):
+        Catalog.__init__(self, **options)
+        self._init_pool()
+        self.reuse_port = reuse_port
+        HTTPServer.__init__(self, address, handler, bind_and_activate)
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        HTTPServer.server_bind(self)
+
+def make_server(engine="threads", *args, workers=1, **kwargs):
+    if workers > 1:
+        from .prefork import PreforkServer
+        return PreforkServer(engine, *args, workers=workers, **kwargs)
+    if engine == "threads":
+        return Server(*args, **kwargs)
+    elif engine == "asyncio":
+        from .aio import AsyncServer
+        return AsyncServer(*args, **kwargs)
+    else:
+        raise ValueError("Unknown server engine: %s" % engine)
@@ -0,0 +1,91 @@
+import os
+from tempfile import TemporaryFile
+from threading import Lock
+
+__all__ = ("MemoryBudget", "SpoolFile")
+
+COPY_SIZE = 1 << 20
+
+class MemoryBudget:
+    # Bytes that all SpoolFiles together may keep in memory.
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._lock = Lock()
+
+    def reserve(self, nbytes):
+        with self._lock:
+            if self.used + nbytes > self.limit:
+                return False
+            self.used += nbytes
+            return True
+
+    def release(self, nbytes):
+        with self._lock:
+            self.used -= nbytes
+
+def _memfd():
+    try:
+        return open(os.memfd_create("platter-archive", os.MFD_CLOEXEC), "wb")
+    except (AttributeError, OSError):
+        return None
+
+class SpoolFile:
+    # A write-only temporary file that's kept in anonymous memory (a memfd)
+    # while it's at most max_size bytes and fits in the budget, and moved to
+    # disk once it doesn't. Either way it has a real descriptor, so it can be
+    # served through /proc/self/fd with sendfile.
+
+    def __init__(self, max_size, budget):
+        self.max_size = max_size
+        self.budget = budget
+        self._held = 0
+        self._file = _memfd() if max_size and budget.limit else None
+        self.in_memory = self._file is not None
+        if not self.in_memory:
+            self._file = TemporaryFile(mode="wb")
+
+    def write(self, buf):
+        if self.in_memory:
+            nbytes = len(buf)
+            if self._held + nbytes > self.max_size or not self.budget.reserve(nbytes):
+                self._spill()
+            else:
+                self._held += nbytes
+        return self._file.write(buf)
+
+    def _spill(self):
+        self._file.flush()
+        disk = TemporaryFile(mode="wb")
+        fd = self._file.fileno()
+        offset = 0
+        while offset < self._held:
+            buf = os.pread(fd, min(COPY_SIZE, self._held - offset), offset)
+            if not buf:
+                raise IOError("Spool truncated")
+            disk.write(buf)
+            offset += len(buf)
+        self._file.close()
+        self._release()
+        self._file = disk
+
+    def _release(self):
+        if self.in_memory:
+            self.in_memory = False
+            self.budget.release(self._held)
+            self._held = 0
+
+    def flush(self):
+        self._file.flush()
+
+    def fileno(self):
+        return self._file.fileno()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def close(self):
+        self._file.close()
+        self._release()
@@ -0,0 +1,212 @@
+import time
+from threading import Lock
+
+__all__ = ("TokenBucket", "Scheduler")
+
+MIN_CHUNK = 16 << 10
+MAX_CHUNK = 1 << 20
+# How often transfers' shares are adjusted to what they actually use.
+REBALANCE_INTERVAL = 0.5
+
+class TokenBucket:
+    # rate is in bytes per second, None means unlimited. Reservations may
+    # overdraw the bucket; the caller is told how long to wait instead.
+
+    def __init__(self, rate=None):
+        self._lock = Lock()
+        self._last = time.monotonic()
+        self.rate = rate or None
+        self.burst = self._burst(self.rate)
+        self._tokens = self.burst
+        self._used = 0
+        self._waited = False
+
+    @staticmethod
+    def _burst(rate):
+        return max(rate/4, MIN_CHUNK) if rate else 0
+
+    def set_rate(self, rate):
+        # Keep any debt so that changing the rate doesn't hand out free bytes.
+        with self._lock:
+            self.rate = rate or None
+            self.burst = self._burst(self.rate)
+            self._tokens = min(self._tokens, self.burst)
+
+    def reserve(self, nbytes):
+        if self.rate is None:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last)*self.rate)
+            self._last = now
+            self._tokens -= nbytes
+            self._used += nbytes
+            if self._tokens < 0:
+                self._waited = True
+                return -self._tokens/self.rate
+            return 0
+
+    def usage(self):
+        # Bytes reserved (while limited) since the last call, and whether any
+        # of them had to wait.
+        with self._lock:
+            usage = self._used, self._waited
+            self._used, self._waited = 0, False
+            return usage
+
+class Scheduler:
+    # Divides bandwidth between transfers. The global rate is split between
+    # active transfers in proportion to their weights, and each transfer is
+    # also held to its client's and its file's limits (if any). Bandwidth a
+    # transfer can't use (because of those limits or a slow client) goes to
+    # the others: max-min fairness, recomputed every REBALANCE_INTERVAL.
+
+    def __init__(self, rate=None, client_rate=None):
+        self._lock = Lock()
+        self.rate = rate or None
+        self.client_rate = client_rate or None
+        self._total = TokenBucket(self.rate)
+        self._balanced = time.monotonic()
+        # transfer: [share, client, file, weight, demand]; demand is the
+        # most it's expected to use, None if it could use more than it gets.
+        self._transfers = {}
+        self._clients = {}
+        self._file_rates = {}
+        self._file_buckets = {}
+        self._file_weights = {}
+
+    @property
+    def limited(self):
+        return bool(self.rate or self.client_rate or self._file_rates)
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = rate or None
+            self._total.set_rate(self.rate)
+            self._balanced = time.monotonic()
+            self._rebalance()
+
+    def set_client_rate(self, rate):
+        with self._lock:
+            self.client_rate = rate or None
+            for bucket, _ in self._clients.values():
+                bucket.set_rate(self.client_rate)
+
+    def set_file_rate(self, file, rate):
+        with self._lock:
+            if rate:
+                self._file_rates[file] = rate
+            else:
+                self._file_rates.pop(file, None)
+            if file in self._file_buckets:
+                self._file_buckets[file].set_rate(rate)
+
+    def set_file_weight(self, file, weight):
+        with self._lock:
+            self._file_weights[file] = weight
+            for entry in self._transfers.values():
+                if entry[2] is file:
+                    entry[3] = weight
+            self._rebalance()
+
+    def forget_file(self, file):
+        with self._lock:
+            self._file_rates.pop(file, None)
+            self._file_weights.pop(file, None)
+
+    def register(self, transfer, client, file):
+        with self._lock:
+            if client in self._clients:
+                self._clients[client][1] += 1
+            else:
+                self._clients[client] = [TokenBucket(self.client_rate), 1]
+            if file not in self._file_buckets:
+                self._file_buckets[file] = TokenBucket(self._file_rates.get(file))
+            weight = self._file_weights.get(file, 1)
+            self._transfers[transfer] = [TokenBucket(), client, file, weight, None]
+            self._rebalance()
+
+    def unregister(self, transfer):
+        with self._lock:
+            try:
+                _, client, file, _, _ = self._transfers.pop(transfer)
+            except KeyError:
+                return
+            self._clients[client][1] -= 1
+            if not self._clients[client][1]:
+                del self._clients[client]
+            if not any(entry[2] is file for entry in self._transfers.values()):
+                del self._file_buckets[file]
+            self._rebalance()
+
+    def _limit(self, entry):
+        _, client, file, _, demand = entry
+        rates = [r for r in (demand, self._clients[client][0].rate, self._file_buckets[file].rate) if r]
+        return min(rates) if rates else None
+
+    def _measure(self, now):
+        elapsed, self._balanced = now - self._balanced, now
+        for entry in self._transfers.values():
+            used, waited = entry[0].usage()
+            # A transfer its share held back could use more, one it didn't
+            # gets what it used and some room to grow.
+            entry[4] = None if waited else max(used/elapsed*1.5, MIN_CHUNK)
+
+    def _rebalance(self):
+        entries = list(self._transfers.values())
+        if not self.rate:
+            for entry in entries:
+                entry[0].set_rate(None)
+            return
+        # Water-filling: transfers that can't use their weighted share of
+        # what's left are given what they can use, until the rest can.
+        remaining = self.rate
+        while entries:
+            unit = remaining/sum(entry[3] for entry in entries)
+            unlimited = []
+            for entry in entries:
+                limit = self._limit(entry)
+                if limit is not None and limit < unit*entry[3]:
+                    entry[0].set_rate(limit)
+                    remaining -= limit
+                else:
+                    unlimited.append(entry)
+            if len(unlimited) == len(entries):
+                break
+            entries = unlimited
+        for entry in entries:
+            entry[0].set_rate(unit*entry[3])
+
+    def delay(self, transfer, nbytes):
+        # How long the transfer should wait before sending nbytes.
+        try:
+            share, client, file, _, _ = self._transfers[transfer]
+            client_bucket = self._clients[client][0]
+            file_bucket = self._file_buckets[file]
+        except KeyError:
+            return 0
+        if self.rate:
+            now = time.monotonic()
+            if now - self._balanced >= REBALANCE_INTERVAL:
+                with self._lock:
+                    if now - self._balanced >= REBALANCE_INTERVAL:
+                        self._measure(now)
+                        self._rebalance()
+        # The shares can add up to more than the rate while they adjust.
+        return max(
+            self._total.reserve(nbytes),
+            share.reserve(nbytes),
+            client_bucket.reserve(nbytes),
+            file_bucket.reserve(nbytes),
+        )
+
+    def chunk_size(self, transfer):
+        # Keep chunks small enough that limited transfers stay smooth.
+        try:
+            share, client, file, _, _ = self._transfers[transfer]
+            rates = [r for r in (share.rate, self._clients[client][0].rate, self._file_buckets[file].rate) if r]
+        except KeyError:
+            return MAX_CHUNK
+        if not rates:
+            return MAX_CHUNK
+        return int(max(MIN_CHUNK, min(MAX_CHUNK, min(rates)/10)))
@@ -0,0 +1,135 @@
+import os
+import tempfile
+from urllib.parse import unquote
+
+__all__ = ("UPLOAD_PATH", "UPLOAD_CHUNK", "upload_name", "body_length", "parse_chunk_size",
+           "Incoming", "render_upload_page", "BadRequest")
+
+# Files are PUT (or POSTed, as a raw body) to UPLOAD_PATH/<name>. A GET of
+# UPLOAD_PATH returns a page that does that for the files picked in a browser.
+UPLOAD_PATH = "/upload"
+UPLOAD_CHUNK = 1 << 20
+MAX_LINE = 1024
+
+class BadRequest(ValueError):
+    def __init__(self, status, message=None):
+        super().__init__(message or status)
+        self.status = status
+
+def upload_name(path):
+    # Returns a safe file name for an upload path, or None.
+    prefix = UPLOAD_PATH + "/"
+    if not path.startswith(prefix):
+        return None
+    name = unquote(path[len(prefix):].partition("?")[0], errors="surrogateescape")
+    name = name.replace("\\", "/").rpartition("/")[2].lstrip(".").strip()
+    if not name or "\0" in name:
+        return None
+    return name
+
+def body_length(headers):
+    # The Content-Length of a request body, or None if it's chunked.
+    if "chunked" in headers.get("Transfer-Encoding", "").lower():
+        return None
+    length = headers.get("Content-Length")
+    if length is None:
+        raise BadRequest(411)
+    try:
+        length = int(length)
+    except ValueError:
+        raise BadRequest(400, "Bad Content-Length")
+    if length < 0:
+        raise BadRequest(400, "Bad Content-Length")
+    return length
+
+def parse_chunk_size(line):
+    if not line.endswith(b"\n"):
+        raise BadRequest(400, "Bad chunk")
+    try:
+        size = int(line.split(b";", 1)[0].strip(), 16)
+    except ValueError:
+        raise BadRequest(400, "Bad chunk")
+    if size < 0:
+        raise BadRequest(400, "Bad chunk")
+    return size
+
+class Incoming:
+    # Receives an upload into a hidden temporary file in directory. Once
+    # complete, finish() links it in under name, or "name (2)" and so on if
+    # that's taken, so that a partial upload never shows up.
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        fd, self._tmp = tempfile.mkstemp(dir=directory, prefix=".upload-", suffix=".part")
+        self._file = open(fd, "wb", buffering=0)
+
+    def write(self, buf):
+        view = memoryview(buf)
+        while view:
+            view = view[self._file.write(view):]
+
+    def writelines(self, bufs):
+        for buf in bufs:
+            self.write(buf)
+
+    def finish(self):
+        self._file.close()
+        base, ext = os.path.splitext(self.name)
+        n = 1
+        name = self.name
+        while True:
+            path = os.path.join(self.directory, name)
+            try:
+                os.link(self._tmp, path)
+            except FileExistsError:
+                pass
+            except OSError:
+                # No hard links here, fall back on a (racy) rename.
+                if not os.path.exists(path):
+                    os.rename(self._tmp, path)
+                    return path
+            else:
+                os.unlink(self._tmp)
+                return path
+            n += 1
+            name = "%s (%d)%s" % (base, n, ext)
+
+    def discard(self):
+        self._file.close()
+        try:
+            os.unlink(self._tmp)
+        except OSError:
+            pass
+
+UPLOAD_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><meta name="viewport" content="width=device-width">
+<title>Send files</title></head><body>
+<p><input type="file" id="files" multiple></p>
+<ul id="status"></ul>
+<script>
+document.getElementById("files").onchange = async function() {
+    for (const file of this.files) {
+        const item = document.createElement("li");
+        item.textContent = file.name + ": sending";
+        document.getElementById("status").appendChild(item);
+        await new Promise(function(done) {
+            const xhr = new XMLHttpRequest();
+            xhr.open("PUT", "%s/" + encodeURIComponent(file.name));
+            xhr.upload.onprogress = function(e) {
+                item.textContent = file.name + ": " + Math.floor(e.loaded/e.total*100) + "%%";
+            };
+            xhr.onloadend = function() {
+                item.textContent = file.name + ": " + (xhr.status == 201 ? "done" : "failed");
+                done();
+            };
+            xhr.send(file);
+        });
+    }
+    this.value = "";
+};
+</script></body></html>
+""" % UPLOAD_PATH
+
+def render_upload_page():
+    return UPLOAD_PAGE.encode("utf-8")
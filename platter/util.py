@@ -2,12 +2,11 @@ import os, base64
 import threading
 import itertools
 import functools
-from urllib.request import pathname2url
 
 def make_code(length=6):
     return base64.urlsafe_b64encode(os.urandom(length)).decode('utf-8')
 
-def async(func):
+def run_async(func):
     @functools.wraps(func)
     def do(*args, **kwargs):
         if "callback" in kwargs:
@@ -29,6 +28,11 @@ def list_files(path):
     else:
         return (path,)
 
+def is_url(path):
+    from urllib.parse import urlsplit
+    return urlsplit(path).scheme in ("http", "https")
+
 def path2url(path):
+    from urllib.request import pathname2url
     return 'file://' + pathname2url(os.path.abspath(path))
 
@@ -0,0 +1,144 @@
+import os
+import time
+import errno
+import select
+import struct
+import threading
+
+__all__ = ("Watcher",)
+
+# inotify(7) through ctypes, Linux only. Watcher raises OSError where it's
+# not available.
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+EVENT = struct.Struct("iIII")
+READ_SIZE = 64 << 10
+
+_libc = None
+
+def _inotify():
+    global _libc
+    if _libc is None:
+        import ctypes
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            libc.inotify_init1
+        except (OSError, AttributeError):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        _libc = libc
+    return _libc
+
+def _check(result):
+    if result < 0:
+        import ctypes
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return result
+
+class Watcher(threading.Thread):
+    # Calls callback (from the watcher's thread) once paths have stopped
+    # changing for delay seconds. Directories are watched recursively.
+    daemon = True
+
+    def __init__(self, paths, callback, delay=1.0):
+        super().__init__(name="platter-watch")
+        self.callback = callback
+        self.delay = delay
+        self._libc = _inotify()
+        self._fd = _check(self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC))
+        self._wake_r, self._wake_w = os.pipe()
+        self._fds = (self._fd, self._wake_r, self._wake_w)
+        self._stopped = False
+        self._lock = threading.Lock()
+        self._dirs = {}
+        try:
+            for path in paths:
+                self._watch_tree(path)
+        except OSError:
+            self.close()
+            raise
+
+    def _watch(self, path):
+        wd = _check(self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK))
+        self._dirs[wd] = path
+
+    def _watch_tree(self, path):
+        self._watch(path)
+        if os.path.isdir(path):
+            for dirpath, dirnames, _ in os.walk(path):
+                for dirname in dirnames:
+                    try:
+                        self._watch(os.path.join(dirpath, dirname))
+                    except OSError:
+                        pass
+
+    def run(self):
+        deadline = None
+        while not self._stopped:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            readable, _, _ = select.select([self._fd, self._wake_r], [], [], timeout)
+            if self._stopped:
+                break
+            if self._fd in readable:
+                self._read()
+                deadline = time.monotonic() + self.delay
+            elif deadline is not None and time.monotonic() >= deadline:
+                deadline = None
+                self.callback()
+        self.close()
+
+    def _read(self):
+        try:
+            data = os.read(self._fd, READ_SIZE)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset+length].rstrip(b"\0")
+            offset += length
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            # Pick up directories created (or moved in) under a watched one.
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and wd in self._dirs:
+                try:
+                    self._watch_tree(os.path.join(self._dirs[wd], os.fsdecode(name)))
+                except OSError:
+                    pass
+
+    @property
+    def stopped(self):
+        return self._stopped
+
+    def stop(self):
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            os.write(self._wake_w, b"\0")
+
+    # Called once the thread stops, or instead of starting it.
+    def close(self):
+        with self._lock:
+            self._stopped = True
+            fds, self._fds = self._fds, ()
+        for fd in fds:
+            os.close(fd)
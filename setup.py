@@ -27,6 +27,7 @@ setup(
     license = "GPLV3",
     url = "http://stebalien.com",
     entry_points = {
-        'gui_scripts': ['platter = platter.qt:main']
+        'gui_scripts': ['platter = platter.qt:main'],
+        'console_scripts': ['platter-server = platter.cli:main'],
     }
 )
@@ -0,0 +1,33 @@
+import threading
+import urllib.request
+from unittest import mock
+
+from platter.server import make_server
+
+def start_server(test, engine="threads", **options):
+    # find_ip looks at the host's network interfaces, which tests don't need.
+    with mock.patch("platter.server.find_ip", return_value="127.0.0.1"):
+        server = make_server(engine, ("127.0.0.1", 0), **options)
+    handler = getattr(server, "RequestHandlerClass", None)
+    if handler is not None:
+        server.RequestHandlerClass = type("QuietRequest", (handler,), {"log_message": lambda *args: None})
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    def stop():
+        server.shutdown()
+        thread.join()
+        server.server_close()
+    test.addCleanup(stop)
+    return server
+
+# Returns (status, headers, body) without raising for error statuses.
+def fetch(server, path, method="GET", headers={}, timeout=10):
+    request = urllib.request.Request(
+        "http://127.0.0.1:%d%s" % (server.server_port, path), method=method, headers=headers
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        with e:
+            return e.code, e.headers, e.read()
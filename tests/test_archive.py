@@ -0,0 +1,92 @@
+import io
+import os
+import hashlib
+import tempfile
+import unittest
+import zipfile
+
+from platter.archive import Entry, ZipStream, ArchiveBuilder
+
+MTIME = 1445412480
+
+TEXT = b"lorem ipsum dolor sit amet " * 4096
+NOISE = os.urandom(64 << 10)
+
+def entry(name, data, size=None):
+    return Entry(name, len(data) if size is None else size, MTIME, lambda: io.BytesIO(data))
+
+def contents(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        return {info.filename: (info.compress_type, zf.read(info)) for info in zf.infolist()}
+
+class ZipStreamTest(unittest.TestCase):
+    def test_round_trip(self):
+        entries = [
+            entry("text.txt", TEXT),
+            entry("empty", b""),
+            # Stored under another name than the file it's read from.
+            entry("dir/renamed.bin", NOISE),
+            entry("naïve.txt", b"unicode"),
+        ]
+        data = ZipStream(entries).read()
+        self.assertEqual(len(data), ZipStream.length(entries))
+        self.assertEqual(contents(data), {
+            "text.txt": (zipfile.ZIP_STORED, TEXT),
+            "empty": (zipfile.ZIP_STORED, b""),
+            "dir/renamed.bin": (zipfile.ZIP_STORED, NOISE),
+            "naïve.txt": (zipfile.ZIP_STORED, b"unicode"),
+        })
+
+    def test_empty_archive(self):
+        data = ZipStream([]).read()
+        self.assertEqual(len(data), ZipStream.length([]))
+        self.assertEqual(contents(data), {})
+
+    def test_changed_entries_keep_their_size(self):
+        entries = [entry("shrunk", b"12345", size=10), entry("grew", b"1234567890", size=4)]
+        data = ZipStream(entries).read()
+        self.assertEqual(len(data), ZipStream.length(entries))
+        self.assertEqual(contents(data), {
+            "shrunk": (zipfile.ZIP_STORED, b"12345" + bytes(5)),
+            "grew": (zipfile.ZIP_STORED, b"1234"),
+        })
+
+class ArchiveBuilderTest(unittest.TestCase):
+    entries = [
+        entry("text.txt", TEXT),
+        entry("noise", NOISE),
+        entry("packed.zip", TEXT),
+        entry("empty", b""),
+        entry("dir/renamed.txt", TEXT[:1000]),
+    ]
+    expected = {
+        "text.txt": (zipfile.ZIP_DEFLATED, TEXT),
+        "noise": (zipfile.ZIP_STORED, NOISE),
+        "packed.zip": (zipfile.ZIP_STORED, TEXT),
+        "empty": (zipfile.ZIP_DEFLATED, b""),
+        "dir/renamed.txt": (zipfile.ZIP_DEFLATED, TEXT[:1000]),
+    }
+
+    def test_round_trip(self):
+        out = io.BytesIO()
+        builder = ArchiveBuilder(self.entries, workers=2)
+        builder.write(out)
+        data = out.getvalue()
+        self.assertEqual(contents(data), self.expected)
+        self.assertEqual(builder.sha256, hashlib.sha256(data).digest())
+
+    def test_reuses_previous(self):
+        def unreadable():
+            raise AssertionError("Read an unchanged entry")
+        with tempfile.TemporaryFile() as first:
+            builder = ArchiveBuilder(self.entries, workers=2)
+            builder.write(first)
+            out = io.BytesIO()
+            ArchiveBuilder(
+                [e._replace(open=unreadable) for e in self.entries], workers=2, previous=(first, builder.index)
+            ).write(out)
+        self.assertEqual(contents(out.getvalue()), self.expected)
+
+if __name__ == "__main__":
+    unittest.main()
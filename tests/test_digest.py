@@ -0,0 +1,39 @@
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+from platter.digest import Digests, SUFFIX
+
+from .support import start_server, fetch
+
+class ChecksumTimeoutTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.path = os.path.join(self.root, "file.bin")
+        with open(self.path, "wb") as f:
+            f.write(os.urandom(1024))
+
+    def check_timeout(self, engine):
+        pending = Future()
+        with mock.patch.object(Digests, "compute", return_value=pending):
+            server = start_server(self, engine, checksums=True, timeout=0.5)
+            f = server.serve([self.path])
+            f.wait()
+            status, headers, _ = fetch(server, "/%d%s" % (f.fid, SUFFIX))
+        self.assertEqual(status, 503)
+        self.assertIn("Retry-After", headers)
+        # Other clients may still be waiting on it.
+        self.assertFalse(pending.cancelled())
+
+    def test_threads(self):
+        self.check_timeout("threads")
+
+    def test_asyncio(self):
+        self.check_timeout("asyncio")
+
+if __name__ == "__main__":
+    unittest.main()
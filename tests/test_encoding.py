@@ -0,0 +1,110 @@
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+
+from platter.cache import VariantCache, variant_key
+from platter.encoding import ENCODINGS, negotiate
+
+from .support import start_server, fetch
+
+TEXT = b"lorem ipsum dolor sit amet " * 4096
+
+class NegotiateTest(unittest.TestCase):
+    def test_negotiate(self):
+        best = next(iter(ENCODINGS))
+        cases = {
+            None: None,
+            "": None,
+            "identity": None,
+            "br": None,
+            "gzip": "gzip",
+            "GZip ; q=0.5": "gzip",
+            "gzip;q=0": None,
+            "gzip;q=x": None,
+            "*": best,
+            "*;q=0": None,
+            "*, gzip;q=0": "zstd" if "zstd" in ENCODINGS else None,
+            "identity;q=0, gzip;q=0.1": "gzip",
+            "zstd;q=0.5, gzip": "gzip",
+        }
+        for header, encoding in cases.items():
+            self.assertEqual(negotiate(header), encoding, header)
+
+    def test_prefers_zstd(self):
+        if "zstd" not in ENCODINGS:
+            self.skipTest("zstandard isn't installed")
+        self.assertEqual(negotiate("gzip, zstd"), "zstd")
+        self.assertEqual(negotiate("gzip, zstd;q=0.9"), "gzip")
+
+class VariantKeyTest(unittest.TestCase):
+    def test_keying(self):
+        with tempfile.NamedTemporaryFile() as f:
+            st = os.stat(f.name)
+            key = variant_key(f.name, st, "gzip")
+            self.assertEqual(key, variant_key(f.name, os.stat(f.name), "gzip"))
+            self.assertNotEqual(key, variant_key(f.name, st, "zstd"))
+            self.assertNotEqual(key, variant_key(f.name + "x", st, "gzip"))
+            f.write(b"changed")
+            f.flush()
+            os.utime(f.name, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+            self.assertNotEqual(key, variant_key(f.name, os.stat(f.name), "gzip"))
+
+class TrackedCache(VariantCache):
+    def __init__(self, *args):
+        VariantCache.__init__(self, *args)
+        self.handed_out = []
+
+    def lookup(self, key):
+        variant = VariantCache.lookup(self, key)
+        if variant is not None:
+            self.handed_out.append(variant)
+        return variant
+
+class VariantCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.path = os.path.join(self.root, "file.txt")
+        with open(self.path, "wb") as f:
+            f.write(TEXT)
+        self.cache = TrackedCache(1 << 20, os.path.join(self.root, "cache"))
+
+    def check_cached(self, engine):
+        server = start_server(self, engine, compress_transfers=True, variant_cache=self.cache)
+        f = server.serve([self.path])
+        f.wait()
+        path = "/%d" % f.fid
+        accept = {"Accept-Encoding": "gzip"}
+
+        status, headers, body = fetch(server, path, headers=accept)
+        self.assertEqual(status, 200)
+        self.assertEqual(gzip.decompress(body), TEXT)
+        self.assertEqual(len(os.listdir(self.cache.directory)), 1)
+
+        for _ in range(5):
+            status, headers, _ = fetch(server, path, "HEAD", accept)
+            self.assertEqual(status, 200)
+            self.assertEqual(int(headers["Content-Length"]), len(body))
+            status, _, _ = fetch(server, path, headers=dict(accept, **{"If-None-Match": headers["ETag"]}))
+            self.assertEqual(status, 304)
+        self.assertTrue(self.cache.handed_out)
+        self.assertTrue(all(variant.closed for variant in self.cache.handed_out))
+
+        status, cached_headers, cached = fetch(server, path, headers=accept)
+        self.assertEqual(cached, body)
+        self.assertEqual(int(cached_headers["Content-Length"]), len(body))
+
+        os.unlink(self.path)
+        status, _, _ = fetch(server, path, "HEAD", accept)
+        self.assertEqual(status, 404)
+
+    def test_threads(self):
+        self.check_cached("threads")
+
+    def test_asyncio(self):
+        self.check_cached("asyncio")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import gc
+import unittest
+
+from platter.event import Observable, EventQueue
+
+class Thing(Observable):
+    pass
+
+class Listener:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, *args, **kwargs):
+        self.calls.append((args, kwargs))
+
+    def method(self, *args, **kwargs):
+        self.calls.append((args, kwargs))
+
+class ObservableTest(unittest.TestCase):
+    def setUp(self):
+        self.observable = Thing()
+
+    def test_on_off(self):
+        listener = Listener()
+        self.observable.on("load", listener)
+        self.observable.trigger("load", 1, x=2)
+        self.observable.trigger("unload")
+        self.observable.off("load", listener)
+        self.observable.trigger("load", 3)
+        self.assertEqual(listener.calls, [((1,), {"x": 2})])
+        # Unsubscribing twice (or from nothing) is harmless.
+        self.observable.off("load", listener)
+        self.observable.off("other", listener)
+
+    def test_all(self):
+        listener = Listener()
+        loads = Listener()
+        self.observable.on("all", listener)
+        self.observable.on("load", loads)
+        self.observable.trigger("load", 1)
+        self.observable.trigger("unload", 2)
+        self.assertEqual(listener.calls, [((1,), {}), ((2,), {})])
+        self.assertEqual(loads.calls, [((1,), {})])
+
+    def test_once(self):
+        listener = Listener()
+        self.observable.once("load", listener)
+        for i in range(3):
+            self.observable.trigger("load", i)
+        self.assertEqual(listener.calls, [((0,), {})])
+
+    def test_weak(self):
+        listener = Listener()
+        owner = Listener()
+        self.observable.on("load", listener, weak=True)
+        self.observable.on("load", owner.method, weak=True)
+        self.observable.trigger("load", 1)
+        self.assertEqual(listener.calls, [((1,), {})])
+        self.assertEqual(owner.calls, [((1,), {})])
+        del listener, owner
+        gc.collect()
+        # The dead subscriptions have been dropped, not just skipped.
+        table, default = self.observable._Observable__table
+        self.assertEqual(table.get("load", default), ())
+        self.observable.trigger("load", 2)
+
+    def test_weak_off(self):
+        owner = Listener()
+        self.observable.on("load", owner.method, weak=True)
+        self.observable.off("load", owner.method)
+        self.observable.trigger("load")
+        self.assertEqual(owner.calls, [])
+
+class EventQueueTest(unittest.TestCase):
+    def test_drain(self):
+        observable = Thing()
+        queue = EventQueue()
+        listener = Listener()
+        observable.on("progress", listener, queue=queue)
+        for i in range(3):
+            observable.trigger("progress", i)
+        self.assertEqual(listener.calls, [])
+        queue.drain()
+        self.assertEqual(listener.calls, [((0,), {}), ((1,), {}), ((2,), {})])
+        queue.drain()
+        self.assertEqual(len(listener.calls), 3)
+
+    def test_coalesce(self):
+        observable = Thing()
+        queue = EventQueue(coalesce=True)
+        progress = Listener()
+        done = Listener()
+        observable.on("progress", progress, queue=queue)
+        observable.on("done", done, queue=queue)
+        for i in range(3):
+            observable.trigger("progress", i, total=10)
+        observable.trigger("done")
+        queue.drain()
+        self.assertEqual(progress.calls, [((2,), {"total": 10})])
+        self.assertEqual(done.calls, [((), {})])
+        queue.drain()
+        self.assertEqual(len(progress.calls), 1)
+
+    def test_events_queued_while_draining(self):
+        observable = Thing()
+        queue = EventQueue()
+        calls = []
+        def listener(i):
+            calls.append(i)
+            if i < 2:
+                observable.trigger("progress", i + 1)
+        observable.on("progress", listener, queue=queue)
+        observable.trigger("progress", 0)
+        queue.drain()
+        self.assertEqual(calls, [0])
+        queue.drain()
+        self.assertEqual(calls, [0, 1])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+from platter.prefork import Channel
+
+class ChannelTest(unittest.TestCase):
+    def setUp(self):
+        a, b = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sender = Channel(a)
+        self.receiver = Channel(b)
+        self.addCleanup(self.sender.close)
+        self.addCleanup(self.receiver.close)
+
+    def test_round_trip(self):
+        self.sender.send(("hello", {"fid": 1}))
+        self.sender.send([])
+        self.assertEqual(self.receiver.recv(), (("hello", {"fid": 1}), []))
+        self.assertEqual(self.receiver.recv(), ([], []))
+
+    def test_fds(self):
+        data = os.urandom(4096)
+        with tempfile.TemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            self.sender.send(("fd", "data"), [f.fileno()])
+        message, fds = self.receiver.recv()
+        self.assertEqual(message, ("fd", "data"))
+        self.assertEqual(len(fds), 1)
+        try:
+            # The original is closed (and gone), the one received still reads.
+            self.assertEqual(os.pread(fds[0], len(data) + 1, 0), data)
+        finally:
+            os.close(fds[0])
+
+    def test_large_message(self):
+        # Bigger than the socket's buffer, so it's sent in several pieces
+        # after the one carrying the fd.
+        message = os.urandom(4 << 20)
+        r, w = os.pipe()
+        self.addCleanup(os.close, r)
+        sender = threading.Thread(target=self.sender.send, args=(message, [w]))
+        sender.start()
+        received, fds = self.receiver.recv()
+        sender.join()
+        os.close(w)
+        self.assertEqual(received, message)
+        self.assertEqual(len(fds), 1)
+        os.write(fds[0], b"x")
+        os.close(fds[0])
+        self.assertEqual(os.read(r, 1), b"x")
+
+    def test_eof(self):
+        self.sender.close()
+        with self.assertRaises(EOFError):
+            self.receiver.recv()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+
+from platter.ranges import parse_range, RangeNotSatisfiable, Multipart
+
+class ParseRangeTest(unittest.TestCase):
+    def test_ranges(self):
+        cases = {
+            "bytes=0-99": [(0, 100)],
+            "bytes=900-": [(900, 1000)],
+            "bytes=-100": [(900, 1000)],
+            "bytes=-5000": [(0, 1000)],
+            "bytes=990-2000": [(990, 1000)],
+            "bytes=0-0,-1": [(0, 1), (999, 1000)],
+            " Bytes = 10 - 19 , 30-39": [(10, 20), (30, 40)],
+        }
+        for header, ranges in cases.items():
+            self.assertEqual(parse_range(header, 1000), ranges, header)
+
+    def test_merges_overlapping_ranges(self):
+        self.assertEqual(parse_range("bytes=50-99,0-49,10-20", 1000), [(0, 100)])
+        self.assertEqual(parse_range("bytes=0-9,0-9,0-9", 1000), [(0, 10)])
+        self.assertEqual(parse_range("bytes=0-9,20-29", 1000), [(0, 10), (20, 30)])
+
+    def test_ignored(self):
+        for header in (None, "items=0-9", "bytes=", "bytes=a-b", "bytes=-", "bytes=9-0", "bytes=0-9;x"):
+            self.assertIsNone(parse_range(header, 1000), header)
+
+    def test_unsatisfiable(self):
+        for header in ("bytes=1000-", "bytes=2000-3000", "bytes=-0"):
+            with self.assertRaises(RangeNotSatisfiable, msg=header):
+                parse_range(header, 1000)
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range("bytes=0-", 0)
+
+class MultipartTest(unittest.TestCase):
+    def test_length(self):
+        multipart = Multipart([(0, 10), (20, 25)], 100, "sep", "text/plain")
+        body = b"".join(head + bytes(stop - start) for head, start, stop in multipart.parts) + multipart.trailer
+        self.assertEqual(multipart.length, len(body))
+        self.assertIn(b"Content-Range: bytes 20-24/100", body)
+        self.assertEqual(multipart.content_type, "multipart/byteranges; boundary=sep")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,216 @@
+import os
+import time
+import hashlib
+import tempfile
+import threading
+import unittest
+import http.client
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from platter.remote import Download, PolledGrowth, Tail
+
+from .support import start_server
+
+PAYLOAD = os.urandom(1 << 20)
+CHUNK = 64 << 10
+
+class Upstream(ThreadingHTTPServer):
+    # Trickles PAYLOAD out a chunk at a time. With fail_at set, the
+    # connection is dropped after that many bytes.
+    daemon_threads = True
+
+    def __init__(self, fail_at=None):
+        super().__init__(("127.0.0.1", 0), UpstreamHandler)
+        self.fail_at = fail_at
+        self.hits = 0
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d/payload.bin" % self.server_port
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.hits += 1
+        self.send_response(200)
+        self.send_header("Content-Length", len(PAYLOAD))
+        self.send_header("ETag", '"upstream"')
+        self.end_headers()
+        end = len(PAYLOAD) if self.server.fail_at is None else self.server.fail_at
+        for offset in range(0, end, CHUNK):
+            self.wfile.write(PAYLOAD[offset:min(end, offset + CHUNK)])
+            self.wfile.flush()
+            time.sleep(0.01)
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+def start_upstream(test, **options):
+    upstream = Upstream(**options)
+    thread = threading.Thread(target=upstream.serve_forever, daemon=True)
+    thread.start()
+    def stop():
+        upstream.shutdown()
+        thread.join()
+        upstream.server_close()
+    test.addCleanup(stop)
+    return upstream
+
+def read_all(reader, results, index):
+    try:
+        with reader:
+            parts = []
+            while True:
+                buf = reader.read(CHUNK // 3)
+                if not buf:
+                    break
+                parts.append(buf)
+        results[index] = b"".join(parts)
+    except IOError as e:
+        results[index] = e
+
+def run_readers(readers):
+    results = [None] * len(readers)
+    threads = [threading.Thread(target=read_all, args=(r, results, i)) for i, r in enumerate(readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(30)
+    return results
+
+class DownloadTest(unittest.TestCase):
+    def start(self, download):
+        errors = []
+        def run():
+            try:
+                download.run()
+            except IOError as e:
+                errors.append(e)
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.addCleanup(download.close)
+        self.addCleanup(thread.join)
+        return thread, errors
+
+    def test_tails(self):
+        upstream = start_upstream(self)
+        download = Download(upstream.url)
+        self.assertEqual(download.length, len(PAYLOAD))
+        self.assertEqual(download.etag, '"upstream"')
+        thread, errors = self.start(download)
+        fd = download.file.fileno()
+        results = run_readers([Tail(fd, download.length, download) for _ in range(4)])
+        thread.join(10)
+        self.assertEqual(results, [PAYLOAD] * 4)
+        self.assertEqual(upstream.hits, 1)
+        self.assertTrue(download.complete)
+        self.assertEqual(download.sha256, hashlib.sha256(PAYLOAD).digest())
+        self.assertEqual(errors, [])
+
+    def test_cut_short(self):
+        upstream = start_upstream(self, fail_at=len(PAYLOAD) // 2)
+        download = Download(upstream.url)
+        thread, errors = self.start(download)
+        fd = download.file.fileno()
+        results = run_readers([Tail(fd, download.length, download) for _ in range(2)])
+        thread.join(10)
+        for result in results:
+            self.assertIsInstance(result, IOError)
+        self.assertFalse(download.complete)
+        self.assertIsNotNone(download.error)
+        self.assertEqual(len(errors), 1)
+
+    def test_read_nowait(self):
+        upstream = start_upstream(self)
+        download = Download(upstream.url)
+        tail = Tail(download.file.fileno(), download.length, download)
+        self.addCleanup(tail.close)
+        # Nothing has been fetched yet.
+        self.assertIsNone(tail.read_nowait())
+        self.start(download)
+        download.wait(0)
+        self.assertTrue(tail.read_nowait())
+
+class PolledGrowthTest(unittest.TestCase):
+    def test_growing_file(self):
+        stopped = threading.Event()
+        with tempfile.TemporaryFile(buffering=0) as f:
+            def grow():
+                for offset in range(0, len(PAYLOAD), CHUNK):
+                    f.write(PAYLOAD[offset:offset + CHUNK])
+                    time.sleep(0.01)
+            writer = threading.Thread(target=grow)
+            writer.start()
+            source = PolledGrowth(f.fileno(), len(PAYLOAD), stopped.is_set)
+            results = run_readers([Tail(f.fileno(), len(PAYLOAD), source) for _ in range(3)])
+            writer.join()
+        self.assertEqual(results, [PAYLOAD] * 3)
+
+    def test_stopped(self):
+        stopped = threading.Event()
+        with tempfile.TemporaryFile(buffering=0) as f:
+            f.write(PAYLOAD[:CHUNK])
+            source = PolledGrowth(f.fileno(), len(PAYLOAD), stopped.is_set)
+            tail = Tail(f.fileno(), len(PAYLOAD), source)
+            threading.Timer(0.2, stopped.set).start()
+            results = run_readers([tail])
+        self.assertIsInstance(results[0], IOError)
+
+class RemoteFileTest(unittest.TestCase):
+    def fetch_all(self, server, path, clients):
+        # Raw connections, as a body cut short is part of what's checked.
+        def get():
+            conn = http.client.HTTPConnection("127.0.0.1", server.server_port, timeout=30)
+            try:
+                conn.request("GET", path)
+                response = conn.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, OSError) as e:
+                return None, e
+            finally:
+                conn.close()
+        results = [None] * clients
+        def run(i):
+            results[i] = get()
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(60)
+        return results
+
+    def check_shared(self, engine):
+        upstream = start_upstream(self)
+        server = start_server(self, engine)
+        f = server.serve([upstream.url])
+        self.assertTrue(f.wait(10))
+        results = self.fetch_all(server, "/%d" % f.fid, 4)
+        self.assertEqual(results, [(200, PAYLOAD)] * 4)
+        self.assertEqual(upstream.hits, 1)
+
+    def check_failed(self, engine):
+        upstream = start_upstream(self, fail_at=len(PAYLOAD) // 2)
+        server = start_server(self, engine)
+        f = server.serve([upstream.url])
+        self.assertTrue(f.wait(10))
+        for status, body in self.fetch_all(server, "/%d" % f.fid, 2):
+            self.assertNotEqual(body, PAYLOAD)
+        f.join(10)
+        self.assertTrue(f.failed)
+        self.assertNotIn(f.fid, server.files)
+        self.assertEqual(upstream.hits, 1)
+
+    def test_shared_threads(self):
+        self.check_shared("threads")
+
+    def test_shared_asyncio(self):
+        self.check_shared("asyncio")
+
+    def test_failed_threads(self):
+        self.check_failed("threads")
+
+    def test_failed_asyncio(self):
+        self.check_failed("asyncio")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+from email.utils import formatdate
+
+from platter.server import plan_response
+
+from .support import start_server, fetch
+
+MTIME = 1445412480
+ETAG = '"abc"'
+
+def fake_file(etag=ETAG):
+    server = SimpleNamespace(compress_transfers=False)
+    file = SimpleNamespace(
+        server=server, name="file.bin", size=1000, mtime=MTIME + 0.5, etag=etag,
+        digest=None, seekable=True, compressible=False, open=None,
+    )
+    file.snapshot = lambda: file
+    return file
+
+class PlanResponseTest(unittest.TestCase):
+    def plan(self, etag=ETAG, **headers):
+        response = plan_response(fake_file(etag), {k.replace("_", "-"): v for k, v in headers.items()})
+        return response.status, dict(response.headers)
+
+    def test_full(self):
+        status, headers = self.plan()
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["ETag"], ETAG)
+        self.assertEqual(headers["Last-Modified"], formatdate(MTIME + 0.5, usegmt=True))
+        self.assertEqual(headers["Content-Length"], 1000)
+        self.assertEqual(headers["Accept-Ranges"], "bytes")
+
+    def test_if_none_match(self):
+        cases = {
+            ETAG: 304,
+            "W/" + ETAG: 304,
+            '"other", ' + ETAG: 304,
+            "*": 304,
+            '"other"': 200,
+            '"abc-gzip"': 200,
+        }
+        for header, expected in cases.items():
+            status, headers = self.plan(If_None_Match=header)
+            self.assertEqual(status, expected, header)
+            if status == 304:
+                self.assertEqual(headers["ETag"], ETAG)
+                self.assertNotIn("Content-Length", headers)
+        self.assertEqual(self.plan(etag=None, If_None_Match="*")[0], 200)
+
+    def test_if_modified_since(self):
+        cases = {
+            formatdate(MTIME, usegmt=True): 304,
+            formatdate(MTIME + 60, usegmt=True): 304,
+            formatdate(MTIME - 1, usegmt=True): 200,
+            "yesterday": 200,
+        }
+        for header, expected in cases.items():
+            self.assertEqual(self.plan(If_Modified_Since=header)[0], expected, header)
+        # If-None-Match takes precedence.
+        status, _ = self.plan(If_None_Match='"other"', If_Modified_Since=formatdate(MTIME + 60, usegmt=True))
+        self.assertEqual(status, 200)
+
+    def test_range(self):
+        status, headers = self.plan(Range="bytes=0-99")
+        self.assertEqual(status, 206)
+        self.assertEqual(headers["Content-Range"], "bytes 0-99/1000")
+        self.assertEqual(headers["Content-Length"], 100)
+        status, headers = self.plan(Range="bytes=1000-")
+        self.assertEqual(status, 416)
+        self.assertEqual(headers["Content-Range"], "bytes */1000")
+
+    def test_if_range(self):
+        cases = {
+            ETAG: 206,
+            formatdate(MTIME, usegmt=True): 206,
+            # Falls back to sending the whole file.
+            '"other"': 200,
+            "W/" + ETAG: 200,
+            formatdate(MTIME - 1, usegmt=True): 200,
+            "yesterday": 200,
+        }
+        for header, expected in cases.items():
+            status, headers = self.plan(Range="bytes=0-99", If_Range=header)
+            self.assertEqual(status, expected, header)
+            self.assertEqual(headers["Content-Length"], 100 if expected == 206 else 1000)
+        self.assertEqual(self.plan(etag=None, Range="bytes=0-99", If_Range=ETAG)[0], 200)
+
+class DeletedFileTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.path = os.path.join(self.root, "file.bin")
+        with open(self.path, "wb") as f:
+            f.write(os.urandom(1024))
+
+    def check_deleted(self, engine):
+        server = start_server(self, engine)
+        f = server.serve([self.path])
+        f.wait()
+        etag = f.etag
+        os.unlink(self.path)
+        for method, headers in (("HEAD", {}), ("GET", {"If-None-Match": etag}), ("GET", {})):
+            status, _, _ = fetch(server, "/%d" % f.fid, method, headers)
+            self.assertEqual(status, 404, (method, headers))
+
+    def test_threads(self):
+        self.check_deleted("threads")
+
+    def test_asyncio(self):
+        self.check_deleted("asyncio")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import gc
+import os
+import time
+import weakref
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from platter.server import File, BundleFile, parse_fids, select_files
+
+from .support import start_server, fetch
+
+class ParseFidsTest(unittest.TestCase):
+    def test_fids(self):
+        cases = {
+            "/3": [(3, 3)],
+            "/1-5+9": [(1, 5), (9, 9)],
+            "/9+1-5": [(1, 5), (9, 9)],
+            "/1-3+4-6": [(1, 6)],
+            "/2-8+3-4+8": [(2, 8)],
+            "/1-1000000000": [(1, 1000000000)],
+        }
+        for path, intervals in cases.items():
+            self.assertEqual(parse_fids(path), intervals, path)
+
+    def test_invalid(self):
+        for path in ("/", "/0", "/-1", "/5-3", "/1-", "/1--2", "/a", "/1+", "/1+b", "/1-2-3"):
+            self.assertIsNone(parse_fids(path), path)
+
+    def test_select_files(self):
+        files = {fid: SimpleNamespace(fid=fid) for fid in (1, 2, 4, 7, 9, 12)}
+        selected = select_files(files, parse_fids("/9-20+2-4"))
+        self.assertEqual([f.fid for f in selected], [2, 4, 9, 12])
+
+class FailedArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        with open(os.path.join(self.root, "file"), "wb") as f:
+            f.write(b"data")
+
+    def check_failed(self, stream_archives):
+        server = start_server(self, stream_archives=stream_archives, timeout=30)
+        gone = os.path.join(self.root, "gone")
+        os.mkdir(gone)
+        os.rmdir(gone)
+        start = time.monotonic()
+        f = server.serve([os.path.join(self.root, "file"), gone])
+        status, _, _ = fetch(server, "/%d" % f.fid)
+        self.assertEqual(status, 404)
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertTrue(f.wait(5))
+        self.assertTrue(f.failed)
+        self.assertNotIn(f.fid, server.files)
+
+    def test_missing_directory(self):
+        self.check_failed(stream_archives=False)
+
+    def test_streaming_missing_directory(self):
+        self.check_failed(stream_archives=True)
+
+class BundleFileTest(unittest.TestCase):
+    def setUp(self):
+        self.files = [File(None, fid, "%d.bin" % fid) for fid in (1, 2)]
+
+    def test_abandoned(self):
+        bundle = weakref.ref(BundleFile(None, self.files))
+        gc.collect()
+        self.assertIsNone(bundle())
+        # Loading the members afterwards is harmless.
+        for f in self.files:
+            f._loaded.set()
+            f.trigger("load")
+
+    def test_waits_for_members(self):
+        bundle = BundleFile(None, self.files)
+        loads = []
+        bundle.on("load", lambda: loads.append(bundle.loaded))
+        self.files[0]._loaded.set()
+        self.files[0].trigger("load")
+        self.assertFalse(bundle.loaded)
+        self.files[1].failed = True
+        self.files[1]._loaded.set()
+        self.files[1].trigger("load")
+        self.assertEqual(loads, [True])
+        self.assertTrue(bundle.failed)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+import socket
+import time
+import unittest
+from unittest import mock
+
+from platter import throttle
+from platter.throttle import TokenBucket, Scheduler, REBALANCE_INTERVAL
+
+from .support import start_server, fetch
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class ClockTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch.object(throttle.time, "monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+class TokenBucketTest(ClockTest):
+    def test_unlimited(self):
+        bucket = TokenBucket()
+        self.assertEqual(bucket.reserve(1 << 30), 0)
+        self.assertEqual(bucket.usage(), (0, False))
+
+    def test_reserve(self):
+        bucket = TokenBucket(100000)
+        self.assertEqual(bucket.burst, 25000)
+        self.assertEqual(bucket.reserve(25000), 0)
+        self.assertAlmostEqual(bucket.reserve(10000), 0.1)
+        self.clock.now += 0.2
+        self.assertEqual(bucket.reserve(10000), 0)
+        self.assertEqual(bucket.usage(), (45000, True))
+        self.assertEqual(bucket.usage(), (0, False))
+
+    def test_burst_is_capped(self):
+        bucket = TokenBucket(100000)
+        self.clock.now += 60
+        self.assertEqual(bucket.reserve(25000), 0)
+        self.assertAlmostEqual(bucket.reserve(10000), 0.1)
+
+    def test_set_rate_keeps_debt(self):
+        bucket = TokenBucket(100000)
+        bucket.reserve(45000)
+        bucket.set_rate(200000)
+        self.assertAlmostEqual(bucket.reserve(0), 0.1)
+        bucket.set_rate(None)
+        self.assertEqual(bucket.reserve(1 << 30), 0)
+
+class SchedulerTest(ClockTest):
+    def run_transfers(self, scheduler, transfers, seconds=30, settle=5):
+        # Sends as fast as the scheduler allows, on the injected clock, and
+        # returns each transfer's rate once the shares have settled.
+        due = dict.fromkeys(transfers, self.clock.now)
+        sent = dict.fromkeys(transfers, 0)
+        start = self.clock.now
+        end = start + seconds
+        while True:
+            transfer = min(due, key=due.get)
+            self.clock.now = due[transfer]
+            if self.clock.now >= end:
+                break
+            nbytes = scheduler.chunk_size(transfer)
+            due[transfer] = self.clock.now + scheduler.delay(transfer, nbytes)
+            if self.clock.now >= start + settle:
+                sent[transfer] += nbytes
+        return {transfer: sent[transfer]/(seconds - settle) for transfer in transfers}
+
+    def assertRate(self, rate, expected):
+        self.assertLess(abs(rate - expected), expected*0.1, (rate, expected))
+
+    def test_global_rate_is_split(self):
+        scheduler = Scheduler(rate=300000)
+        transfers = [object() for _ in range(3)]
+        for i, transfer in enumerate(transfers):
+            scheduler.register(transfer, ("10.0.0.%d" % i, 1), object())
+        rates = self.run_transfers(scheduler, transfers)
+        for transfer in transfers:
+            self.assertRate(rates[transfer], 100000)
+        self.assertRate(sum(rates.values()), 300000)
+
+    def test_file_rate_surplus_is_shared(self):
+        scheduler = Scheduler(rate=300000)
+        files = [object() for _ in range(3)]
+        scheduler.set_file_rate(files[0], 50000)
+        transfers = [object() for _ in files]
+        for i, (transfer, file) in enumerate(zip(transfers, files)):
+            scheduler.register(transfer, ("10.0.0.%d" % i, 1), file)
+        rates = self.run_transfers(scheduler, transfers)
+        self.assertRate(rates[transfers[0]], 50000)
+        self.assertRate(rates[transfers[1]], 125000)
+        self.assertRate(rates[transfers[2]], 125000)
+
+    def test_weights(self):
+        scheduler = Scheduler(rate=300000)
+        files = [object(), object()]
+        scheduler.set_file_weight(files[0], 2)
+        transfers = [object(), object()]
+        for i, (transfer, file) in enumerate(zip(transfers, files)):
+            scheduler.register(transfer, ("10.0.0.%d" % i, 1), file)
+        rates = self.run_transfers(scheduler, transfers)
+        self.assertRate(rates[transfers[0]], 200000)
+        self.assertRate(rates[transfers[1]], 100000)
+
+    def test_unregister(self):
+        scheduler = Scheduler(rate=300000)
+        transfers = [object(), object()]
+        for i, transfer in enumerate(transfers):
+            scheduler.register(transfer, ("10.0.0.%d" % i, 1), object())
+        scheduler.unregister(transfers[0])
+        self.assertEqual(scheduler.delay(transfers[0], 1 << 20), 0)
+        self.clock.now += REBALANCE_INTERVAL
+        rates = self.run_transfers(scheduler, transfers[1:])
+        self.assertRate(rates[transfers[1]], 300000)
+
+class AdmissionTest(unittest.TestCase):
+    def check_admission(self, engine):
+        server = start_server(self, engine, max_transfers=1, max_queued=1)
+        # The first connection holds the only transfer slot and the second
+        # waits for it, neither sends a request.
+        held = []
+        for _ in range(2):
+            held.append(socket.create_connection(("127.0.0.1", server.server_port)))
+            time.sleep(0.2)
+        status, headers, _ = fetch(server, "/1")
+        self.assertEqual(status, 503)
+        self.assertIn("Retry-After", headers)
+        for sock in held:
+            sock.close()
+        # Retrying gets through once the held connections have been dropped.
+        deadline = time.monotonic() + 5
+        while status == 503 and time.monotonic() < deadline:
+            time.sleep(0.05)
+            status, _, _ = fetch(server, "/1")
+        self.assertEqual(status, 404)
+
+    def test_threads(self):
+        self.check_admission("threads")
+
+    def test_asyncio(self):
+        self.check_admission("asyncio")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import socket
+import shutil
+import tempfile
+import unittest
+
+from platter.upload import UPLOAD_PATH, upload_name, body_length, parse_chunk_size, BadRequest
+
+from .support import start_server
+
+class UploadNameTest(unittest.TestCase):
+    def test_names(self):
+        cases = {
+            UPLOAD_PATH + "/file.txt": "file.txt",
+            UPLOAD_PATH + "/my%20file.txt?x=1": "my file.txt",
+            UPLOAD_PATH + "/../../etc/x": "x",
+            UPLOAD_PATH + "/..%2F..%2Fetc%2Fx": "x",
+            UPLOAD_PATH + "/..%5C..%5Cwindows%5Cx": "x",
+            UPLOAD_PATH + "/.hidden": "hidden",
+            UPLOAD_PATH + "/ spaced ": "spaced",
+        }
+        for path, name in cases.items():
+            self.assertEqual(upload_name(path), name, path)
+
+    def test_rejected(self):
+        for path in ("/", "/file.txt", UPLOAD_PATH, UPLOAD_PATH + "/", UPLOAD_PATH + "/..",
+                     UPLOAD_PATH + "/dir/", UPLOAD_PATH + "/a%00b", UPLOAD_PATH + "/?name=x"):
+            self.assertIsNone(upload_name(path), path)
+
+class BodyLengthTest(unittest.TestCase):
+    def test_length(self):
+        self.assertEqual(body_length({"Content-Length": "0"}), 0)
+        self.assertEqual(body_length({"Content-Length": " 1234 "}), 1234)
+        self.assertIsNone(body_length({"Transfer-Encoding": "Chunked"}))
+        self.assertIsNone(body_length({"Transfer-Encoding": "gzip, chunked", "Content-Length": "5"}))
+
+    def test_invalid(self):
+        cases = [({}, 411), ({"Content-Length": "abc"}, 400), ({"Content-Length": "-1"}, 400),
+                 ({"Content-Length": ""}, 400), ({"Content-Length": "1.5"}, 400)]
+        for headers, status in cases:
+            with self.assertRaises(BadRequest, msg=headers) as cm:
+                body_length(headers)
+            self.assertEqual(cm.exception.status, status)
+
+class ParseChunkSizeTest(unittest.TestCase):
+    def test_sizes(self):
+        cases = {
+            b"0\r\n": 0,
+            b"a\r\n": 10,
+            b"FF\r\n": 255,
+            b"10;name=value\r\n": 16,
+            b" 1f \n": 31,
+        }
+        for line, size in cases.items():
+            self.assertEqual(parse_chunk_size(line), size, line)
+
+    def test_invalid(self):
+        for line in (b"", b"10", b"\r\n", b"xyz\r\n", b"-5\r\n", b";ext\r\n"):
+            with self.assertRaises(BadRequest, msg=line) as cm:
+                parse_chunk_size(line)
+            self.assertEqual(cm.exception.status, 400)
+
+class ChunkedUploadTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def upload(self, server, body, name="file.bin"):
+        # Sends a raw chunked PUT and returns the response's status.
+        with socket.create_connection(("127.0.0.1", server.server_port), timeout=10) as sock:
+            sock.sendall(
+                b"PUT %s/%s HTTP/1.1\r\nHost: localhost\r\nTransfer-Encoding: chunked\r\n\r\n"
+                % (UPLOAD_PATH.encode("ascii"), name.encode("ascii")) + body
+            )
+            response = sock.makefile("rb").readline()
+        return int(response.split()[1])
+
+    def uploaded(self):
+        files = {}
+        for name in os.listdir(self.root):
+            with open(os.path.join(self.root, name), "rb") as f:
+                files[name] = f.read()
+        return files
+
+    def check_chunked(self, engine):
+        server = start_server(self, engine, upload_dir=self.root)
+        cases = [
+            (b"5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n", b"hello world"),
+            (b"0\r\n\r\n", b""),
+            # Extensions, lowercase hex, a bare LF and a trailer.
+            (b"b;ext=1\r\nhello world\r\n0\nX-Trailer: yes\r\n\r\n", b"hello world"),
+        ]
+        for i, (body, data) in enumerate(cases):
+            name = "case%d" % i
+            self.assertEqual(self.upload(server, body, name), 201, body)
+            self.assertEqual(self.uploaded()[name], data)
+
+        bad = [
+            b"zz\r\nhello\r\n0\r\n\r\n",
+            # The chunk is longer than its size says.
+            b"3\r\nhello\r\n0\r\n\r\n",
+        ]
+        for body in bad:
+            self.assertEqual(self.upload(server, body, "bad"), 400, body)
+        # Nothing is left behind, not even a partial upload.
+        self.assertEqual(sorted(self.uploaded()), ["case0", "case1", "case2"])
+
+    def test_threads(self):
+        self.check_chunked("threads")
+
+    def test_asyncio(self):
+        self.check_chunked("asyncio")
+
+if __name__ == "__main__":
+    unittest.main()